@@ -0,0 +1,340 @@
+#!/usr/bin/python
+
+"""Run many plugin checks concurrently and report them as passive results"""
+
+# Reads one check per line, either a plugin command line or
+# host_name;service_description;command line, runs the checks concurrently in
+# one process and writes each result as soon as it completes, in Nagios
+# external command format so the output can go straight to the command file:
+#
+#   [1500000000] PROCESS_SERVICE_CHECK_RESULT;web1;HTTP;0;OK: expected 200, got 200
+#
+# Without a host_name and service_description the target host and the plugin
+# name are used. A line that cannot be parsed, i.e. with an unbalanced quote,
+# is reported as UNKNOWN rather than stopping the run.
+#
+# A large run must not burst hundreds of queries at one switch or web server,
+# and one slow target must not starve the others. Checks are queued per target
+# host and started round-robin across targets, subject to:
+#
+#   --max-inflight   checks running at once in total
+#   --host-inflight  checks running at once against one host
+#   --host-rate      checks started per second against one host, in bursts of
+#                    up to --host-burst
+#   --snmp-rate      SNMP requests per second sent to one agent, counting every
+#                    GETBULK page and retry, in bursts of up to --snmp-burst
+#
+# Checks run in threads of this process. With --processes, the CPU-bound
+# checks, of check_ping, check_procs, check_ssh and check_ssl and any using
+# SNMPv3, run in that many worker processes instead so a large run can use
+# every core of the poller.
+#
+# With --daemon the checks run over and over instead, each on an interval
+# that adapts to its results: steady checks are polled less often, up to
+# --max-interval, and warning or flapping ones every --min-interval. Due
+# times are jittered so the checks do not all fire on the same second.
+#
+# Example, feeding the results to Nagios as passive checks:
+#
+#   ./batch.py -f checks.txt -o /usr/local/nagios/var/rw/nagios.cmd
+#
+# checks.txt:
+#
+#   switch1;Load;check_load -H 10.0.0.1 -C secretpass -w 1,3,5 -c 5,7,9
+#   switch1;Interfaces;check_interfaces -H 10.0.0.1 -C secretpass -w 80 -c 95
+#   check_response_code -u http://www.example.com -r 200
+#
+# Checks are read as they are needed, at most QUEUE_WINDOW ahead of the ones
+# running, and results are written as they complete, so a run over 100k
+# targets needs no more memory than one over a few hundred.
+#
+
+from __future__ import print_function
+
+#  standard library imports
+import importlib
+import shlex
+import sys
+import time
+from collections import OrderedDict, deque, namedtuple
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# local application imports
+from multicall import PLUGINS, plugin_name
+from nagioslib.output import run_captured, thread_output
+from nagioslib.ratelimit import RateLimiter, limit_snmp
+from nagioslib.result import Result
+from nagioslib.schedule import Schedule
+from nagioslib.tls import enable_reuse
+from nagioslib.workers import ProcessCall
+
+
+Check = namedtuple('Check', 'host_name service plugin argv target error')
+
+# Most checks read ahead of those running, to schedule fairly across targets
+QUEUE_WINDOW = 4096
+
+
+def check_target(argv):
+    """
+    Return the host a plugin command line checks
+
+    :param argv: plugin arguments
+    """
+    for idx, arg in enumerate(argv[:-1]):
+        if arg in ('-H', '--host'):
+            return argv[idx + 1].lower()
+        if arg in ('-u', '--url'):
+            host = argv[idx + 1].split('://', 1)[-1].split('/', 1)[0]
+            return host.rsplit('@', 1)[-1].split(':', 1)[0].lower()
+    return ''
+
+
+def parse_check(line, number=0):
+    """
+    Return the Check for a line of input, or None for blank lines and
+    comments. A line that cannot be parsed gives a Check with no plugin and
+    the reason in its error, for run_check() to report as UNKNOWN.
+
+    :param line: plugin command line, optionally prefixed by
+                 host_name;service_description;
+    :param number: line number of the line in the input
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    fields = line.split(';', 2)
+    host_name, service, command = fields if len(fields) == 3 else (None, None, line)
+    try:
+        argv = shlex.split(command)
+    except ValueError as err:
+        error = str(err)
+    else:
+        error = None if argv else 'no command'
+    if error is not None:
+        error = 'cannot parse check line {0}: {1}'.format(number, error)
+        return Check(host_name or '', service or 'line {0}'.format(number), None, [], '',
+                     error)
+    plugin = plugin_name(argv[0])
+    target = check_target(argv[1:])
+    return Check(host_name or target, service or plugin, plugin, argv[1:], target, None)
+
+
+def read_checks(lines):
+    """
+    Yield the Check for each line of input that has one, importing each
+    plugin the first time it is seen so worker threads never race to
+
+    :param lines: iterable of lines of input
+    """
+    imported = set()
+    for number, line in enumerate(lines, 1):
+        check = parse_check(line, number)
+        if check is None:
+            continue
+        if check.plugin not in imported and check.plugin in PLUGINS:
+            importlib.import_module(check.plugin)
+            imported.add(check.plugin)
+        yield check
+
+
+def run_main(module, check):
+    """
+    Run a plugin's main function with a check's arguments
+
+    :param module: plugin module
+    :param check: Check to run
+    """
+    module.main(check.argv)
+
+
+def run_check(check, output, call=run_main):
+    """
+    Run a check in the calling thread and return its Result
+
+    :param check: Check to run
+    :param output: ThreadOutput installed as sys.stdout and sys.stderr
+    :param call: function called with the plugin module and the Check to run
+                 it
+    """
+    started = time.time()
+    if check.error is not None:
+        return Result(check, 3, 'UNKNOWN: {0}'.format(check.error), started, 0.0)
+    if check.plugin not in PLUGINS:
+        return Result(check, 3, 'UNKNOWN: no plugin named {0}'.format(check.plugin),
+                      started, 0.0)
+    code, text, _ = run_captured(output, call, importlib.import_module(check.plugin), check)
+    return Result(check, code, text.replace('\n', '\\n'), started,
+                  time.time() - started)
+
+
+def run_batch(checks, output, max_inflight, host_inflight, host_limiter, call=run_main):
+    """
+    Run checks concurrently and yield the Result of each as it completes
+
+    Checks are read up to QUEUE_WINDOW ahead and queued per target, and every
+    pass over the targets starts at most one check for each, the targets
+    served moving to the back, so a target with many or slow checks cannot
+    hold up the others. Targets are forgotten once they have nothing queued
+    or running, so memory use does not grow with the number of checks.
+
+    :param checks: iterable of Check, read as needed, which may also yield
+                   the seconds until it will have another check, i.e. a
+                   Schedule
+    :param output: ThreadOutput installed as sys.stdout and sys.stderr
+    :param max_inflight: most checks running at once
+    :param host_inflight: most checks running at once against one target
+    :param host_limiter: RateLimiter of checks started per target
+    :param call: function called with the plugin module and the Check to run
+                 it
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    pending = iter(checks)
+    queues = OrderedDict()
+    inflight = {}
+    done = queue.Queue()
+    queued = 0
+    running = 0
+
+    with ThreadPoolExecutor(max_inflight) as executor:
+        while True:
+            idle = None
+            while queued < QUEUE_WINDOW:
+                check = next(pending, None)
+                if check is None:
+                    break
+                if isinstance(check, float):
+                    idle = check
+                    break
+                queues.setdefault(check.target, deque()).append(check)
+                queued += 1
+            if not queues and not running and idle is None:
+                break
+
+            wait = idle
+            for target in list(queues):
+                if running >= max_inflight:
+                    break
+                if inflight.get(target, 0) >= host_inflight:
+                    continue
+                delay = host_limiter.take(target)
+                if delay:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+                check = queues[target].popleft()
+                if queues[target]:
+                    queues.move_to_end(target)
+                else:
+                    del queues[target]
+                inflight[target] = inflight.get(target, 0) + 1
+                queued -= 1
+                running += 1
+                executor.submit(run_check, check, output, call).add_done_callback(done.put)
+
+            try:
+                future = done.get(timeout=wait)
+            except queue.Empty:
+                continue
+            while future is not None:
+                result = future.result()
+                target = result.check.target
+                inflight[target] -= 1
+                if not inflight[target]:
+                    del inflight[target]
+                running -= 1
+                yield result
+                try:
+                    future = done.get_nowait()
+                except queue.Empty:
+                    future = None
+
+
+def do_argparser(argv=None):
+    """
+    Parse and return command line arguments
+
+    :param argv: arguments to parse instead of sys.argv
+    """
+    import argparse
+
+    file_help = 'Optional: file of checks, one per line, defaults to stdin'
+    output_help = 'Optional: file to append results to, i.e. the Nagios command file, defaults to stdout'
+    inflight_help = 'Optional: most checks running at once, defaults to 32'
+    host_inflight_help = 'Optional: most checks running at once against one host, defaults to 2'
+    host_rate_help = 'Optional: checks started per second against one host, defaults to 5'
+    host_burst_help = 'Optional: checks started at once against one host, defaults to 5'
+    snmp_rate_help = 'Optional: SNMP requests per second sent to one agent, defaults to 20'
+    snmp_burst_help = 'Optional: SNMP requests sent at once to one agent, defaults to 10'
+    processes_help = 'Optional: worker processes for CPU-bound checks, defaults to 0, running every check in this process'
+    daemon_help = 'Optional: run the checks over and over on adaptive intervals instead of once'
+    interval_help = 'Optional: seconds between runs of a new or recovering check in daemon mode, defaults to 300'
+    min_interval_help = 'Optional: seconds between runs of a warning or flapping check in daemon mode, defaults to 60'
+    max_interval_help = 'Optional: most seconds between runs of a steady check in daemon mode, defaults to 3600'
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--file', help=file_help, required=False)
+    parser.add_argument('-o', '--output', help=output_help, required=False)
+    parser.add_argument('-j', '--max-inflight', help=inflight_help, type=int,
+                        default=32)
+    parser.add_argument('--host-inflight', help=host_inflight_help, type=int,
+                        default=2)
+    parser.add_argument('--host-rate', help=host_rate_help, type=float, default=5.0)
+    parser.add_argument('--host-burst', help=host_burst_help, type=float, default=5.0)
+    parser.add_argument('--snmp-rate', help=snmp_rate_help, type=float, default=20.0)
+    parser.add_argument('--snmp-burst', help=snmp_burst_help, type=float, default=10.0)
+    parser.add_argument('--processes', help=processes_help, type=int, default=0)
+    parser.add_argument('--daemon', help=daemon_help, action='store_true')
+    parser.add_argument('-i', '--interval', help=interval_help, type=float,
+                        default=300.0)
+    parser.add_argument('--min-interval', help=min_interval_help, type=float,
+                        default=60.0)
+    parser.add_argument('--max-interval', help=max_interval_help, type=float,
+                        default=3600.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Main function
+
+    :param argv: command line arguments to use instead of sys.argv
+    """
+    args = do_argparser(argv)
+
+    source = open(args.file) if args.file else sys.stdin
+    checks = read_checks(source)
+    schedule = None
+    if args.daemon:
+        schedule = checks = Schedule(list(checks), args.interval,
+                                     args.min_interval, args.max_interval)
+    limit_snmp(args.snmp_rate, args.snmp_burst)
+    enable_reuse()
+    host_limiter = RateLimiter(args.host_rate, args.host_burst)
+    call = run_main
+    if args.processes > 0:
+        call = ProcessCall(args.processes, run_main, args.host_inflight,
+                           args.snmp_rate, args.snmp_burst)
+    out = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        with thread_output() as output:
+            for result in run_batch(checks, output, args.max_inflight,
+                                    args.host_inflight, host_limiter, call):
+                out.write(result.command())
+                out.flush()
+                if schedule is not None:
+                    schedule.report(result.check, result.code)
+    finally:
+        source.close()
+        if args.output:
+            out.close()
+        if call is not run_main:
+            call.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,886 @@
+#!/usr/bin/python
+
+"""Benchmark the plugins against local stand-in services"""
+
+# Starts local stand-ins for everything the plugins talk to and measures
+# checks/sec, p50/p99 latency and peak RSS for each plugin:
+#
+#   * an SNMP v2c command responder (pysnmp) serving the load, users, uptime
+#     and hrSystemDate OIDs, hrProcessorTable, hrStorageTable, hrSWRunTable
+#     and an IF-MIB interface table
+#   * an SNMPv3 agent (pysnmp) serving the same table to an authPriv user
+#   * an HTTP server
+#   * a TLS server with a freshly generated self-signed certificate
+#   * a TCP server sending an SSH banner
+#   * loopback ICMP
+#
+# Each plugin is measured in its own worker process so peak RSS figures are
+# not polluted by other plugins. Modes:
+#
+#   oneshot    a new interpreter per check, the way Nagios runs the plugins
+#   inprocess  main() called repeatedly in one interpreter
+#   batch      the checks run concurrently through batch.run_batch, as
+#              batch.py runs a check file
+#   daemon     a few checks run over and over through batch.run_batch and a
+#              Schedule with no interval, as batch.py --daemon runs them
+#
+# In the batch and daemon modes checks/sec is the throughput of the whole run
+# and the latencies are those of each check. All checks go to the one
+# stand-in host, so the per-host limits are lifted to BATCH_INFLIGHT.
+#
+# --imports instead checks that importing each plugin stays cheap: it fails if
+# a plugin pulls in argparse, pysnmp, requests, ssl or other heavy modules at
+# import time, or if an import takes longer than --import-budget ms.
+#
+# --matching instead times check_procs counting 34 patterns over 3000 distinct
+# command lines, and fails if that takes longer than --match-budget ms.
+#
+# --batch-rss instead streams batch runs of increasing numbers of checks
+# against distinct loopback targets through batch.py and reports the peak RSS
+# of each, which should stay flat however many targets there are.
+#
+# --snmp-loss and --snmp-delay make the SNMP v2c stand-in drop and delay
+# requests like a lossy WAN link, to measure tail latency.
+#
+# Save results with --json and compare a later run against them with
+# --baseline to catch regressions, i.e.
+#
+#   ./benchmark.py -n 50 --json before.json
+#   ./benchmark.py -n 50 --baseline before.json
+#
+# REQUIRES: pysnmp for the SNMP stand-in (SNMP plugins are skipped without it)
+# and the openssl command line tool for the TLS stand-in.
+
+from __future__ import print_function
+
+#  standard library imports
+import argparse
+import bisect
+import contextlib
+import importlib
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import socketserver
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    import SocketServer as socketserver
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+try:
+    from shlex import quote as shlex_quote
+except ImportError:
+    from pipes import quote as shlex_quote
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SNMP_COMMUNITY = 'public'
+SNMP_V3_AUTH = ['-U', 'nagios', '-A', 'benchmark-auth', '-X', 'benchmark-priv',
+                '--authproto', 'SHA256', '--privproto', 'AES']
+SSH_BANNER = b'SSH-2.0-OpenSSH_7.4 benchmark\r\n'
+
+# Command lines for each plugin, formatted with the stand-in ports; a :suffix
+# labels another command line for the same plugin
+PLUGINS = [
+    ('check_load', ['-H', '127.0.0.1', '-p', '{snmp}', '-C', SNMP_COMMUNITY,
+                    '-w', '5,5,5', '-c', '9,9,9', '-n', '--cpu-critical', '99']),
+    ('check_users', ['-H', '127.0.0.1', '-p', '{snmp}', '-C', SNMP_COMMUNITY,
+                     '-w', '10', '-c', '20']),
+    ('check_uptime', ['-H', '127.0.0.1', '-p', '{snmp}', '-C', SNMP_COMMUNITY,
+                      '-w', '1', '-c', '0', '-o', 'lt', '-t', 'day']),
+    ('check_time', ['-H', '127.0.0.1', '-p', '{snmp}', '-C', SNMP_COMMUNITY,
+                    '-w', '1', '-c', '5']),
+    ('check_interfaces', ['-H', '127.0.0.1', '-p', '{snmp}', '-C', SNMP_COMMUNITY,
+                          '-w', '80', '-c', '95']),
+    ('check_storage', ['-H', '127.0.0.1', '-p', '{snmp}', '-C', SNMP_COMMUNITY,
+                       '-w', '80', '-c', '90', '-e', '^/run']),
+    ('check_procs', ['-H', '127.0.0.1', '-p', '{snmp}', '-C', SNMP_COMMUNITY,
+                     '-m', 'sshd=^sshd', '-m', 'web=httpd', '-m', 'db=^postgres',
+                     '-m', 'cron=crond', '-w', '1:200']),
+    ('check_users:v3', ['-H', '127.0.0.1', '-p', '{snmpv3}'] + SNMP_V3_AUTH +
+     ['-w', '10', '-c', '20']),
+    ('check_storage:v3', ['-H', '127.0.0.1', '-p', '{snmpv3}'] + SNMP_V3_AUTH +
+     ['-w', '80', '-c', '90', '-e', '^/run']),
+    ('check_ping', ['-H', '127.0.0.1', '-w', '10,100', '-c', '20,200',
+                    '-p', '1', '-t', '1']),
+    ('check_tcp_port', ['-H', '127.0.0.1', '-p', '{http}']),
+    ('check_response_code', ['-u', 'http://127.0.0.1:{http}/', '-r', '200']),
+    ('check_ssl', ['-H', 'localhost', '-p', '{tls}', '-w', '30', '-c', '10']),
+    ('check_ssh', ['-H', '127.0.0.1', '-p', '{ssh}']),
+]
+
+MODES = ('oneshot', 'inprocess', 'batch', 'daemon')
+
+# Checks running at once in the batch and daemon modes, and the number of
+# checks the daemon mode schedules
+BATCH_INFLIGHT = 8
+
+# Modules that must only be imported at the point of use
+HEAVY_MODULES = ('argparse', 'pysnmp', 'pyasn1', 'requests', 'urllib3', 'ssl',
+                 'telnetlib', 'subprocess')
+
+IMPORT_PROBE = '''
+import json, sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+__import__(sys.argv[1])
+elapsed = time.perf_counter() - start
+print(json.dumps({'ms': elapsed * 1000, 'modules': sorted(set(sys.modules) - before)}))
+'''
+
+
+def build_mib_table(pmod):
+    """
+    Return a dict of OID tuples to values served by the SNMP stand-in. Values
+    may be callables returning the value, for counters that move over time
+
+    :param pmod: pysnmp protocol module to build the values with
+    """
+    start = time.time()
+    now = time.gmtime()
+    host_date = pmod.OctetString(hexValue='{0:04x}{1:02x}{2:02x}{3:02x}{4:02x}{5:02x}002b0000'.format(
+        now.tm_year, now.tm_mon, now.tm_mday, now.tm_hour, now.tm_min, now.tm_sec))
+    table = {
+        # UCD-SNMP-MIB::laLoad.1-3
+        (1, 3, 6, 1, 4, 1, 2021, 10, 1, 3, 1): pmod.OctetString('0.42'),
+        (1, 3, 6, 1, 4, 1, 2021, 10, 1, 3, 2): pmod.OctetString('0.35'),
+        (1, 3, 6, 1, 4, 1, 2021, 10, 1, 3, 3): pmod.OctetString('0.30'),
+        # HOST-RESOURCES-MIB::hrSystemUptime, hrSystemDate, hrSystemNumUsers
+        (1, 3, 6, 1, 2, 1, 25, 1, 1, 0): pmod.TimeTicks(8640000 * 12),
+        (1, 3, 6, 1, 2, 1, 25, 1, 2, 0): host_date,
+        (1, 3, 6, 1, 2, 1, 25, 1, 5, 0): pmod.Gauge32(3),
+    }
+
+    def counter(cls, rate):
+        """Return a callable counter increasing by rate per second"""
+        return lambda: cls(int((time.time() - start) * rate) % (2 ** 32 if cls is pmod.Counter32 else 2 ** 64))
+
+    # HOST-RESOURCES-MIB::hrProcessorLoad for 8 cores
+    for index in range(8):
+        table[(1, 3, 6, 1, 2, 1, 25, 3, 3, 1, 2, 196608 + index)] = pmod.Integer(5 + index * 11)
+
+    # HOST-RESOURCES-MIB::hrStorageTable with memory and four filesystems
+    storage = ((1, 2, 'Physical memory', 1024, 16000000, 9000000),
+               (3, 3, 'Virtual memory', 1024, 20000000, 9500000),
+               (31, 4, '/', 4096, 25000000, 11000000),
+               (32, 4, '/boot', 1024, 500000, 120000),
+               (33, 4, '/var', 4096, 50000000, 20000000),
+               (36, 4, '/run', 4096, 400000, 1000))
+    for index, kind, descr, units, size, used in storage:
+        entry = (1, 3, 6, 1, 2, 1, 25, 2, 3, 1)
+        table[entry + (1, index)] = pmod.Integer(index)
+        table[entry + (2, index)] = pmod.ObjectIdentifier((1, 3, 6, 1, 2, 1, 25, 2, 1, kind))
+        table[entry + (3, index)] = pmod.OctetString(descr)
+        table[entry + (4, index)] = pmod.Integer(units)
+        table[entry + (5, index)] = pmod.Integer(size)
+        table[entry + (6, index)] = pmod.Integer(used)
+
+    # HOST-RESOURCES-MIB::hrSWRunTable with a thousand processes
+    procs = [('systemd', '--switched-root --system'), ('sshd', '-D'),
+             ('postgres', '-D /var/lib/pgsql/data'), ('crond', '-n')]
+    procs += [('httpd', '-DFOREGROUND')] * 150
+    procs += [('postgres', 'postgres: worker {0}'.format(i)) for i in range(50)]
+    procs += [('kworker/{0}:1'.format(i), '') for i in range(1000 - len(procs))]
+    for index, (name, params) in enumerate(procs, 1):
+        entry = (1, 3, 6, 1, 2, 1, 25, 4, 2, 1)
+        table[entry + (2, index)] = pmod.OctetString(name)
+        table[entry + (5, index)] = pmod.OctetString(params)
+
+    # IF-MIB ifTable and ifXTable for 48 gigabit interfaces
+    for index in range(1, 49):
+        if_table = (1, 3, 6, 1, 2, 1, 2, 2, 1)
+        if_x_table = (1, 3, 6, 1, 2, 1, 31, 1, 1, 1)
+        table[if_table + (8, index)] = pmod.Integer(1 if index % 8 else 2)
+        table[if_table + (13, index)] = counter(pmod.Counter32, 0)
+        table[if_table + (14, index)] = counter(pmod.Counter32, index % 3)
+        table[if_table + (19, index)] = counter(pmod.Counter32, 0)
+        table[if_table + (20, index)] = counter(pmod.Counter32, 0)
+        table[if_x_table + (1, index)] = pmod.OctetString('Gi0/{0}'.format(index))
+        table[if_x_table + (6, index)] = counter(pmod.Counter64, index * 1000000)
+        table[if_x_table + (10, index)] = counter(pmod.Counter64, index * 500000)
+        table[if_x_table + (15, index)] = pmod.Gauge32(1000)
+    return table
+
+
+class SNMPResponder(threading.Thread):
+    """
+    Minimal SNMP v1/v2c command responder answering GET, GETNEXT and GETBULK
+    requests from a static table, optionally over a simulated lossy link
+
+    :param community: SNMP community the responder accepts
+    :param loss: fraction of requests to drop
+    :param delay: seconds to delay each response by
+    """
+    def __init__(self, community, loss=0.0, delay=0.0):
+        super(SNMPResponder, self).__init__()
+        from pysnmp.proto import api
+        from pyasn1.codec.ber import decoder, encoder
+        self.daemon = True
+        self.api = api
+        self.decoder = decoder
+        self.encoder = encoder
+        self.community = community
+        self.loss = loss
+        self.delay = delay
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        self.table = build_mib_table(api.protoModules[api.protoVersion2c])
+        self.oids = sorted(self.table)
+
+    def next_oid(self, oid):
+        """Return the first OID in the table after the given one, or None"""
+        idx = bisect.bisect_right(self.oids, tuple(oid))
+        if idx < len(self.oids):
+            return self.oids[idx]
+        return None
+
+    def next_var_bind(self, pmod, oid):
+        """Return the GETNEXT var-bind for an OID"""
+        next_oid = self.next_oid(oid)
+        if next_oid is None:
+            return oid, pmod.EndOfMibView() if hasattr(pmod, 'EndOfMibView') else pmod.Null()
+        return pmod.ObjectIdentifier(next_oid), self.value(next_oid)
+
+    def value(self, oid):
+        """Return the value of an OID in the table, or None"""
+        val = self.table.get(oid)
+        if callable(val):
+            val = val()
+        return val
+
+    def respond(self, msg):
+        """Return the encoded response to an encoded request, or None"""
+        api = self.api
+        version = int(api.decodeMessageVersion(msg))
+        pmod = api.protoModules[version]
+        req_msg, _ = self.decoder.decode(msg, asn1Spec=pmod.Message())
+        if str(pmod.apiMessage.getCommunity(req_msg)) != self.community:
+            return None
+        rsp_msg = pmod.apiMessage.getResponse(req_msg)
+        req_pdu = pmod.apiMessage.getPDU(req_msg)
+        rsp_pdu = pmod.apiMessage.getPDU(rsp_msg)
+        req_binds = pmod.apiPDU.getVarBinds(req_pdu)
+
+        var_binds = []
+        if req_pdu.isSameTypeWith(pmod.GetRequestPDU()):
+            for oid, _ in req_binds:
+                val = self.value(tuple(oid))
+                if val is None:
+                    val = pmod.NoSuchInstance() if hasattr(pmod, 'NoSuchInstance') else pmod.Null()
+                var_binds.append((oid, val))
+        elif req_pdu.isSameTypeWith(pmod.GetNextRequestPDU()):
+            var_binds = [self.next_var_bind(pmod, oid) for oid, _ in req_binds]
+        elif version and req_pdu.isSameTypeWith(pmod.GetBulkRequestPDU()):
+            non_rep = int(pmod.apiBulkPDU.getNonRepeaters(req_pdu))
+            max_rep = int(pmod.apiBulkPDU.getMaxRepetitions(req_pdu))
+            var_binds = [self.next_var_bind(pmod, oid) for oid, _ in req_binds[:non_rep]]
+            cursors = [oid for oid, _ in req_binds[non_rep:]]
+            for _ in range(max_rep):
+                row = [self.next_var_bind(pmod, oid) for oid in cursors]
+                var_binds.extend(row)
+                cursors = [oid for oid, _ in row]
+                if all(self.next_oid(oid) is None for oid in cursors):
+                    break
+        else:
+            return None
+
+        pmod.apiPDU.setVarBinds(rsp_pdu, var_binds)
+        return self.encoder.encode(rsp_msg)
+
+    def run(self):
+        while True:
+            msg, addr = self.sock.recvfrom(65535)
+            if random.random() < self.loss:
+                continue
+            try:
+                rsp = self.respond(msg)
+            except Exception: # pylint: disable=I0011,W0703
+                continue
+            if rsp and self.delay:
+                threading.Timer(self.delay, self.sock.sendto, (rsp, addr)).start()
+            elif rsp:
+                self.sock.sendto(rsp, addr)
+
+
+class SNMPv3Agent(threading.Thread):
+    """
+    SNMPv3 agent answering GET, GETNEXT and GETBULK requests of one authPriv
+    user from the table of an SNMPResponder
+
+    :param responder: SNMPResponder whose table is served
+    :param argv: SNMPv3 plugin arguments naming the user, passwords and protocols
+    """
+    def __init__(self, responder, argv):
+        super(SNMPv3Agent, self).__init__()
+        from pysnmp.carrier.asyncore.dgram import udp
+        from pysnmp.entity import config, engine
+        from pysnmp.entity.rfc3413 import cmdrsp, context
+        from pysnmp.proto.api import v2c
+        from pysnmp.smi import instrum
+        sys.path.insert(0, HERE)
+        from nagioslib.snmp import AUTH_PROTOCOLS, PRIV_PROTOCOLS
+
+        opts = dict(zip(argv[::2], argv[1::2]))
+        self.daemon = True
+        self.engine = engine.SnmpEngine()
+        transport = udp.UdpSocketTransport().openServerMode(('127.0.0.1', 0))
+        config.addTransport(self.engine, udp.domainName, transport)
+        self.port = transport.socket.getsockname()[1]
+        config.addV3User(self.engine, opts['-U'],
+                         getattr(config, AUTH_PROTOCOLS[opts['--authproto']]), opts['-A'],
+                         getattr(config, PRIV_PROTOCOLS[opts['--privproto']]), opts['-X'])
+        config.addVacmUser(self.engine, 3, opts['-U'], 'authPriv', (1, 3, 6))
+
+        class TableInstrum(instrum.AbstractMibInstrumController):
+            """MIB instrumentation reading the responder's table"""
+            def readVars(self, varBinds, acInfo=(None, None)): # pylint: disable=I0011,C0103
+                values = [(oid, responder.value(tuple(oid))) for oid, _ in varBinds]
+                return [(oid, v2c.NoSuchInstance() if val is None else val)
+                        for oid, val in values]
+
+            def readNextVars(self, varBinds, acInfo=(None, None)): # pylint: disable=I0011,C0103
+                return [responder.next_var_bind(v2c, oid) for oid, _ in varBinds]
+
+        snmp_context = context.SnmpContext(self.engine)
+        snmp_context.unregisterContextName(v2c.OctetString(''))
+        snmp_context.registerContextName(v2c.OctetString(''), TableInstrum())
+        for responder_class in (cmdrsp.GetCommandResponder, cmdrsp.NextCommandResponder,
+                                cmdrsp.BulkCommandResponder):
+            responder_class(self.engine, snmp_context)
+
+    def run(self):
+        self.engine.transportDispatcher.jobStarted(1)
+        self.engine.transportDispatcher.runDispatcher()
+
+
+class HTTPHandler(BaseHTTPRequestHandler):
+    """Answer every GET with a small 200 response"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self): # pylint: disable=I0011,C0103
+        """Handle a GET request"""
+        body = b'OK\n'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): # pylint: disable=I0011,W0221
+        pass
+
+
+class TLSHandler(socketserver.BaseRequestHandler):
+    """Complete a TLS handshake then close the connection"""
+    def handle(self):
+        try:
+            tls_sock = self.server.context.wrap_socket(self.request, server_side=True)
+            tls_sock.close()
+        except (ssl.SSLError, socket.error):
+            pass
+
+
+class BannerHandler(socketserver.BaseRequestHandler):
+    """Send an SSH banner then close the connection"""
+    def handle(self):
+        try:
+            self.request.sendall(SSH_BANNER)
+        except socket.error:
+            pass
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Threaded TCP server that doesn't block shutdown on its handlers"""
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server that doesn't block shutdown on its handlers"""
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def serve(server):
+    """Serve a socketserver in a daemon thread and return its port"""
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server.server_address[1]
+
+
+def make_cert(workdir):
+    """
+    Return the paths of a generated self-signed certificate and key for
+    localhost
+
+    :param workdir: directory to write the certificate and key to
+    """
+    cert = os.path.join(workdir, 'cert.pem')
+    key = os.path.join(workdir, 'key.pem')
+    subprocess.check_call(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '365',
+         '-keyout', key, '-out', cert, '-subj', '/CN=localhost',
+         '-addext', 'subjectAltName=DNS:localhost'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert, key
+
+
+def start_standins(workdir, snmp_loss=0.0, snmp_delay=0.0):
+    """
+    Start the stand-in services and return a dict of their ports and the
+    environment plugins need to trust the stand-in certificate
+
+    :param workdir: scratch directory for generated files
+    :param snmp_loss: fraction of SNMP v2c requests to drop
+    :param snmp_delay: seconds to delay SNMP v2c responses by
+    """
+    ports = {}
+    env = {'NAGIOS_PLUGIN_STATE_DIR': os.path.join(workdir, 'state')}
+    try:
+        responder = SNMPResponder(SNMP_COMMUNITY, snmp_loss, snmp_delay)
+    except ImportError:
+        print('pysnmp not installed, skipping SNMP plugins', file=sys.stderr)
+    else:
+        responder.start()
+        ports['snmp'] = responder.port
+        agent = SNMPv3Agent(responder, SNMP_V3_AUTH)
+        agent.start()
+        ports['snmpv3'] = agent.port
+
+    ports['http'] = serve(ThreadingHTTPServer(('127.0.0.1', 0), HTTPHandler))
+    ports['ssh'] = serve(ThreadingTCPServer(('127.0.0.1', 0), BannerHandler))
+
+    try:
+        cert, key = make_cert(workdir)
+    except (OSError, subprocess.CalledProcessError):
+        print('openssl not available, skipping check_ssl', file=sys.stderr)
+    else:
+        tls_server = ThreadingTCPServer(('127.0.0.1', 0), TLSHandler)
+        tls_server.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        tls_server.context.load_cert_chain(cert, key)
+        ports['tls'] = serve(tls_server)
+        env['SSL_CERT_FILE'] = cert
+    return ports, env
+
+
+def percentile(values, pct):
+    """Return the nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    idx = int(round(pct / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(idx, len(values) - 1))]
+
+
+def run_oneshot(plugin, argv, count):
+    """
+    Run a plugin as a new process count times and return latencies, exit
+    codes, the peak RSS of any one run in KB and the seconds the runs took
+    """
+    cmd = [sys.executable, os.path.join(HERE, plugin.split(':')[0] + '.py')] + argv
+    latencies = []
+    codes = {}
+    peak_rss = 0
+    for _ in range(count):
+        start = time.time()
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _, status, usage = os.wait4(proc.pid, 0)
+        latencies.append(time.time() - start)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        codes[proc.returncode] = codes.get(proc.returncode, 0) + 1
+        peak_rss = max(peak_rss, usage.ru_maxrss)
+    return latencies, codes, peak_rss, sum(latencies)
+
+
+def run_inprocess(plugin, argv, count):
+    """
+    Call a plugin's main() count times in this process and return
+    latencies, exit codes, the peak RSS of this process in KB and the seconds
+    the calls took
+    """
+    sys.path.insert(0, HERE)
+    module = importlib.import_module(plugin.split(':')[0])
+    latencies = []
+    codes = {}
+    # one untimed run so imports and first-use setup are not counted
+    for i in range(count + 1):
+        sys.argv = [plugin] + argv
+        start = time.time()
+        code = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                module.main()
+            except SystemExit as err:
+                code = err.code
+            except Exception as err: # pylint: disable=I0011,W0703
+                code = type(err).__name__
+        if i:
+            latencies.append(time.time() - start)
+            codes[code] = codes.get(code, 0) + 1
+    return (latencies, codes, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            sum(latencies))
+
+
+def run_checks(checks, count):
+    """
+    Run checks through batch.run_batch until count have completed and return
+    their latencies, exit codes, the peak RSS of this process in KB and the
+    seconds the run took
+
+    :param checks: iterable of Check, or a Schedule of them
+    :param count: number of results to collect
+    """
+    from batch import run_batch
+    from nagioslib.output import thread_output
+    from nagioslib.ratelimit import RateLimiter
+
+    latencies = []
+    codes = {}
+    with thread_output() as output:
+        start = time.time()
+        results = run_batch(checks, output, BATCH_INFLIGHT, BATCH_INFLIGHT,
+                            RateLimiter(1e9, BATCH_INFLIGHT))
+        for result in results:
+            latencies.append(result.elapsed)
+            codes[result.code] = codes.get(result.code, 0) + 1
+            if hasattr(checks, 'report'):
+                checks.report(result.check, result.code)
+            if len(latencies) == count:
+                break
+        results.close()
+        seconds = time.time() - start
+    return latencies, codes, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, seconds
+
+
+def batch_checks(plugin, argv, count):
+    """
+    Return count Checks of a plugin command line, imported and run once
+    untimed so imports and first-use setup are not counted
+
+    :param plugin: plugin name, optionally with a :suffix
+    :param argv: plugin arguments
+    :param count: number of checks
+    """
+    sys.path.insert(0, HERE)
+    from batch import parse_check, read_checks
+
+    line = ' '.join(shlex_quote(arg) for arg in [plugin.split(':')[0]] + argv)
+    run_checks(list(read_checks([line])), 1)
+    return [parse_check(line) for _ in range(count)]
+
+
+def run_batch_mode(plugin, argv, count):
+    """
+    Run count checks of a plugin concurrently through batch.run_batch and
+    return what run_checks() does
+
+    :param plugin: plugin name, optionally with a :suffix
+    :param argv: plugin arguments
+    :param count: number of checks
+    """
+    return run_checks(batch_checks(plugin, argv, count), count)
+
+
+def run_daemon(plugin, argv, count):
+    """
+    Run BATCH_INFLIGHT checks of a plugin over and over through a Schedule
+    with no interval until count have completed and return what run_checks()
+    does
+
+    :param plugin: plugin name, optionally with a :suffix
+    :param argv: plugin arguments
+    :param count: number of results to collect
+    """
+    from nagioslib.schedule import Schedule
+
+    checks = batch_checks(plugin, argv, min(count, BATCH_INFLIGHT))
+    return run_checks(Schedule(checks, 0.0, 0.0, 0.0), count)
+
+
+RUNNERS = {
+    'oneshot': run_oneshot,
+    'inprocess': run_inprocess,
+    'batch': run_batch_mode,
+    'daemon': run_daemon,
+}
+
+
+def worker(plugin, mode, count, ports):
+    """Benchmark one plugin in one mode and print the result as JSON"""
+    argv = dict(PLUGINS)[plugin]
+    argv = [arg.format(**ports) for arg in argv]
+    wall = time.time()
+    latencies, codes, peak_rss, seconds = RUNNERS[mode](plugin, argv, count)
+    wall = time.time() - wall
+    latencies.sort()
+    print(json.dumps({
+        'plugin': plugin,
+        'mode': mode,
+        'count': count,
+        'checks_per_sec': round(len(latencies) / seconds, 2) if seconds else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'peak_rss_mb': round(peak_rss / 1024.0, 2),
+        'wall_sec': round(wall, 3),
+        'exit_codes': dict((str(k), v) for k, v in codes.items()),
+    }))
+
+
+def spawn_worker(plugin, mode, count, ports, env):
+    """Run worker() in a fresh interpreter and return its parsed result"""
+    cmd = [sys.executable, os.path.abspath(__file__), '--worker', plugin,
+           '--mode', mode, '-n', str(count), '--ports', json.dumps(ports)]
+    output = subprocess.check_output(cmd, env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def check_imports(modules, budget):
+    """
+    Print the import time and any heavy modules pulled in by importing each
+    module, returning the number of modules over budget or importing heavy
+    dependencies
+
+    :param modules: names of the modules to import
+    :param budget: allowed import time in milliseconds
+    """
+    failures = 0
+    row = '{0:<20} {1:>8}  {2}'
+    print(row.format('module', 'ms', 'heavy imports'))
+    for name in modules:
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_PROBE, name], cwd=HERE)
+        probe = json.loads(output.decode())
+        heavy = sorted(set(mod for mod in probe['modules']
+                           if mod.split('.')[0] in HEAVY_MODULES))
+        status = ''
+        if heavy or probe['ms'] > budget:
+            failures += 1
+            status = 'FAIL '
+        print(row.format(name, round(probe['ms'], 2), status + ', '.join(heavy)))
+    return failures
+
+
+def check_matching(budget, patterns=34, lines=3000):
+    """
+    Print the time check_procs takes to count the processes matching a number
+    of patterns, returning 1 if it is over budget and 0 otherwise
+
+    :param budget: allowed time in milliseconds
+    :param patterns: number of patterns
+    :param lines: number of distinct command lines
+    """
+    sys.path.insert(0, HERE)
+    from collections import Counter
+    import check_procs
+
+    rand = random.Random(1)
+    names = ['sshd', 'httpd', 'postgres', 'crond', 'java', 'python3', 'nginx',
+             'redis-server', 'systemd', 'bash', 'rsyslogd', 'dockerd']
+    command_lines = Counter('{0} -D --opt={1} /var/lib/{0}/{2}'.format(
+        rand.choice(names), idx, rand.randint(0, 9999)) for idx in range(lines))
+    regexes = ['^sshd', 'httpd', '^postgres', 'crond', r'java .*-D', 'nginx',
+               'redis', '^docker', r'\d+$', '^python3 .*opt=1']
+    _, matchers = check_procs.parse_patterns(
+        ['m{0}={1}'.format(idx, regexes[idx % len(regexes)]) for idx in range(patterns)])
+    start = time.perf_counter()
+    check_procs.count_matches(command_lines, matchers)
+    elapsed = (time.perf_counter() - start) * 1000
+    status = 'FAIL' if elapsed > budget else 'ok'
+    print('check_procs {0} patterns x {1} lines: {2:.2f} ms {3}'.format(
+        patterns, lines, elapsed, status))
+    return int(elapsed > budget)
+
+
+def feed_checks(pipe, count, port):
+    """
+    Write check lines for count distinct loopback targets to a pipe and close
+    it
+
+    :param pipe: writable binary pipe
+    :param count: number of checks
+    :param port: closed TCP port the checks connect to
+    """
+    for idx in range(count):
+        pipe.write('check_tcp_port -H 127.{0}.{1}.{2} -p {3} -t 1\n'.format(
+            idx >> 16 & 255, idx >> 8 & 255, (idx & 255) or 1, port).encode())
+    pipe.close()
+
+
+def check_batch_rss(counts, workdir):
+    """
+    Print the run time and peak RSS of batch.py runs over increasing numbers
+    of targets, streaming the checks in and the results out
+
+    :param counts: numbers of checks to run
+    :param workdir: scratch directory for plugin state
+    """
+    # a port nothing listens on, so every check fails fast with a refusal
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    env = dict(os.environ, NAGIOS_PLUGIN_STATE_DIR=os.path.join(workdir, 'state'))
+    row = '{0:>8} {1:>9} {2:>10} {3:>9}'
+    print(row.format('checks', 'seconds', 'checks/s', 'RSS MB'))
+    for count in counts:
+        started = time.time()
+        batch = subprocess.Popen([sys.executable, os.path.join(HERE, 'batch.py'),
+                                  '-o', os.devnull], stdin=subprocess.PIPE, env=env)
+        feeder = threading.Thread(target=feed_checks, args=(batch.stdin, count, port))
+        feeder.start()
+        usage = os.wait4(batch.pid, 0)[2]
+        feeder.join()
+        elapsed = time.time() - started
+        print(row.format(count, round(elapsed, 1), round(count / elapsed),
+                         round(usage.ru_maxrss / 1024.0, 1)))
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print results that regressed against a baseline and return their count
+
+    :param results: list of result dicts from this run
+    :param baseline: list of result dicts from an earlier run
+    :param tolerance: allowed slowdown in percent
+    """
+    previous = dict(((r['plugin'], r['mode']), r) for r in baseline)
+    regressions = 0
+    for result in results:
+        old = previous.get((result['plugin'], result['mode']))
+        if not old:
+            continue
+        for key, worse_if_higher in (('p50_ms', True), ('p99_ms', True),
+                                     ('peak_rss_mb', True), ('checks_per_sec', False)):
+            if not old[key]:
+                continue
+            change = (result[key] - old[key]) * 100.0 / old[key]
+            if (change if worse_if_higher else -change) > tolerance:
+                print('REGRESSION: {0} {1} {2} {3} -> {4} ({5:+.1f}%)'.format(
+                    result['plugin'], result['mode'], key, old[key], result[key], change))
+                regressions += 1
+    return regressions
+
+
+def print_table(results):
+    """Print benchmark results as a table"""
+    row = '{0:<20} {1:<10} {2:>6} {3:>10} {4:>10} {5:>10} {6:>9}  {7}'
+    print(row.format('plugin', 'mode', 'n', 'checks/s', 'p50 ms', 'p99 ms',
+                     'RSS MB', 'exit codes'))
+    for res in results:
+        print(row.format(res['plugin'], res['mode'], res['count'], res['checks_per_sec'],
+                         res['p50_ms'], res['p99_ms'], res['peak_rss_mb'],
+                         ' '.join('{0}:{1}'.format(k, v) for k, v
+                                  in sorted(res['exit_codes'].items()))))
+
+
+def do_argparser():
+    """Parse and return command line arguments"""
+    count_help = 'Number of checks per plugin and mode, defaults to 20'
+    plugin_help = 'Plugin to benchmark, may be repeated, defaults to all'
+    mode_help = 'Mode to benchmark, may be repeated, defaults to all'
+    json_help = 'Optional: write results to this file as JSON'
+    baseline_help = 'Optional: JSON results of an earlier run to compare against'
+    tolerance_help = 'Slowdown in percent reported as a regression, defaults to 10'
+    imports_help = 'Only check plugin import time and heavy imports'
+    budget_help = 'Import time in ms reported as a failure, defaults to 25'
+    loss_help = 'Percent of SNMP v2c requests the stand-in drops, defaults to 0'
+    delay_help = 'Milliseconds the SNMP v2c stand-in delays responses by, defaults to 0'
+    matching_help = 'Only time check_procs pattern matching over 3000 command lines'
+    match_budget_help = 'Pattern matching time in ms reported as a failure, defaults to 100'
+    batch_rss_help = 'Only measure batch.py peak RSS for these comma-separated numbers of checks'
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--count', help=count_help, type=int, default=20)
+    parser.add_argument('-P', '--plugin', help=plugin_help, action='append',
+                        choices=[p for p, _ in PLUGINS])
+    parser.add_argument('-m', '--mode', help=mode_help, action='append',
+                        choices=MODES)
+    parser.add_argument('-j', '--json', help=json_help, required=False)
+    parser.add_argument('-b', '--baseline', help=baseline_help, required=False)
+    parser.add_argument('-t', '--tolerance', help=tolerance_help, type=float,
+                        default=10.0)
+    parser.add_argument('-i', '--imports', help=imports_help, action='store_true')
+    parser.add_argument('--import-budget', help=budget_help, type=float, default=25.0)
+    parser.add_argument('--matching', help=matching_help, action='store_true')
+    parser.add_argument('--match-budget', help=match_budget_help, type=float, default=100.0)
+    parser.add_argument('--snmp-loss', help=loss_help, type=float, default=0.0)
+    parser.add_argument('--snmp-delay', help=delay_help, type=float, default=0.0)
+    parser.add_argument('--batch-rss', help=batch_rss_help, required=False)
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--ports', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    """Main function"""
+    args = do_argparser()
+
+    if args.worker:
+        worker(args.worker, args.mode[0], args.count, json.loads(args.ports))
+        return
+
+    if args.imports:
+        modules = sorted(set(p.split(':')[0] for p, _ in PLUGINS)) + ['multicall']
+        if check_imports(modules, args.import_budget):
+            sys.exit(1)
+        return
+
+    if args.matching:
+        if check_matching(args.match_budget):
+            sys.exit(1)
+        return
+
+    workdir = tempfile.mkdtemp(prefix='nagios-bench-')
+    if args.batch_rss:
+        try:
+            check_batch_rss([int(i) for i in args.batch_rss.split(',')], workdir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        return
+
+    try:
+        ports, extra_env = start_standins(workdir, args.snmp_loss / 100.0,
+                                          args.snmp_delay / 1000.0)
+        env = dict(os.environ)
+        env.update(extra_env)
+        results = []
+        for plugin, argv in PLUGINS:
+            if args.plugin and plugin not in args.plugin:
+                continue
+            needed = set(p for a in argv for p in ('snmp', 'snmpv3', 'http', 'tls', 'ssh')
+                         if '{' + p + '}' in a)
+            if not needed.issubset(ports):
+                continue
+            for mode in args.mode or MODES:
+                results.append(spawn_worker(plugin, mode, args.count, ports, env))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(results)
+
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as base:
+            if compare(results, json.load(base), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/python
+
+"""Nagios plugin to check network interface traffic, errors and discards"""
+
+# Walks the IF-MIB ifTable and ifXTable of a host with GETBULK, reading the
+# 64-bit (HC) octet counters plus error and discard counters of every
+# interface in as few round trips as possible. Agents without an ifXTable are
+# read from the 32-bit ifTable octet counters and ifSpeed instead. The
+# counters are stored in a compact state file per host so the next run can
+# compute bits/s, utilisation against ifHighSpeed, and error/discard rates,
+# which are reported as performance data for every interface checked. 32-bit
+# counters that went backwards have wrapped; 64-bit counters that went
+# backwards were reset, i.e. by a reboot, and their interface is skipped until
+# the next run. Warning and critical values are utilisation percentages;
+# optionally give a rate of errors plus discards per second that triggers a
+# warning. The first run only stores counters.
+#
+# Example Nagios command for commands.cfg (or where your command templates are stored):
+#
+# define command {
+#     command_name check_interfaces
+#     command_line $USER1$/check_interfaces.py -H $HOSTADDRESS$ -C $ARG1$ -w $ARG2$ -c $ARG3$
+# }
+#
+# Example Nagios service for the host file:
+#
+# define service {
+#     name check_interfaces
+#     check_command check_interfaces!secretpass!80!95!-e 10 -i ^(Gi|Te)
+# }
+#
+
+from __future__ import print_function
+
+#  standard library imports
+import re
+import struct
+import sys
+
+# local application imports
+from nagioslib import capture
+from nagioslib.snmp import SNMPData, add_v3_arguments, snmp_auth
+from nagioslib.state import read_state, state_path, write_state
+
+
+# IF-MIB ifXTable and ifTable columns
+IF_NAME = '1.3.6.1.2.1.31.1.1.1.1'
+IF_HC_IN_OCTETS = '1.3.6.1.2.1.31.1.1.1.6'
+IF_HC_OUT_OCTETS = '1.3.6.1.2.1.31.1.1.1.10'
+IF_HIGH_SPEED = '1.3.6.1.2.1.31.1.1.1.15'
+IF_DESCR = '1.3.6.1.2.1.2.2.1.2'
+IF_SPEED = '1.3.6.1.2.1.2.2.1.5'
+IF_IN_OCTETS = '1.3.6.1.2.1.2.2.1.10'
+IF_OUT_OCTETS = '1.3.6.1.2.1.2.2.1.16'
+IF_OPER_STATUS = '1.3.6.1.2.1.2.2.1.8'
+IF_IN_DISCARDS = '1.3.6.1.2.1.2.2.1.13'
+IF_IN_ERRORS = '1.3.6.1.2.1.2.2.1.14'
+IF_OUT_DISCARDS = '1.3.6.1.2.1.2.2.1.19'
+IF_OUT_ERRORS = '1.3.6.1.2.1.2.2.1.20'
+
+# Counters stored per interface, in record order, and their wrap values
+COUNTERS = (IF_HC_IN_OCTETS, IF_HC_OUT_OCTETS, IF_IN_ERRORS, IF_OUT_ERRORS,
+            IF_IN_DISCARDS, IF_OUT_DISCARDS)
+COUNTER_WRAP = (2 ** 64, 2 ** 64, 2 ** 32, 2 ** 32, 2 ** 32, 2 ** 32)
+
+# The same from the ifTable of agents without an ifXTable
+COUNTERS_32 = (IF_IN_OCTETS, IF_OUT_OCTETS, IF_IN_ERRORS, IF_OUT_ERRORS,
+               IF_IN_DISCARDS, IF_OUT_DISCARDS)
+COUNTER_WRAP_32 = (2 ** 32,) * 6
+
+# State file layout: a header of magic, poll timestamp and record count, then
+# one fixed-size record of ifIndex plus counters per interface
+STATE_HEADER = struct.Struct('<4sdI')
+STATE_RECORD = struct.Struct('<I6Q')
+STATE_MAGIC = b'IFC1'
+
+
+class InterfaceData(SNMPData):
+    """
+    Return the formatted results of a GETBULK walk of the interface tables
+
+    :param community: SNMP community password for host, or V3Credentials
+    :param host: hostname or IP of host
+    :param port: SNMP port of host
+    """
+    def __init__(self, community, host, port=161):
+        self.oids = [IF_NAME, IF_HIGH_SPEED, IF_OPER_STATUS] + list(COUNTERS)
+        self.data = self.do_snmpbulkwalk(community, host, self.oids, port)
+        self.counters, self.wraps = COUNTERS, COUNTER_WRAP
+        self.name_oid, self.speed_oid, self.speed_unit = IF_NAME, IF_HIGH_SPEED, 1
+        if not self.data[IF_NAME]:
+            self.data.update(self.do_snmpbulkwalk(
+                community, host, [IF_DESCR, IF_SPEED, IF_IN_OCTETS, IF_OUT_OCTETS], port))
+            self.counters, self.wraps = COUNTERS_32, COUNTER_WRAP_32
+            self.name_oid, self.speed_oid, self.speed_unit = IF_DESCR, IF_SPEED, 1000000
+        self.timestamp = capture.now()
+        super(InterfaceData, self).__init__(community, host, port)
+
+    def interfaces(self):
+        """
+        Return a dict of ifIndex to interface details and counters, skipping
+        interfaces missing a counter
+        """
+        interfaces = {}
+        for index, name in self.data[self.name_oid].items():
+            try:
+                counters = tuple(int(self.data[col][index]) for col in self.counters)
+            except KeyError:
+                continue
+            interfaces[int(index)] = {
+                'name': str(name),
+                'speed': int(self.data[self.speed_oid].get(index, 0)) // self.speed_unit,
+                'up': int(self.data[IF_OPER_STATUS].get(index, 1)) == 1,
+                'counters': counters,
+                'wraps': self.wraps,
+            }
+        return interfaces
+
+
+def pack_counters(timestamp, interfaces):
+    """
+    Return interface counters packed into the state file format
+
+    :param timestamp: time the counters were read
+    :param interfaces: dict of ifIndex to interface details from InterfaceData
+    """
+    records = [STATE_RECORD.pack(index, *iface['counters'])
+               for index, iface in sorted(interfaces.items())]
+    return STATE_HEADER.pack(STATE_MAGIC, timestamp, len(records)) + b''.join(records)
+
+
+def unpack_counters(data):
+    """
+    Return the timestamp and a dict of ifIndex to counters from a state file,
+    or (None, {}) if the data is missing or not a counter state file
+
+    :param data: contents of the state file
+    """
+    if not data or len(data) < STATE_HEADER.size:
+        return None, {}
+    magic, timestamp, count = STATE_HEADER.unpack_from(data)
+    if magic != STATE_MAGIC or len(data) != STATE_HEADER.size + count * STATE_RECORD.size:
+        return None, {}
+    counters = {}
+    for record in STATE_RECORD.iter_unpack(data[STATE_HEADER.size:]):
+        counters[record[0]] = record[1:]
+    return timestamp, counters
+
+
+def counter_rates(previous, current, seconds, wraps=COUNTER_WRAP):
+    """
+    Return per-second rates between two sets of counters, allowing for 32-bit
+    counter wrap, or None if a 64-bit counter went backwards because the
+    counters were reset
+
+    :param previous: tuple of counters from the previous run
+    :param current: tuple of counters from this run
+    :param seconds: seconds between the two runs
+    :param wraps: wrap value of each counter
+    """
+    rates = []
+    for prev, cur, wrap in zip(previous, current, wraps):
+        if cur < prev and wrap > 2 ** 32:
+            return None
+        rates.append(((cur - prev) % wrap) / seconds)
+    return rates
+
+
+def do_argparser(argv=None):
+    """
+    Parse and return command line arguments
+
+    :param argv: arguments to parse instead of sys.argv
+    """
+    import argparse
+
+    host_help = 'Host to check, i.e. 127.0.0.1'
+    comm_help = 'SNMP community password, unless an SNMPv3 user is given'
+    port_help = 'Optional: SNMP port, defaults to 161'
+    warn_help = 'Interface utilisation in percent to trigger a warning'
+    critical_help = 'Interface utilisation in percent to trigger a critical alert'
+    errors_help = 'Optional: errors plus discards per second on an interface to trigger a warning'
+    include_help = 'Optional: regular expression of interface names to check, defaults to all'
+    version_help = 'check_interfaces.py, Version 1.0.0, 2017'
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-H', '--host', help=host_help, required=True)
+    parser.add_argument('-C', '--community', help=comm_help, required=False)
+    parser.add_argument('-w', '--warn', help=warn_help, type=float, required=True)
+    parser.add_argument('-c', '--critical', help=critical_help, type=float,
+                        required=True)
+    parser.add_argument('-e', '--errors', help=errors_help, type=float,
+                        required=False)
+    parser.add_argument('-i', '--include', help=include_help, required=False)
+    parser.add_argument('-p', '--port', help=port_help, type=int, default=161,
+                        required=False)
+    add_v3_arguments(parser)
+    parser.add_argument('-v', '--version',
+                        help=version_help, required=False)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Main function
+
+    :param argv: command line arguments to use instead of sys.argv
+    """
+    args = do_argparser(argv)
+
+    if_data = InterfaceData(snmp_auth(args), args.host, args.port)
+    interfaces = if_data.interfaces()
+    path = state_path('check_interfaces', '{0}_{1}'.format(args.host, args.port))
+    last_poll, last_counters = unpack_counters(read_state(path))
+    write_state(path, pack_counters(if_data.timestamp, interfaces))
+
+    if not interfaces:
+        print('UNKNOWN: no interface counters in ifXTable or ifTable')
+        sys.exit(3)
+
+    if last_poll is None or if_data.timestamp <= last_poll:
+        print('OK: stored counters for {0} interfaces, rates available on the next run'.format(
+            len(interfaces)))
+        sys.exit(0)
+
+    include = re.compile(args.include) if args.include else None
+    seconds = if_data.timestamp - last_poll
+    warnings = []
+    criticals = []
+    busiest = (0.0, None, 0.0, 0.0)
+    reset = []
+    perfdata = []
+
+    for index, iface in sorted(interfaces.items()):
+        if not iface['up'] or index not in last_counters:
+            continue
+        if include and not include.search(iface['name']):
+            continue
+        rates = counter_rates(last_counters[index], iface['counters'], seconds,
+                              iface['wraps'])
+        if rates is None:
+            reset.append(iface['name'])
+            continue
+        bps_in, bps_out = rates[0] * 8, rates[1] * 8
+        bad_rate = sum(rates[2:])
+        label = re.sub(r"['=]", '_', iface['name'])
+        limits = ';;;0;{0}'.format(iface['speed'] * 1000000) if iface['speed'] else ';;;0'
+        perfdata.append("'{0}_in'={1:.0f}{2} '{0}_out'={3:.0f}{2}".format(
+            label, bps_in, limits, bps_out))
+
+        if iface['speed']:
+            util = max(bps_in, bps_out) * 100.0 / (iface['speed'] * 1000000.0)
+            perfdata.append("'{0}_util'={1:.2f}%;{2};{3};0;100".format(
+                label, util, args.warn, args.critical))
+            if util >= busiest[0]:
+                busiest = (util, iface['name'], bps_in, bps_out)
+            if util >= args.critical:
+                criticals.append('{0} utilisation {1:.1f}%'.format(iface['name'], util))
+            elif util >= args.warn:
+                warnings.append('{0} utilisation {1:.1f}%'.format(iface['name'], util))
+
+        perfdata.append("'{0}_errors'={1:.3f};;;0 '{0}_discards'={2:.3f};;;0".format(
+            label, rates[2] + rates[3], rates[4] + rates[5]))
+        if args.errors is not None and bad_rate >= args.errors:
+            warnings.append('{0} errors and discards {1:.2f}/s'.format(iface['name'], bad_rate))
+
+    perfdata = ' | ' + ' '.join(perfdata) if perfdata else ''
+
+    if criticals:
+        print('CRITICAL: {0}{1}'.format(', '.join(criticals + warnings), perfdata))
+        sys.exit(2)
+
+    if warnings:
+        print('WARNING: {0}{1}'.format(', '.join(warnings), perfdata))
+        sys.exit(1)
+
+    if busiest[1] is None:
+        summary = 'no interface reports its speed'
+    else:
+        summary = 'max utilisation {0:.1f}% on {1} (in {2:.1f} Mb/s, out {3:.1f} Mb/s)'.format(
+            busiest[0], busiest[1], busiest[2] / 1000000.0, busiest[3] / 1000000.0)
+    if reset:
+        summary += ', counters reset on {0}'.format(', '.join(reset))
+    print('OK: {0} interfaces, {1}{2}'.format(len(interfaces), summary, perfdata))
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
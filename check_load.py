@@ -9,6 +9,16 @@
 # a host. Accepts warning and critical values as comma-separated floats or integers
 # and compares them to current load levels.
 #
+# With -n the thresholds are per core: load averages are divided by the number
+# of processors before comparing, so the same thresholds suit a 4-core and a
+# 128-core host. The core count is cached between runs since it rarely changes.
+# --cpu-warn and --cpu-critical give the percent busy of any single core that
+# triggers an alert, to catch hotspots hidden by the averages. Per-core loads
+# come from a single GETBULK walk of HOST-RESOURCES-MIB::hrProcessorTable.
+# Per-core loads are not published to the results board, so --board cannot be
+# combined with --cpu-warn or --cpu-critical, and -n with --board needs the
+# collector to run the check with -n too so it publishes the core count.
+#
 # Example Nagios command for commands.cfg (or where your command templates are stored):
 #
 # define command {
@@ -23,60 +33,50 @@
 #     check_command check_load!secretpass!1,3,5!5,7,9
 # }
 #
+# define service {
+#     name check_load_per_core
+#     check_command check_load!secretpass!0.7,0.6,0.5!1,0.9,0.8!-n --cpu-critical 98
+# }
+#
 
 from __future__ import print_function
 
 #  standard library imports
-import argparse
 import sys
+import time
 
-# related third party imports
-from pysnmp.entity.rfc3413.oneliner import cmdgen
+# local application imports
+from nagioslib.board import add_board_arguments, board_result
+from nagioslib.history import add_trend_arguments, record_history, trend_text, trend_values
+from nagioslib.result import Result
+from nagioslib.snmp import SNMPData, add_v3_arguments, snmp_auth
+from nagioslib.state import read_state, state_path, write_state
 
 
-class SNMPData(object): # pylint: disable=I0011,R0903
-    """
-    Make an SNMP connection and return the results with do_snmpget()
+# HOST-RESOURCES-MIB::hrProcessorLoad
+HR_PROCESSOR_LOAD = '1.3.6.1.2.1.25.3.3.1.2'
 
-    :param community: SNMP community password for host
-    :param host: hostname or IP of host
-    """
-    def __init__(self, community, host):
-        self.community = community
-        self.host = host
-
-    @staticmethod
-    def do_snmpget(community, host, oid):
-        """
-        Return the results of an snmpget
-
-        :param community: SNMP community password for host
-        :param host: hostname or IP of host
-        :param oid: SNMP oid to retrieve data from the host
-        """
-        cmd_gen = cmdgen.CommandGenerator()
-        err_found, err_status, err_index, var_binds = cmd_gen.getCmd(
-            cmdgen.CommunityData(community),
-            cmdgen.UdpTransportTarget((host, 161)), *oid)
-        if err_found:
-            print('UNKNOWN: {0} {1} {2}'.format(err_found, err_status, err_index))
-            sys.exit(3)
-        return var_binds
+# Seconds a cached core count is trusted before walking hrProcessorTable again
+CORE_CACHE_TTL = 86400
+
+# Metrics kept in the history with --trend
+LOAD_METRICS = ('load1', 'load5', 'load15')
 
 
 class LoadData(SNMPData):
     """
     Return the formatted results of an snmpget for system load
 
-    :param community: SNMP community password for host
+    :param community: SNMP community password for host, or V3Credentials
     :param host: hostname or IP of host
+    :param port: SNMP port of host
     """
-    def __init__(self, community, host):
+    def __init__(self, community, host, port=161):
         self.oids = ['1.3.6.1.4.1.2021.10.1.3.1',
                      '1.3.6.1.4.1.2021.10.1.3.2',
                      '1.3.6.1.4.1.2021.10.1.3.3']
-        self.data = self.do_snmpget(community, host, self.oids)
-        super(LoadData, self).__init__(community, host)
+        self.data = self.do_snmpget(community, host, self.oids, port)
+        super(LoadData, self).__init__(community, host, port)
 
     def one_minute(self):
         """Return the one minute load average"""
@@ -91,52 +91,212 @@ class LoadData(SNMPData):
         return self.data[2][1]
 
 
-def do_argparser():
-    """Parse and return command line arguments"""
+class ProcessorData(SNMPData):
+    """
+    Return the formatted results of a GETBULK walk of hrProcessorTable
+
+    :param community: SNMP community password for host, or V3Credentials
+    :param host: hostname or IP of host
+    :param port: SNMP port of host
+    """
+    def __init__(self, community, host, port=161):
+        self.oids = [HR_PROCESSOR_LOAD]
+        self.data = self.do_snmpbulkwalk(community, host, self.oids, port)
+        super(ProcessorData, self).__init__(community, host, port)
+
+    def core_loads(self):
+        """Return the percent busy of each core over the last minute"""
+        column = self.data[HR_PROCESSOR_LOAD]
+        return [int(column[index]) for index in sorted(column, key=int)]
+
+
+def cached_core_count(host, port):
+    """
+    Return the core count cached by an earlier run, or None if there is no
+    cached count or it is too old
+
+    :param host: hostname or IP of host
+    :param port: SNMP port of host
+    """
+    cached = read_state(state_path('check_load', '{0}_{1}'.format(host, port), 'cores'))
+    try:
+        cores, stored = cached.split()
+        if time.time() - float(stored) < CORE_CACHE_TTL and int(cores) > 0:
+            return int(cores)
+    except (AttributeError, ValueError):
+        pass
+    return None
+
+
+def cache_core_count(host, port, cores):
+    """
+    Store the core count of a host for later runs
+
+    :param host: hostname or IP of host
+    :param port: SNMP port of host
+    :param cores: number of cores
+    """
+    path = state_path('check_load', '{0}_{1}'.format(host, port), 'cores')
+    write_state(path, '{0} {1}'.format(cores, time.time()).encode())
+
+
+def perfdata(load, warn, critical, core_loads, cpu_warn, cpu_critical):
+    """
+    Return Nagios performance data for the load averages and core loads
+
+    :param load: list of 1, 5 and 15 minute load averages
+    :param warn: list of absolute warning thresholds for the load averages
+    :param critical: list of absolute critical thresholds for the load averages
+    :param core_loads: list of percent busy of each core, may be empty
+    :param cpu_warn: percent busy warning threshold for a core, or None
+    :param cpu_critical: percent busy critical threshold for a core, or None
+    """
+    fmt = lambda val: '' if val is None else '{0:g}'.format(val)
+    data = ['{0}={1:g};{2};{3};0'.format(label, l, fmt(w), fmt(c)) for label, l, w, c
+            in zip(('load1', 'load5', 'load15'), load, warn, critical)]
+    data += ['cpu{0}={1}%;{2};{3};0;100'.format(idx, busy, fmt(cpu_warn), fmt(cpu_critical))
+             for idx, busy in enumerate(core_loads)]
+    return ' '.join(data)
+
+
+def do_argparser(argv=None):
+    """
+    Parse and return command line arguments
+
+    :param argv: arguments to parse instead of sys.argv
+    """
+    import argparse
+
     host_help = 'Host to check, i.e. 127.0.0.1'
-    comm_help = 'SNMP community password'
+    comm_help = 'SNMP community password, unless an SNMPv3 user is given'
+    port_help = 'Optional: SNMP port, defaults to 161'
     warn_help = 'Comma-separated values for 1, 5, 15 min load to trigger a warning'
     critical_help = 'Comma-separated values for 1, 5, 15 min load to trigger a critical alert'
+    normalize_help = 'Optional: compare load per core against the thresholds'
+    cpu_warn_help = 'Optional: percent busy of any single core to trigger a warning'
+    cpu_critical_help = 'Optional: percent busy of any single core to trigger a critical alert'
     version_help = 'check_load.py, Version 1.0.0, 2017'
 
     parser = argparse.ArgumentParser()
     parser.add_argument('-H', '--host', help=host_help, required=True)
-    parser.add_argument('-C', '--community', help=comm_help, required=True)
+    parser.add_argument('-C', '--community', help=comm_help, required=False)
     parser.add_argument('-w', '--warn', help=warn_help, required=True)
     parser.add_argument('-c', '--critical', help=critical_help, required=True)
+    parser.add_argument('-n', '--normalize', help=normalize_help,
+                        action='store_true')
+    parser.add_argument('--cpu-warn', help=cpu_warn_help, type=float,
+                        required=False)
+    parser.add_argument('--cpu-critical', help=cpu_critical_help, type=float,
+                        required=False)
+    parser.add_argument('-p', '--port', help=port_help, type=int, default=161,
+                        required=False)
+    add_v3_arguments(parser)
+    add_board_arguments(parser)
+    add_trend_arguments(parser)
     parser.add_argument('-v', '--version',
                         help=version_help, required=False)
-    return parser.parse_args()
+    return parser.parse_args(argv)
+
 
+def collect(args):
+    """
+    Return a Result of the values and text main() checks against the
+    thresholds: the 1, 5 and 15 minute load averages, the core count, or 0 if
+    it is not needed and not cached, then the percent busy of each core if
+    --cpu-warn or --cpu-critical is given, and the load averages as reported
+    by the host. With --trend the load averages are recorded in their history.
+
+    :param args: parsed command line arguments
+    """
+    auth = snmp_auth(args)
+    all_load = LoadData(auth, args.host, args.port)
+    raw_load = [all_load.one_minute(), all_load.five_minute(), all_load.fifteen_minute()]
 
-def main():
-    """Main function"""
-    args = do_argparser()
+    core_loads = []
+    cores = cached_core_count(args.host, args.port)
+    if args.cpu_warn is not None or args.cpu_critical is not None:
+        core_loads = ProcessorData(auth, args.host, args.port).core_loads()
+        cores = len(core_loads)
+        cache_core_count(args.host, args.port, cores)
+    elif args.normalize and cores is None:
+        cores = len(ProcessorData(auth, args.host, args.port).core_loads())
+        cache_core_count(args.host, args.port, cores)
+
+    values = tuple(float(l) for l in raw_load) + (cores or 0,) + tuple(core_loads)
+    if args.trend:
+        record_history('check_load', '{0}_{1}'.format(args.host, args.port),
+                       LOAD_METRICS, values[:3])
+    return Result(output=' '.join(str(l) for l in raw_load), values=values)
+
+
+def main(argv=None):
+    """
+    Main function
+
+    :param argv: command line arguments to use instead of sys.argv
+    """
+    args = do_argparser(argv)
 
     warn = [float(i) for i in args.warn.split(',')]
     critical = [float(i) for i in args.critical.split(',')]
 
-    all_load = LoadData(args.community, args.host)
+    if args.board:
+        if args.cpu_warn is not None or args.cpu_critical is not None:
+            print('UNKNOWN: per-core loads are not published to the board')
+            sys.exit(3)
+        result = board_result('check_load', args)
+    else:
+        result = collect(args)
+    values, text = result.values, result.output
+
+    load = list(values[:3])
+    cores = int(values[3])
+    core_loads = [int(busy) for busy in values[4:]]
+    message = 'load is {0}'.format(', '.join(text.split()))
+
+    if args.normalize:
+        if not cores and args.board:
+            print('UNKNOWN: no core count on the board, collect with -n')
+            sys.exit(3)
+        if not cores:
+            print('UNKNOWN: no processors found in hrProcessorTable')
+            sys.exit(3)
+        warn = [w * cores for w in warn]
+        critical = [c * cores for c in critical]
+        message += ' ({0:.2f}, {1:.2f}, {2:.2f} per core on {3} cores)'.format(
+            *([l / cores for l in load] + [cores]))
+
+    judged = load
+    if args.trend:
+        judged = trend_values('check_load', '{0}_{1}'.format(args.host, args.port),
+                              LOAD_METRICS, args)
+        message += ', ' + trend_text(args, judged)
+
+    check_warn = [l for l, w in zip(judged, warn) if l >= w]
+    check_critical = [l for l, c in zip(judged, critical) if l >= c]
 
-    m1_load = all_load.one_minute()
-    m5_load = all_load.five_minute()
-    m15_load = all_load.fifteen_minute()
+    hot_warn = [(idx, busy) for idx, busy in enumerate(core_loads)
+                if args.cpu_warn is not None and busy >= args.cpu_warn]
+    hot_critical = [(idx, busy) for idx, busy in enumerate(core_loads)
+                    if args.cpu_critical is not None and busy >= args.cpu_critical]
+    hotspots = hot_critical or hot_warn
+    if hotspots:
+        message += ', hot cores {0}'.format(
+            ', '.join('cpu{0} at {1}%'.format(idx, busy) for idx, busy in hotspots))
 
-    load = [float(m1_load), float(m5_load), float(m15_load)]
-    check_warn = [l for l, w in zip(load, warn) if l >= w]
-    check_critical = [l for l, c in zip(load, critical) if l >= c]
+    message += ' | ' + perfdata(load, warn, critical, core_loads,
+                                args.cpu_warn, args.cpu_critical)
 
-    if check_critical:
-        print('CRITICAL: load is {0}, {1}, {2}'.format(m1_load, m5_load, m15_load))
+    if check_critical or hot_critical:
+        print('CRITICAL: {0}'.format(message))
         sys.exit(2)
 
-    if check_warn:
-        print('WARNING: load is {0}, {1}, {2}'.format(m1_load, m5_load, m15_load))
+    if check_warn or hot_warn:
+        print('WARNING: {0}'.format(message))
         sys.exit(1)
 
-    if not check_warn and not check_critical:
-        print('OK: load is {0}, {1}, {2}'.format(m1_load, m5_load, m15_load))
-        sys.exit(0)
+    print('OK: {0}'.format(message))
+    sys.exit(0)
 
 
 if __name__ == "__main__":
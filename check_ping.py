@@ -26,11 +26,17 @@
 from __future__ import print_function
 
 #  standard library imports
-import subprocess
 import re
-import argparse
 import sys
 
+# local application imports
+from nagioslib import capture
+from nagioslib.history import add_trend_arguments, record_history, trend_text, trend_values
+
+
+# Metrics kept in the history with --trend
+PING_METRICS = ('loss', 'rtt')
+
 
 def do_ping(packets, host, timeout):
     """
@@ -40,10 +46,18 @@ def do_ping(packets, host, timeout):
     :param host: hostname or IP of host
     :param timeout: timeout to wait for results
     """
-    ping = subprocess.Popen(['ping', '-q', '-W', timeout, '-c', packets, host],
-                            stdout=subprocess.PIPE)
-    output = str(ping.communicate()[0])
-    ping.stdout.close()
+    key = '{0} -c {1} -W {2}'.format(host, packets, timeout)
+    if capture.replaying():
+        output = capture.replay('ping', key)
+    else:
+        import subprocess
+
+        ping = subprocess.Popen(['ping', '-q', '-W', timeout, '-c', packets, host],
+                                stdout=subprocess.PIPE)
+        output = ping.communicate()[0]
+        ping.stdout.close()
+        capture.record('ping', key, output)
+    output = str(output)
     output = [i for i in output.split('\n') if i.strip()]
     return output
 
@@ -72,8 +86,14 @@ def get_rtt(output):
     return float(rtt)
 
 
-def do_argparser():
-    """Parse and return command line arguments"""
+def do_argparser(argv=None):
+    """
+    Parse and return command line arguments
+
+    :param argv: arguments to parse instead of sys.argv
+    """
+    import argparse
+
     host_help = 'Host to check, i.e. 127.0.0.1'
     warn_help = 'Comma-separated values for packet loss, transit time to trigger a warning'
     critical_help = '''Comma-separated values for packet loss, transit time to
@@ -88,14 +108,19 @@ def do_argparser():
     parser.add_argument('-c', '--critical', help=critical_help, required=True)
     parser.add_argument('-t', '--timeout', help=timeout_help, required=False)
     parser.add_argument('-p', '--packets', help=packets_help, required=False)
+    add_trend_arguments(parser)
     parser.add_argument('-v', '--version',
                         help=version_help, required=False)
-    return parser.parse_args()
+    return parser.parse_args(argv)
+
 
+def main(argv=None):
+    """
+    Main function
 
-def main():
-    """Main function"""
-    args = do_argparser()
+    :param argv: command line arguments to use instead of sys.argv
+    """
+    args = do_argparser(argv)
 
     if args.timeout:
         timeout = args.timeout
@@ -116,16 +141,24 @@ def main():
     warn_rtt = float(args.warn.split(',')[1])
     critical_rtt = float(args.critical.split(',')[1])
 
+    message = 'packet loss {0}%, rtt avg {1} ms'.format(pktloss, rtt)
+    perfdata = 'pl={0:g}%;{1:g};{2:g};0;100 rtt={3:g}ms;{4:g};{5:g};0'.format(
+        pktloss, warn_pl, critical_pl, rtt, warn_rtt, critical_rtt)
+    if args.trend:
+        record_history('check_ping', args.host, PING_METRICS, (pktloss, rtt))
+        pktloss, rtt = trend_values('check_ping', args.host, PING_METRICS, args)
+        message += ', ' + trend_text(args, (pktloss, rtt))
+
     if pktloss >= critical_pl or rtt >= critical_rtt:
-        print('CRITICAL: packet loss {0}%, rtt avg {1} ms'.format(pktloss, rtt))
+        print('CRITICAL: {0} | {1}'.format(message, perfdata))
         sys.exit(2)
 
     if pktloss >= warn_pl or rtt >= warn_rtt:
-        print('WARNING: packet loss {0}%, rtt avg {1} ms'.format(pktloss, rtt))
+        print('WARNING: {0} | {1}'.format(message, perfdata))
         sys.exit(1)
 
     if pktloss < warn_pl and rtt < warn_rtt:
-        print('OK: packet loss {0}%, rtt avg {1} ms'.format(pktloss, rtt))
+        print('OK: {0} | {1}'.format(message, perfdata))
         sys.exit(0)
 
 if __name__ == "__main__":
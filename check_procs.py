@@ -0,0 +1,204 @@
+#!/usr/bin/python
+
+"""Nagios plugin to check the presence and number of running processes"""
+
+# Uses SNMP to walk HOST-RESOURCES-MIB::hrSWRunTable with GETBULK and counts
+# the processes matching each given pattern. Patterns are regular expressions
+# searched in the process name followed by its arguments, optionally prefixed
+# with a label, i.e. -m web=httpd. Each pattern is compiled once, patterns with
+# no special characters are looked up as plain substrings, and identical
+# command lines are only matched once, so watching dozens of daemons on a host
+# with thousands of processes stays cheap.
+#
+# Warning and critical values are Nagios ranges applied to the count of each
+# pattern: 5 alerts above 5, 1: alerts below 1, 2:10 alerts outside 2 to 10 and
+# @2:10 alerts inside 2 to 10. The default critical range of 1: alerts when a
+# pattern matches no processes.
+#
+# Example Nagios command for commands.cfg (or where your command templates are stored):
+#
+# define command {
+#     command_name check_procs
+#     command_line $USER1$/check_procs.py -H $HOSTADDRESS$ -C $ARG1$ $ARG2$
+# }
+#
+# Example Nagios service for the host file:
+#
+# define service {
+#     name check_procs
+#     check_command check_procs!secretpass!-m sshd=^sshd -m web=httpd -w 2:200 -c 1:
+# }
+#
+
+from __future__ import print_function
+
+#  standard library imports
+import re
+import sys
+from collections import Counter
+
+# local application imports
+from nagioslib.snmp import SNMPData, add_v3_arguments, snmp_auth
+
+
+# HOST-RESOURCES-MIB::hrSWRunTable columns
+HR_SW_RUN_NAME = '1.3.6.1.2.1.25.4.2.1.2'
+HR_SW_RUN_PARAMETERS = '1.3.6.1.2.1.25.4.2.1.5'
+
+
+class ProcessData(SNMPData):
+    """
+    Return the formatted results of a GETBULK walk of hrSWRunTable
+
+    :param community: SNMP community password for host, or V3Credentials
+    :param host: hostname or IP of host
+    :param port: SNMP port of host
+    :param with_args: also walk the process arguments
+    """
+    def __init__(self, community, host, port=161, with_args=True):
+        self.oids = [HR_SW_RUN_NAME]
+        if with_args:
+            self.oids.append(HR_SW_RUN_PARAMETERS)
+        self.data = self.do_snmpbulkwalk(community, host, self.oids, port,
+                                         max_repetitions=50)
+        super(ProcessData, self).__init__(community, host, port)
+
+    def command_lines(self):
+        """Return a Counter of process command lines"""
+        names = self.data[HR_SW_RUN_NAME]
+        params = self.data.get(HR_SW_RUN_PARAMETERS, {})
+        return Counter('{0} {1}'.format(name, params.get(idx, '')).rstrip()
+                       for idx, name in names.items())
+
+
+def parse_patterns(patterns):
+    """
+    Return a list of labels and a list of functions returning whether each
+    pattern matches a command line
+
+    :param patterns: list of regular expressions, optionally as label=regex
+    """
+    labels = []
+    matchers = []
+    for pattern in patterns:
+        label, sep, regex = pattern.partition('=')
+        if not sep or not re.match(r'^[\w.-]+$', label):
+            label, regex = pattern, pattern
+        labels.append(label)
+        if re.escape(regex) == regex:
+            matchers.append(lambda line, text=regex: text in line)
+        else:
+            matchers.append(re.compile(regex).search)
+    return labels, matchers
+
+
+def count_matches(command_lines, matchers):
+    """
+    Return a list of the number of processes matching each pattern
+
+    :param command_lines: Counter of process command lines
+    :param matchers: pattern matchers from parse_patterns()
+    """
+    counts = [0] * len(matchers)
+    for line, procs in command_lines.items():
+        for idx, matcher in enumerate(matchers):
+            if matcher(line):
+                counts[idx] += procs
+    return counts
+
+
+def parse_range(text):
+    """
+    Return a function returning True when a value falls outside (or, for @
+    ranges, inside) a Nagios threshold range
+
+    :param text: Nagios range, i.e. 10, 1:, 2:10, ~:5 or @2:10
+    """
+    inside = text.startswith('@')
+    text = text.lstrip('@')
+    start, sep, end = text.partition(':')
+    if not sep:
+        start, end = '0', text
+    low = float('-inf') if start in ('', '~') else float(start)
+    high = float('inf') if end == '' else float(end)
+    if inside:
+        return lambda val: low <= val <= high
+    return lambda val: val < low or val > high
+
+
+def do_argparser(argv=None):
+    """
+    Parse and return command line arguments
+
+    :param argv: arguments to parse instead of sys.argv
+    """
+    import argparse
+
+    host_help = 'Host to check, i.e. 127.0.0.1'
+    comm_help = 'SNMP community password, unless an SNMPv3 user is given'
+    port_help = 'Optional: SNMP port, defaults to 161'
+    match_help = 'Regular expression of processes to count, optionally label=regex, may be repeated'
+    warn_help = 'Optional: Nagios range of process counts that is ok before warning'
+    critical_help = 'Optional: Nagios range of process counts that is ok before a critical alert, defaults to 1:'
+    names_help = 'Optional: match process names only, without walking their arguments'
+    version_help = 'check_procs.py, Version 1.0.0, 2017'
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-H', '--host', help=host_help, required=True)
+    parser.add_argument('-C', '--community', help=comm_help, required=False)
+    parser.add_argument('-m', '--match', help=match_help, action='append',
+                        required=True)
+    parser.add_argument('-w', '--warn', help=warn_help, required=False)
+    parser.add_argument('-c', '--critical', help=critical_help, default='1:',
+                        required=False)
+    parser.add_argument('-n', '--names-only', help=names_help, action='store_true')
+    parser.add_argument('-p', '--port', help=port_help, type=int, default=161,
+                        required=False)
+    add_v3_arguments(parser)
+    parser.add_argument('-v', '--version',
+                        help=version_help, required=False)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Main function
+
+    :param argv: command line arguments to use instead of sys.argv
+    """
+    args = do_argparser(argv)
+
+    try:
+        labels, matchers = parse_patterns(args.match)
+    except re.error as err:
+        print('UNKNOWN: invalid pattern: {0}'.format(err))
+        sys.exit(3)
+
+    try:
+        warn = parse_range(args.warn) if args.warn else (lambda val: False)
+        critical = parse_range(args.critical)
+    except ValueError as err:
+        print('UNKNOWN: invalid range: {0}'.format(err))
+        sys.exit(3)
+
+    proc_data = ProcessData(snmp_auth(args), args.host, args.port, not args.names_only)
+    counts = count_matches(proc_data.command_lines(), matchers)
+
+    summary = ', '.join('{0} {1}'.format(l, c) for l, c in zip(labels, counts))
+    perfdata = ' '.join("'{0}'={1};{2};{3}".format(l, c, args.warn or '', args.critical)
+                        for l, c in zip(labels, counts))
+
+    if any(critical(c) for c in counts):
+        print('CRITICAL: {0} | {1}'.format(summary, perfdata))
+        sys.exit(2)
+
+    if any(warn(c) for c in counts):
+        print('WARNING: {0} | {1}'.format(summary, perfdata))
+        sys.exit(1)
+
+    print('OK: {0} | {1}'.format(summary, perfdata))
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,16 @@
 # given expected code is invalid, the script will warn. A status of OK is only
 # produced when the codes are valid and match.
 #
+# With -F it checks every URL listed in a file instead, one per line with
+# optionally its own expected code and a regular expression its body must
+# match, and reports the status code and time of each. With httpx and h2
+# installed the URLs are fetched concurrently as HTTP/2 streams over one
+# connection per origin, otherwise over pooled, kept-alive HTTP/1.1
+# connections, so dozens of paths on a few origins cost a few connection
+# setups rather than one each.
+#
 # REQUIRES: requests
+# OPTIONAL: httpx and h2, for HTTP/2 with -F
 #
 # Example Nagios command for commands.cfg (or where your command templates are stored):
 #
@@ -26,56 +35,309 @@
 #     check_command check_response_code!http://www.example.com!200
 # }
 #
+# Example URL file for -F:
+#
+#   https://www.example.com/
+#   https://www.example.com/login 200 Sign in
+#   https://www.example.com/old 301
+#
 
 from __future__ import print_function
 
 #  standard library imports
-import argparse
+import re
 import sys
+import time
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+# local application imports
+from nagioslib import capture
+from nagioslib.breaker import breaker_open, check_breaker, record_success, record_timeout
+from nagioslib.tls import http_session
+
+
+# Most URLs fetched at once over HTTP/1.1 when HTTP/2 is not available
+POOLED_WORKERS = 10
+
+
+def response_head(version, status, reason, headers):
+    """
+    Return the status line and headers of a response as recorded in a
+    capture
+
+    :param version: HTTP version, i.e. HTTP/1.1
+    :param status: status code
+    :param reason: reason phrase
+    :param headers: iterable of (name, value) header pairs
+    """
+    head = '{0} {1} {2}\r\n'.format(version, status, reason)
+    return head + ''.join('{0}: {1}\r\n'.format(*i) for i in headers)
+
+
+def record_response(url, head, body):
+    """
+    Record the head of a response, and its body if it was needed, when
+    recording
+
+    :param url: URL fetched
+    :param head: status line and headers from response_head()
+    :param body: body of the response, or None if it was not needed
+    """
+    if capture.RECORD_PATH is not None:
+        payload = head.encode('latin-1')
+        if body is not None:
+            payload += b'\r\n' + body.encode('utf-8')
+        capture.record('http', url, payload)
 
-# related third party imports
-import requests
 
+def decode_response(payload):
+    """
+    Return the status code and body of a recorded response
 
-def get_response_code(url):
+    :param payload: recorded response
     """
-    Return the status code of a URL
+    head, _, body = payload.partition(b'\r\n\r\n')
+    return int(head.split()[1]), body.decode('utf-8', 'replace')
+
+
+def get_response_code(url, host, timeout, need_body=False):
+    """
+    Return the status code and body of a URL, fetched through the requests
+    Session shared by the checks of this process, exiting CRITICAL if it
+    cannot be fetched
 
     :param url: URL to check
+    :param host: hostname or IP of the URL
+    :param timeout: timeout in seconds to wait for the connection and each read
+    :param need_body: read the body, otherwise '' is returned for it
     """
-    req = requests.get(url)
-    return req.status_code
+    if capture.replaying():
+        return capture.replay('http', url, decode_response)
+
+    import requests
 
+    try:
+        req = http_session().get(url, timeout=(timeout, timeout))
+    except requests.exceptions.RequestException as err:
+        if isinstance(err, requests.exceptions.Timeout):
+            record_timeout(host)
+        else:
+            record_success(host)
+        print('CRITICAL: {0}'.format(err))
+        sys.exit(2)
+    record_success(host)
+    body = req.text if need_body else None
+    version = req.raw.version if req.raw is not None else 11
+    record_response(url, response_head('HTTP/{0}.{1}'.format(version // 10, version % 10),
+                                       req.status_code, req.reason, req.headers.items()),
+                    body)
+    return req.status_code, body or ''
+
+
+def fetch_pooled(urls, timeout):
+    """
+    Return the status code, seconds taken, body, response head and whether
+    it timed out of each URL, fetched concurrently over the kept-alive
+    HTTP/1.1 connections of the shared requests Session; the status code and
+    head are None and the body is the error for a URL that could not be
+    fetched
+
+    :param urls: list of URLs to fetch
+    :param timeout: timeout in seconds to wait for each connection and read
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import requests
+
+    session = http_session()
+
+    def fetch(url):
+        started = time.time()
+        try:
+            req = session.get(url, timeout=(timeout, timeout))
+        except requests.exceptions.RequestException as err:
+            return (None, time.time() - started, str(err), None,
+                    isinstance(err, requests.exceptions.Timeout))
+        version = req.raw.version if req.raw is not None else 11
+        head = response_head('HTTP/{0}.{1}'.format(version // 10, version % 10),
+                             req.status_code, req.reason, req.headers.items())
+        return req.status_code, time.time() - started, req.text, head, False
+
+    with ThreadPoolExecutor(min(POOLED_WORKERS, len(urls))) as executor:
+        return list(executor.map(fetch, urls))
+
+
+def fetch_urls(urls, timeout, need_body):
+    """
+    Return the status code, seconds taken and body, or None and the error,
+    and whether it timed out of each URL, over HTTP/2 if httpx and h2 are
+    installed
+
+    :param urls: list of URLs to fetch
+    :param timeout: timeout in seconds to wait for each connection and read
+    :param need_body: record the bodies along with the heads
+    """
+    if capture.replaying():
+        results = []
+        for url in urls:
+            status, body = capture.replay('http', url, decode_response)
+            results.append((status, 0.0, body, False))
+        return results
+
+    try:
+        from nagioslib.http2 import fetch_http2
+    except (ImportError, SyntaxError):
+        fetch_http2 = None
+    if fetch_http2 is not None:
+        results = fetch_http2(urls, timeout)
+    else:
+        results = fetch_pooled(urls, timeout)
+
+    for url, (_, _, body, head, _) in zip(urls, results):
+        if head is not None:
+            record_response(url, head, body if need_body else None)
+    return [result[:3] + result[4:] for result in results]
+
+
+def read_urls(path, responsecode, match):
+    """
+    Return the URLs listed in a URL file as (url, expected code, regular
+    expression or None) tuples. Each line holds a URL, optionally followed by
+    its expected code and then a regular expression its body must match;
+    blank lines and comments are skipped.
+
+    :param path: path of the URL file
+    :param responsecode: expected code of URLs listed without one
+    :param match: regular expression of URLs listed without one, or None
+    """
+    urls = []
+    with open(path) as url_file:
+        for line in url_file:
+            fields = line.split(None, 2)
+            if fields and not fields[0].startswith('#'):
+                urls.append((fields[0], fields[1] if len(fields) > 1 else responsecode,
+                             fields[2].strip() if len(fields) > 2 else match))
+    return urls
+
+
+def urls_main(args):
+    """
+    Check every URL of a URL file and report the status code and time of
+    each. URLs of hosts whose circuit breaker is open fail straight away, and
+    each host counts as one timeout or success towards its breaker per run.
+
+    :param args: parsed command line arguments
+    """
+    urls = read_urls(args.urls, args.responsecode, args.match)
+    if not urls:
+        print('UNKNOWN: no URLs in {0}'.format(args.urls))
+        sys.exit(3)
+    hosts = [urlparse(url).hostname for url, _, _ in urls]
+    tripped = dict((host, breaker_open(host)) for host in set(hosts))
+    wanted = [url for (url, _, _), host in zip(urls, hosts) if tripped[host] is None]
+    need_body = any(match for _, _, match in urls)
+    results = iter(fetch_urls(wanted, args.timeout, need_body) if wanted else [])
+
+    failures = []
+    details = []
+    perfdata = []
+    timed_out = set()
+    answered = set()
+    for (url, expected, match), host in zip(urls, hosts):
+        if tripped[host] is not None:
+            failures.append('{0} failed: {1}'.format(url, tripped[host]))
+            details.append('{0} failed: {1}'.format(url, tripped[host]))
+            continue
+        actual, seconds, body, timeout = next(results)
+        (timed_out if timeout else answered).add(host)
+        if actual is None:
+            failures.append('{0} failed: {1}'.format(url, body))
+            details.append('{0} failed in {1:.3f}s: {2}'.format(url, seconds, body))
+            continue
+        details.append('{0} {1} in {2:.3f}s'.format(url, actual, seconds))
+        perfdata.append("'{0}'={1:.6f}s;;;0".format(re.sub(r"['=]", '_', url), seconds))
+        if str(actual) != expected:
+            failures.append('{0} expected {1}, got {2}'.format(url, expected, actual))
+        elif match and not re.search(match, body):
+            failures.append('{0} body does not match {1}'.format(url, match))
+
+    for host in timed_out:
+        record_timeout(host)
+    for host in answered - timed_out:
+        record_success(host)
+
+    perfdata = ' '.join(perfdata)
+    details = '\n'.join(details)
+    if failures:
+        print('CRITICAL: {0} of {1} URLs failed: {2} | {3}\n{4}'.format(
+            len(failures), len(urls), '; '.join(failures), perfdata, details))
+        sys.exit(2)
+    print('OK: {0} URLs answered as expected | {1}\n{2}'.format(len(urls), perfdata, details))
+    sys.exit(0)
+
+
+def do_argparser(argv=None):
+    """
+    Parse and return command line arguments
+
+    :param argv: arguments to parse instead of sys.argv
+    """
+    import argparse
 
-def do_argparser():
-    """Parse and return command line arguments"""
     url_help = 'URL to check, i.e. http://www.example.com'
+    urls_help = 'File listing URLs, and optionally their expected codes and body patterns, to check instead of a URL'
     rcode_help = 'Expected response code returned by given URL'
+    timeout_help = 'Optional: timeout to wait for the connection and each read, defaults to 5 seconds'
+    match_help = 'Optional: regular expression the body must match'
     version_help = 'check_response_code.py, Version 1.0.0, 2017'
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('-u', '--url', help=url_help, required=True)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('-u', '--url', help=url_help)
+    target.add_argument('-F', '--urls', help=urls_help)
     parser.add_argument('-r', '--responsecode', help=rcode_help, type=str,
                         required=True)
+    parser.add_argument('-t', '--timeout', help=timeout_help, type=float,
+                        default=5.0, required=False)
+    parser.add_argument('-m', '--match', help=match_help, required=False)
     parser.add_argument('-v', '--version',
                         help=version_help, required=False)
-    return parser.parse_args()
+    return parser.parse_args(argv)
+
 
+def main(argv=None):
+    """
+    Main function
+
+    :param argv: command line arguments to use instead of sys.argv
+    """
+    args = do_argparser(argv)
+
+    if args.urls:
+        urls_main(args)
 
-def main():
-    """Main function"""
-    args = do_argparser()
+    host = urlparse(args.url).hostname
 
-    actual = str(get_response_code(args.url))
+    check_breaker(host, 2)
+    actual, body = get_response_code(args.url, host, args.timeout, args.match is not None)
+    actual = str(actual)
     expected = args.responsecode
 
-    if actual == expected:
-        print('OK: expected {0}, got {1}'.format(expected, actual))
-        sys.exit(0)
-    else:
+    if actual != expected:
         print('CRITICAL: expected {0}, got {1}'.format(expected, actual))
         sys.exit(2)
 
+    if args.match and not re.search(args.match, body):
+        print('CRITICAL: expected {0}, got {1}, body does not match {2}'.format(
+            expected, actual, args.match))
+        sys.exit(2)
+
+    print('OK: expected {0}, got {1}'.format(expected, actual))
+    sys.exit(0)
+
 
 if __name__ == "__main__":
     main()
@@ -27,10 +27,12 @@
 from __future__ import print_function
 
 #  standard library imports
-import telnetlib
 import sys
 import socket
-import argparse
+
+# local application imports
+from nagioslib import capture
+from nagioslib.breaker import check_breaker, record_success, record_timeout
 
 
 def telnet_connect(host, port, timeout):
@@ -41,21 +43,36 @@ def telnet_connect(host, port, timeout):
     :param port: host port to check
     :param timeout: timeout to wait for connection
     """
+    key = '{0}:{1}'.format(host, port)
+    if capture.replaying():
+        return capture.replay('ssh', key)
+
+    import telnetlib
+
     try:
         tlnt = telnetlib.Telnet()
         tlnt.open(host, port, timeout)
     except socket.timeout as err:
+        record_timeout(host)
         print('CRITICAL: {0}'.format(err))
         sys.exit(2)
     else:
+        record_success(host)
         data = tlnt.read_some().strip()
     finally:
         tlnt.close()
+    capture.record('ssh', key, data)
     return data
 
 
-def do_argparser():
-    """Parse and return command line arguments"""
+def do_argparser(argv=None):
+    """
+    Parse and return command line arguments
+
+    :param argv: arguments to parse instead of sys.argv
+    """
+    import argparse
+
     host_help = 'URL to check, i.e. http://www.example.com'
     port_help = 'Expected response code returned by given URL'
     timeout_help = 'Optional: specify a timeout to wait for telnet response, defaults to 5 seconds'
@@ -70,18 +87,23 @@ def do_argparser():
                         help=timeout_help, type=float, required=False)
     parser.add_argument('-v', '--version',
                         help=version_help, required=False)
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
-def main():
-    """Main function"""
-    args = do_argparser()
+def main(argv=None):
+    """
+    Main function
+
+    :param argv: command line arguments to use instead of sys.argv
+    """
+    args = do_argparser(argv)
 
     if args.timeout:
         timeout = args.timeout
     else:
         timeout = 5
 
+    check_breaker(args.host, 2)
     ssh_data = str(telnet_connect(args.host, args.port, timeout))
 
     if 'SSH' in ssh_data:
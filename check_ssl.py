@@ -28,12 +28,19 @@
 from __future__ import print_function
 
 #  standard library imports
-import ssl
+import calendar
+import json
 import socket
-import argparse
 import sys
 from datetime import datetime
 
+# local application imports
+from nagioslib import capture
+from nagioslib.board import add_board_arguments, board_result
+from nagioslib.breaker import check_breaker, record_success, record_timeout
+from nagioslib.result import Result
+from nagioslib.tls import tls_peer_certificate
+
 
 def convert_cert_date(date):
     """
@@ -49,14 +56,20 @@ def convert_cert_date(date):
 def convert_today_date():
     """Return a formatted date object from today's date that matches the string
     date from SSL output"""
-    today = datetime.utcnow()
+    today = datetime.utcfromtimestamp(capture.now())
     today = datetime.strftime(today, '%Y-%m-%d %H:%M:%S')
     today = datetime.strptime(today, '%Y-%m-%d %H:%M:%S')
     return today
 
 
-def do_argparser():
-    """Parse and return command line arguments"""
+def do_argparser(argv=None):
+    """
+    Parse and return command line arguments
+
+    :param argv: arguments to parse instead of sys.argv
+    """
+    import argparse
+
     host_help = 'Host to check, i.e. 127.0.0.1'
     port_help = 'port to check, i.e. 443'
     warn_help = 'Number of days until cert expiration to trigger a warning'
@@ -71,65 +84,96 @@ def do_argparser():
     parser.add_argument('-c', '--critical', help=critical_help, type=int,
                         required=True)
     parser.add_argument('-i', '--issuer', help=issuer_help, required=False)
+    add_board_arguments(parser)
     parser.add_argument('-v', '--version',
                         help=version_help, required=False)
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
 def socket_connect(host, port, timeout):
     """
-    Return SSL certificate details
+    Return SSL certificate details, resuming the TLS session of an earlier
+    check of host:port in this process where it can
 
     :param host: hostname to check
     :param port: SSL port of host
     :param timeout: timeout to wait for socket connection
     """
+    key = '{0}:{1}'.format(host, port)
+    if capture.replaying():
+        return capture.replay('tls', key, lambda payload: json.loads(payload.decode('utf-8')))
+
+    import ssl
+
     try:
-        context = ssl.create_default_context()
-        ssl_sock = context.wrap_socket(socket.socket(), server_hostname=host)
-        ssl_sock.settimeout(timeout)
-        ssl_sock.connect((host, port))
-        cert_info = ssl_sock.getpeercert()
+        cert_info = tls_peer_certificate(host, port, timeout)
+        record_success(host)
         ssl.match_hostname(cert_info, host)
+    except socket.timeout as err:
+        record_timeout(host)
+        print('CRITICAL: {0}'.format(err))
+        sys.exit(2)
     except socket.error as err:
         print('CRITICAL: {0}'.format(err))
         sys.exit(2)
     except ssl.CertificateError as err:
         print('CRITICAL: {0}'.format(err))
         sys.exit(2)
-    finally:
-        ssl_sock.close()
+    capture.record('tls', key, json.dumps(cert_info).encode('utf-8'))
     return cert_info
 
 
-def main():
-    """Main function"""
-    args = do_argparser()
-    today = convert_today_date()
+def collect(args):
+    """
+    Return a Result of the values and text main() checks against the
+    thresholds: the certificate's expiry as a UNIX timestamp and its issuer's common name
+
+    :param args: parsed command line arguments
+    """
     timeout = 5
+    check_breaker(args.host, 2)
     cert = socket_connect(args.host, args.port, timeout)
     issuer = dict(i[0] for i in cert['issuer'])
     not_after = convert_cert_date(cert['notAfter'])
+    return Result(output=issuer.get('commonName', ''),
+                  values=(calendar.timegm(not_after.timetuple()),))
+
+
+def main(argv=None):
+    """
+    Main function
+
+    :param argv: command line arguments to use instead of sys.argv
+    """
+    args = do_argparser(argv)
+    if args.board:
+        result = board_result('check_ssl', args)
+    else:
+        result = collect(args)
+    values, issuer = result.values, result.output
+    today = convert_today_date()
+    not_after = datetime.utcfromtimestamp(values[0])
     difference = int((not_after - today).days)
+    perfdata = 'days={0};{1};{2}'.format(difference, args.warn, args.critical)
 
-    if args.issuer and args.issuer not in issuer['commonName']:
+    if args.issuer and args.issuer not in issuer:
         print("CRITICAL: {0} not found in issuer string".format(args.issuer))
         sys.exit(2)
 
     if difference > args.warn:
-        print('OK: cert expires in {0} days'.format(difference))
+        print('OK: cert expires in {0} days | {1}'.format(difference, perfdata))
         sys.exit(0)
 
     if difference <= 0:
-        print('CRITICAL: cert expired {0} days ago'.format(abs(difference)))
+        print('CRITICAL: cert expired {0} days ago | {1}'.format(abs(difference), perfdata))
         sys.exit(2)
 
     if difference <= args.critical:
-        print('CRITICAL: cert expires in {0} days'.format(difference))
+        print('CRITICAL: cert expires in {0} days | {1}'.format(difference, perfdata))
         sys.exit(2)
 
     if difference <= args.warn:
-        print('WARNING: cert expires in {0} days'.format(difference))
+        print('WARNING: cert expires in {0} days | {1}'.format(difference, perfdata))
         sys.exit(1)
 
 
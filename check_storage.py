@@ -0,0 +1,262 @@
+#!/usr/bin/python
+
+"""Nagios plugin to check filesystem usage"""
+
+# Uses SNMP to check the usage of every filesystem on a host at once. The first
+# run walks HOST-RESOURCES-MIB::hrStorageTable with GETBULK in one pass; the
+# index of each matching filesystem is then cached so later runs fetch just
+# those rows with a single GET. The cache is refreshed hourly, or as soon as a
+# cached index no longer points at the same filesystem. Warning and critical
+# values are percentages used. Only fixed and network disks are checked unless
+# -a is given. Filesystems can be selected with include and exclude regular
+# expressions matched against the mount point or description.
+#
+# Example Nagios command for commands.cfg (or where your command templates are stored):
+#
+# define command {
+#     command_name check_storage
+#     command_line $USER1$/check_storage.py -H $HOSTADDRESS$ -C $ARG1$ -w $ARG2$ -c $ARG3$
+# }
+#
+# Example Nagios service for the host file:
+#
+# define service {
+#     name check_storage
+#     check_command check_storage!secretpass!80!90!-e ^/run -e ^/dev
+# }
+#
+
+from __future__ import print_function
+
+#  standard library imports
+import re
+import sys
+import time
+
+# local application imports
+from nagioslib.snmp import SNMPData, add_v3_arguments, snmp_auth
+from nagioslib.state import read_state, state_path, write_state
+
+
+# HOST-RESOURCES-MIB::hrStorageTable columns
+HR_STORAGE_TYPE = '1.3.6.1.2.1.25.2.3.1.2'
+HR_STORAGE_DESCR = '1.3.6.1.2.1.25.2.3.1.3'
+HR_STORAGE_UNITS = '1.3.6.1.2.1.25.2.3.1.4'
+HR_STORAGE_SIZE = '1.3.6.1.2.1.25.2.3.1.5'
+HR_STORAGE_USED = '1.3.6.1.2.1.25.2.3.1.6'
+
+# hrStorageFixedDisk and hrStorageNetworkDisk
+DISK_TYPES = ('1.3.6.1.2.1.25.2.1.4', '1.3.6.1.2.1.25.2.1.10')
+
+# Seconds the cached index to filesystem mapping is trusted
+MAP_CACHE_TTL = 3600
+
+
+class StorageData(SNMPData):
+    """
+    Return the formatted results of a GETBULK walk of hrStorageTable, or of an
+    snmpget of just the rows given in indexes
+
+    :param community: SNMP community password for host, or V3Credentials
+    :param host: hostname or IP of host
+    :param port: SNMP port of host
+    :param indexes: optional list of hrStorageIndex values to get instead of walking
+    """
+    def __init__(self, community, host, port=161, indexes=None):
+        columns = [HR_STORAGE_DESCR, HR_STORAGE_UNITS, HR_STORAGE_SIZE, HR_STORAGE_USED]
+        if indexes:
+            self.oids = ['{0}.{1}'.format(col, idx) for idx in indexes for col in columns]
+            var_binds = self.do_snmpget(community, host, self.oids, port)
+            self.data = dict((col, {}) for col in columns + [HR_STORAGE_TYPE])
+            for (_, val), oid in zip(var_binds, self.oids):
+                col, idx = oid.rsplit('.', 1)
+                self.data[col][idx] = val
+        else:
+            self.oids = [HR_STORAGE_TYPE] + columns
+            self.data = self.do_snmpbulkwalk(community, host, self.oids, port)
+        super(StorageData, self).__init__(community, host, port)
+
+    def filesystems(self):
+        """Return a dict of hrStorageIndex to storage description, type and usage"""
+        storage = {}
+        for idx, descr in self.data[HR_STORAGE_DESCR].items():
+            try:
+                units = int(self.data[HR_STORAGE_UNITS][idx])
+                size = int(self.data[HR_STORAGE_SIZE][idx]) * units
+                used = int(self.data[HR_STORAGE_USED][idx]) * units
+            except (KeyError, TypeError, ValueError):
+                continue
+            storage[idx] = {
+                'descr': str(descr),
+                'type': str(self.data[HR_STORAGE_TYPE].get(idx, '')),
+                'size': size,
+                'used': used,
+            }
+        return storage
+
+
+def compile_patterns(patterns):
+    """
+    Return one compiled regular expression matching any of the patterns, or
+    None if there are none
+
+    :param patterns: list of regular expressions
+    """
+    if not patterns:
+        return None
+    return re.compile('|'.join('(?:{0})'.format(pat) for pat in patterns))
+
+
+def selected(descr, include, exclude):
+    """
+    Return True if a filesystem passes the include and exclude patterns
+
+    :param descr: mount point or description of the filesystem
+    :param include: compiled include pattern or None to include everything
+    :param exclude: compiled exclude pattern or None to exclude nothing
+    """
+    if include and not include.search(descr):
+        return False
+    return not (exclude and exclude.search(descr))
+
+
+def load_index_cache(path, selection):
+    """
+    Return the cached dict of hrStorageIndex to description, or None if the
+    cache is missing, stale, or was built for a different selection
+
+    :param path: path of the cache file
+    :param selection: string identifying the filesystem selection options
+    """
+    cached = read_state(path)
+    if not cached:
+        return None
+    lines = cached.decode('utf-8', 'replace').split('\n')
+    try:
+        stored, cached_selection = lines[0].split('\t', 1)
+        if time.time() - float(stored) >= MAP_CACHE_TTL or cached_selection != selection:
+            return None
+        return dict(line.split('\t', 1) for line in lines[1:] if line)
+    except ValueError:
+        return None
+
+
+def save_index_cache(path, selection, indexes):
+    """
+    Store the dict of hrStorageIndex to description for later runs
+
+    :param path: path of the cache file
+    :param selection: string identifying the filesystem selection options
+    :param indexes: dict of hrStorageIndex to description
+    """
+    lines = ['{0}\t{1}'.format(time.time(), selection)]
+    lines += ['{0}\t{1}'.format(idx, descr) for idx, descr in sorted(indexes.items())]
+    write_state(path, '\n'.join(lines).encode('utf-8'))
+
+
+def get_filesystems(args, include, exclude):
+    """
+    Return a dict of hrStorageIndex to details for the selected filesystems,
+    using the cached indexes when they are still valid
+
+    :param args: parsed command line arguments
+    :param include: compiled include pattern or None
+    :param exclude: compiled exclude pattern or None
+    """
+    selection = repr((args.include, args.exclude, args.all_types))
+    path = state_path('check_storage', '{0}_{1}'.format(args.host, args.port), 'index')
+    auth = snmp_auth(args)
+
+    indexes = load_index_cache(path, selection)
+    if indexes:
+        storage = StorageData(auth, args.host, args.port,
+                              sorted(indexes, key=int)).filesystems()
+        if all(idx in storage and storage[idx]['descr'] == descr
+               for idx, descr in indexes.items()):
+            return storage
+
+    storage = StorageData(auth, args.host, args.port).filesystems()
+    storage = dict((idx, fs) for idx, fs in storage.items()
+                   if (args.all_types or fs['type'] in DISK_TYPES)
+                   and selected(fs['descr'], include, exclude))
+    save_index_cache(path, selection, dict((idx, fs['descr']) for idx, fs in storage.items()))
+    return storage
+
+
+def do_argparser(argv=None):
+    """
+    Parse and return command line arguments
+
+    :param argv: arguments to parse instead of sys.argv
+    """
+    import argparse
+
+    host_help = 'Host to check, i.e. 127.0.0.1'
+    comm_help = 'SNMP community password, unless an SNMPv3 user is given'
+    port_help = 'Optional: SNMP port, defaults to 161'
+    warn_help = 'Percent used of any filesystem to trigger a warning'
+    critical_help = 'Percent used of any filesystem to trigger a critical alert'
+    include_help = 'Optional: regular expression of filesystems to check, may be repeated'
+    exclude_help = 'Optional: regular expression of filesystems to skip, may be repeated'
+    types_help = 'Optional: check all storage types, not just fixed and network disks'
+    version_help = 'check_storage.py, Version 1.0.0, 2017'
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-H', '--host', help=host_help, required=True)
+    parser.add_argument('-C', '--community', help=comm_help, required=False)
+    parser.add_argument('-w', '--warn', help=warn_help, type=float, required=True)
+    parser.add_argument('-c', '--critical', help=critical_help, type=float,
+                        required=True)
+    parser.add_argument('-i', '--include', help=include_help, action='append')
+    parser.add_argument('-e', '--exclude', help=exclude_help, action='append')
+    parser.add_argument('-a', '--all-types', help=types_help, action='store_true')
+    parser.add_argument('-p', '--port', help=port_help, type=int, default=161,
+                        required=False)
+    add_v3_arguments(parser)
+    parser.add_argument('-v', '--version',
+                        help=version_help, required=False)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Main function
+
+    :param argv: command line arguments to use instead of sys.argv
+    """
+    args = do_argparser(argv)
+
+    include = compile_patterns(args.include)
+    exclude = compile_patterns(args.exclude)
+    storage = get_filesystems(args, include, exclude)
+
+    if not storage:
+        print('UNKNOWN: no matching filesystems found')
+        sys.exit(3)
+
+    usage = []
+    for _, fs in sorted(storage.items(), key=lambda item: item[1]['descr']):
+        pct = fs['used'] * 100.0 / fs['size'] if fs['size'] else 0.0
+        usage.append((fs['descr'], pct))
+
+    criticals = ['{0} {1:.1f}%'.format(d, p) for d, p in usage if p >= args.critical]
+    warnings = ['{0} {1:.1f}%'.format(d, p) for d, p in usage
+                if args.warn <= p < args.critical]
+    perfdata = ' '.join("'{0}'={1:.1f}%;{2:g};{3:g};0;100".format(d, p, args.warn, args.critical)
+                        for d, p in usage)
+
+    if criticals:
+        print('CRITICAL: {0} | {1}'.format(', '.join(criticals + warnings), perfdata))
+        sys.exit(2)
+
+    if warnings:
+        print('WARNING: {0} | {1}'.format(', '.join(warnings), perfdata))
+        sys.exit(1)
+
+    print('OK: {0} filesystems, {1} | {2}'.format(
+        len(usage), ', '.join('{0} {1:.1f}%'.format(d, p) for d, p in usage), perfdata))
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
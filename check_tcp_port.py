@@ -31,12 +31,24 @@ from __future__ import print_function
 
 #  standard library imports
 import socket
-import argparse
 import sys
+import time
 
+# local application imports
+from nagioslib import capture
+from nagioslib.board import add_board_arguments, board_result
+from nagioslib.breaker import check_breaker, record_success, record_timeout
+from nagioslib.result import Result
+
+
+def do_argparser(argv=None):
+    """
+    Parse and return command line arguments
+
+    :param argv: arguments to parse instead of sys.argv
+    """
+    import argparse
 
-def do_argparser():
-    """Parse and return command line arguments"""
     host_help = 'Host to check, i.e. 127.0.0.1'
     port_help = 'port to check, i.e. 80'
     timeout_help = 'optional timeout, default is 5 seconds'
@@ -47,45 +59,72 @@ def do_argparser():
     parser.add_argument('-p', '--port', help=port_help, type=int, required=True)
     parser.add_argument('-t', '--timeout', help=timeout_help, type=float,
                         required=False)
+    add_board_arguments(parser)
     parser.add_argument('-v', '--version',
                         help=version_help, required=False)
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
 def socket_connect(host, port, timeout):
     """
-    Return an exit code based on success or failure of a TCP socket connection.
-    Exit code of 2 is returned for a failure and exit code of 0 is returned for
-    a success.
+    Make a TCP socket connection, exiting with code 2 if it fails
 
     :param host: hostname or IP of host
     :param port: port to connect to
     :param timeout: timeout in seconds for the connection
     """
+    key = '{0}:{1}'.format(host, port)
+    if capture.replaying():
+        capture.replay('tcp', key)
+        return
+
     try:
         sock = socket.socket()
         sock.settimeout(timeout)
         sock.connect((host, port))
     except socket.timeout as err:
+        record_timeout(host)
         print('CRITICAL: Connection to port {0} failed: {1}'.format(port, err))
         sys.exit(2)
     else:
-        print('OK: Connection to port {0} successful'.format(port))
-        sys.exit(0)
+        record_success(host)
+        capture.record('tcp', key, b'')
     finally:
         sock.close()
 
 
-def main():
-    """Main function"""
-    args = do_argparser()
-    host = args.host
-    port = args.port
+def collect(args):
+    """
+    Return a Result of the values and text main() reports: the seconds taken
+    to connect and no text
+
+    :param args: parsed command line arguments
+    """
     if args.timeout:
         timeout = args.timeout
     else:
         timeout = 5.0
-    socket_connect(host, port, timeout)
+    check_breaker(args.host, 2)
+    started = time.time()
+    socket_connect(args.host, args.port, timeout)
+    elapsed = time.time() - started
+    return Result(started=started, elapsed=elapsed, values=(elapsed,))
+
+
+def main(argv=None):
+    """
+    Main function
+
+    :param argv: command line arguments to use instead of sys.argv
+    """
+    args = do_argparser(argv)
+    if args.board:
+        values = board_result('check_tcp_port', args).values
+    else:
+        values = collect(args).values
+    print('OK: Connection to port {0} successful | time={1:.6f}s;;;0'.format(
+        args.port, values[0]))
+    sys.exit(0)
 
 
 if __name__ == "__main__":
@@ -14,6 +14,18 @@
 # equal to or greater than the critical value. Setting a warning value of no
 # less than 1 minute is recommended.
 #
+# The host is taken to have read its clock halfway through the SNMP round
+# trip, so network latency does not count as drift.
+#
+# With --fleet, the hosts listed one per line in a file are queried at once
+# and each is compared with the median offset of the fleet rather than with
+# the poller's clock, so the check keeps working when the poller itself drifts.
+# A host is reported when its deviation from the median is at least the
+# warning or critical value and it is an outlier: its deviation is more than
+# --mad times the median absolute deviation of the fleet (scaled to match a
+# standard deviation). Hosts that do not answer are counted but do not fail
+# the check unless fewer than 3 answer.
+#
 # Example Nagios command for commands.cfg (or where your command templates are stored):
 #
 # define command {
@@ -28,60 +40,40 @@
 #     check_command check_time!secretpass!1!5
 # }
 #
+# define command {
+#     command_name check_time_fleet
+#     command_line $USER1$/check_time.py --fleet $ARG1$ -C $ARG2$ -w $ARG3$ -c $ARG4$
+# }
+#
 
 from __future__ import print_function
 
 #  standard library imports
-import argparse
+import calendar
 import sys
 from datetime import datetime, timedelta
 
-# related third party imports
-from pysnmp.entity.rfc3413.oneliner import cmdgen
-
-
-class SNMPData(object): # pylint: disable=I0011,R0903
-    """
-    Make an SNMP connection and return the results with do_snmpget()
-
-    :param community: SNMP community password for host
-    :param host: hostname or IP of host
-    """
-    def __init__(self, community, host):
-        self.community = community
-        self.host = host
-
-    @staticmethod
-    def do_snmpget(community, host, oid):
-        """
-        Return the results of an snmpget
-
-        :param community: SNMP community password for host
-        :param host: hostname or IP of host
-        :param oid: SNMP oid to retrieve data from the host
-        """
-        cmd_gen = cmdgen.CommandGenerator()
-        err_found, err_status, err_index, var_binds = cmd_gen.getCmd(
-            cmdgen.CommunityData(community),
-            cmdgen.UdpTransportTarget((host, 161)), *oid)
-        if err_found:
-            print('UNKNOWN: {0} {1} {2}'.format(err_found, err_status, err_index))
-            sys.exit(3)
-        return var_binds
+# local application imports
+from nagioslib.board import add_board_arguments, board_result
+from nagioslib.output import run_captured, thread_output
+from nagioslib.result import Result
+from nagioslib.snmp import SNMPData, add_v3_arguments, date_and_time, snmp_auth
 
 
 class TimeData(SNMPData):
     """
     Return the formatted results of an snmpget for system time data
 
-    :param community: SNMP community password for host
+    :param community: SNMP community password for host, or V3Credentials
     :param host: hostname or IP of host
+    :param port: SNMP port of host
     """
-    def __init__(self, community, host):
-        self.oids = [(('HOST-RESOURCES-MIB', 'hrSystemDate'), 0)]
-        self.data = self.do_snmpget(community, host, self.oids)
-        self.host_ts = self.data[0][1].prettyPrint().split(',')
-        super(TimeData, self).__init__(community, host)
+    def __init__(self, community, host, port=161):
+        self.oids = ['1.3.6.1.2.1.25.1.2.0']
+        self.data, self.sent, self.received = self.do_timed_snmpget(
+            community, host, self.oids, port)
+        self.host_ts = date_and_time(self.data[0][1]).split(',')
+        super(TimeData, self).__init__(community, host, port)
 
     @staticmethod
     def convert_to_utc(dto, offset):
@@ -108,45 +100,208 @@ class TimeData(SNMPData):
         host_dt_utc = self.convert_to_utc(host_dt, host_offset)
         return host_dt_utc
 
+    def host_timestamp(self):
+        """Return host time as a UNIX timestamp"""
+        host_now = self.host_time_utc()
+        return calendar.timegm(host_now.timetuple()) + host_now.microsecond / 1e6
+
+    def local_timestamp(self):
+        """
+        Return the local time the host read its clock at, taken to be halfway
+        through the round trip
+        """
+        return (self.sent + self.received) / 2.0
+
+    def offset(self):
+        """Return the seconds the host's clock is ahead of the local clock"""
+        return self.host_timestamp() - self.local_timestamp()
+
+
+def median(values):
+    """
+    Return the median of a list of numbers
+
+    :param values: non-empty list of numbers
+    """
+    ordered = sorted(values)
+    mid = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[mid]
+    return (ordered[mid - 1] + ordered[mid]) / 2.0
+
+
+def read_fleet(path, port):
+    """
+    Return the hosts listed in a fleet file as (name, host, port) tuples, the
+    name being host:port for hosts listed with a port. Each line holds a host,
+    optionally followed by its SNMP port; blank lines and comments are
+    skipped.
+
+    :param path: path of the fleet file
+    :param port: SNMP port of hosts listed without one
+    """
+    hosts = []
+    with open(path) as fleet:
+        for line in fleet:
+            fields = line.split()
+            if fields and not fields[0].startswith('#'):
+                if len(fields) > 1:
+                    hosts.append(('{0}:{1}'.format(*fields[:2]), fields[0], int(fields[1])))
+                else:
+                    hosts.append((fields[0], fields[0], port))
+    return hosts
+
+
+def fleet_offsets(auth, hosts, max_inflight):
+    """
+    Query the clocks of hosts concurrently and return a dict of the offset in
+    seconds of each host that answered and a dict of the output of each that
+    did not, both by name
+
+    :param auth: SNMP community password, or V3Credentials
+    :param hosts: list of (name, host, port) tuples from read_fleet()
+    :param max_inflight: most hosts queried at once
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def query(target):
+        """Return the exit code, output and offset of one host"""
+        return run_captured(output, lambda: TimeData(auth, target[1], target[2]).offset())
+
+    with thread_output() as output:
+        with ThreadPoolExecutor(max_inflight) as executor:
+            results = list(executor.map(query, hosts))
+    offsets = {}
+    failures = {}
+    for (name, _, _), (code, text, offset) in zip(hosts, results):
+        if code:
+            failures[name] = text
+        else:
+            offsets[name] = offset
+    return offsets, failures
+
+
+def fleet_main(args):
+    """
+    Check the clocks of a fleet of hosts against the fleet's median
+
+    :param args: parsed command line arguments
+    """
+    hosts = read_fleet(args.fleet, args.port)
+    offsets, failures = fleet_offsets(snmp_auth(args), hosts, args.max_inflight)
+    if len(offsets) < 3:
+        print('UNKNOWN: only {0} of {1} hosts answered'.format(len(offsets), len(hosts)))
+        sys.exit(3)
+
+    fleet = median(list(offsets.values()))
+    deviations = dict((host, offset - fleet) for host, offset in offsets.items())
+    # 1.4826 * MAD estimates the standard deviation of normally distributed offsets
+    spread = 1.4826 * median([abs(dev) for dev in deviations.values()])
+    outliers = sorted(((host, dev) for host, dev in deviations.items()
+                       if abs(dev) > args.mad * spread), key=lambda i: -abs(i[1]))
+    critical = [(host, dev) for host, dev in outliers if abs(dev) / 60.0 >= args.critical]
+    warn = [(host, dev) for host, dev in outliers if abs(dev) / 60.0 >= args.warn]
+
+    perfdata = 'median_offset={0:.3f}s spread={1:.3f}s hosts={2} outliers={3} unanswered={4}'.format(
+        fleet, spread, len(offsets), len(warn), len(failures))
+    summary = '{0} of {1} hosts answered, poller is {2:+.3f}s from the fleet median'.format(
+        len(offsets), len(hosts), -fleet)
+    drifting = ', '.join('{0} {1:+.3f}s'.format(host, dev) for host, dev in (critical or warn))
+
+    if critical:
+        print('CRITICAL: drifting from the fleet: {0}; {1} | {2}'.format(drifting, summary, perfdata))
+        sys.exit(2)
+
+    if warn:
+        print('WARNING: drifting from the fleet: {0}; {1} | {2}'.format(drifting, summary, perfdata))
+        sys.exit(1)
+
+    print('OK: {0} | {1}'.format(summary, perfdata))
+    sys.exit(0)
+
+
+def do_argparser(argv=None):
+    """
+    Parse and return command line arguments
+
+    :param argv: arguments to parse instead of sys.argv
+    """
+    import argparse
 
-def do_argparser():
-    """Parse and return command line arguments"""
     host_help = 'Host to check, i.e. 127.0.0.1'
-    comm_help = 'SNMP community password'
+    fleet_help = 'File listing hosts, and optionally their ports, to check against each other instead of a host'
+    comm_help = 'SNMP community password, unless an SNMPv3 user is given'
+    port_help = 'Optional: SNMP port, defaults to 161'
     warn_help = 'Drift in minutes to generate a warning'
     critical_help = 'Drift in minutes to generate a critical alert'
+    mad_help = '''Optional: deviations from the fleet median, in scaled median absolute
+    deviations, that make a host an outlier with --fleet, defaults to 3.5'''
+    inflight_help = 'Optional: most hosts queried at once with --fleet, defaults to 32'
     version_help = 'check_time.py, Version 1.0.0, 2017'
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('-H', '--host', help=host_help, required=True)
-    parser.add_argument('-C', '--community', help=comm_help, required=True)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('-H', '--host', help=host_help)
+    target.add_argument('-F', '--fleet', help=fleet_help)
+    parser.add_argument('-C', '--community', help=comm_help, required=False)
     parser.add_argument('-w', '--warn', help=warn_help, type=float,
                         required=True)
     parser.add_argument('-c', '--critical', help=critical_help, type=float,
                         required=True)
+    parser.add_argument('-p', '--port', help=port_help, type=int, default=161,
+                        required=False)
+    parser.add_argument('--mad', help=mad_help, type=float, default=3.5)
+    parser.add_argument('-j', '--max-inflight', help=inflight_help, type=int,
+                        default=32)
+    add_v3_arguments(parser)
+    add_board_arguments(parser)
     parser.add_argument('-v', '--version',
                         help=version_help, required=False)
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
-def main():
-    """Main function"""
-    args = do_argparser()
+def collect(args):
+    """
+    Return a Result of the values and text main() checks against the
+    thresholds: the host's time and the local time it was read at, as UNIX
+    timestamps, and no text
+
+    :param args: parsed command line arguments
+    """
+    data = TimeData(snmp_auth(args), args.host, args.port)
+    return Result(values=(data.host_timestamp(), data.local_timestamp()))
+
+
+def main(argv=None):
+    """
+    Main function
+
+    :param argv: command line arguments to use instead of sys.argv
+    """
+    args = do_argparser(argv)
+
+    if args.fleet:
+        fleet_main(args)
 
-    host_now = TimeData(args.community, args.host).host_time_utc()
-    now = datetime.utcnow()
-    diff = round(abs(now - host_now).seconds / 60.0, 3)
+    if args.board:
+        values = board_result('check_time', args).values
+    else:
+        values = collect(args).values
+    host_now = datetime.utcfromtimestamp(values[0])
+    diff = round(abs(values[0] - values[1]) / 60.0, 3)
+    perfdata = 'drift={0:.3f}s;{1:g};{2:g};0'.format(abs(values[0] - values[1]),
+                                                     args.warn * 60, args.critical * 60)
 
     if diff >= args.critical:
-        print('CRITICAL: drift is {0}, time is {1} UTC'.format(diff, host_now))
+        print('CRITICAL: drift is {0}, time is {1} UTC | {2}'.format(diff, host_now, perfdata))
         sys.exit(2)
 
     if diff >= args.warn:
-        print('WARNING: drift is {0}, time is {1} UTC'.format(diff, host_now))
+        print('WARNING: drift is {0}, time is {1} UTC | {2}'.format(diff, host_now, perfdata))
         sys.exit(1)
 
     if diff < args.warn:
-        print('OK: drift is {0}, time is {1} UTC'.format(diff, host_now))
+        print('OK: drift is {0}, time is {1} UTC | {2}'.format(diff, host_now, perfdata))
         sys.exit(0)
 
 
@@ -33,55 +33,27 @@
 from __future__ import print_function
 
 #  standard library imports
-import argparse
 import sys
 from datetime import timedelta
 
-# related third party imports
-from pysnmp.entity.rfc3413.oneliner import cmdgen
-
-
-class SNMPData(object): # pylint: disable=I0011,R0903
-    """
-    Make an SNMP connection and return the results with do_snmpget()
-
-    :param community: SNMP community password for host
-    :param host: hostname or IP of host
-    """
-    def __init__(self, community, host):
-        self.community = community
-        self.host = host
-
-    @staticmethod
-    def do_snmpget(community, host, oid):
-        """
-        Return the results of an snmpget
-
-        :param community: SNMP community password for host
-        :param host: hostname or IP of host
-        :param oid: SNMP oid to retrieve data from the host
-        """
-        cmd_gen = cmdgen.CommandGenerator()
-        err_found, err_status, err_index, var_binds = cmd_gen.getCmd(
-            cmdgen.CommunityData(community),
-            cmdgen.UdpTransportTarget((host, 161)), *oid)
-        if err_found:
-            print('UNKNOWN: {0} {1} {2}'.format(err_found, err_status, err_index))
-            sys.exit(3)
-        return var_binds
+# local application imports
+from nagioslib.board import add_board_arguments, board_result
+from nagioslib.result import Result
+from nagioslib.snmp import SNMPData, add_v3_arguments, snmp_auth
 
 
 class UptimeData(SNMPData):
     """
     Return the formatted results of an snmpget for system uptime data
 
-    :param community: SNMP community password for host
+    :param community: SNMP community password for host, or V3Credentials
     :param host: hostname or IP of host
+    :param port: SNMP port of host
     """
-    def __init__(self, community, host):
+    def __init__(self, community, host, port=161):
         self.oids = ['1.3.6.1.2.1.25.1.1.0']
-        self.data = self.do_snmpget(community, host, self.oids)
-        super(UptimeData, self).__init__(community, host)
+        self.data = self.do_snmpget(community, host, self.oids, port)
+        super(UptimeData, self).__init__(community, host, port)
 
     def uptime(self):
         """Return uptime in seconds"""
@@ -109,10 +81,17 @@ def to_seconds(val, timetype):
         return val * 86400.0
 
 
-def do_argparser():
-    """Parse and return command line arguments"""
+def do_argparser(argv=None):
+    """
+    Parse and return command line arguments
+
+    :param argv: arguments to parse instead of sys.argv
+    """
+    import argparse
+
     host_help = 'Host to check, i.e. 127.0.0.1'
-    comm_help = 'SNMP community password'
+    comm_help = 'SNMP community password, unless an SNMPv3 user is given'
+    port_help = 'Optional: SNMP port, defaults to 161'
     warn_help = 'Length of uptime to generate a warning'
     critical_help = 'Length of uptime to generate a critical alert'
     op_help = '''Operator to use with critical and warning values; greater than
@@ -124,7 +103,7 @@ def do_argparser():
     parser.add_argument('-H', '--host',
                         help=host_help, required=True)
     parser.add_argument('-C', '--community',
-                        help=comm_help, required=True)
+                        help=comm_help, required=False)
     parser.add_argument('-w', '--warn',
                         help=warn_help, type=float, required=True)
     parser.add_argument('-c', '--critical',
@@ -133,40 +112,63 @@ def do_argparser():
                         help=op_help, required=True)
     parser.add_argument('-t', '--timetype',
                         help=tt_help, required=True)
+    parser.add_argument('-p', '--port', help=port_help, type=int, default=161,
+                        required=False)
+    add_v3_arguments(parser)
+    add_board_arguments(parser)
     parser.add_argument('-v', '--version',
                         help=version_help, required=False)
-    return parser.parse_args()
+    return parser.parse_args(argv)
+
 
+def collect(args):
+    """
+    Return a Result of the values and text main() checks against the
+    thresholds: the uptime in seconds and no text
+
+    :param args: parsed command line arguments
+    """
+    return Result(values=(UptimeData(snmp_auth(args), args.host, args.port).uptime(),))
 
-def main():
-    """Main function"""
-    args = do_argparser()
 
-    uptime_seconds = UptimeData(args.community, args.host).uptime()
+def main(argv=None):
+    """
+    Main function
+
+    :param argv: command line arguments to use instead of sys.argv
+    """
+    args = do_argparser(argv)
+
+    if args.board:
+        values = board_result('check_uptime', args).values
+    else:
+        values = collect(args).values
+    uptime_seconds = values[0]
     pretty_uptime = timedelta(seconds=uptime_seconds)
     user_warn = to_seconds(args.warn, args.timetype)
     user_critical = to_seconds(args.critical, args.timetype)
+    perfdata = 'uptime={0:.0f}s;{1:.0f};{2:.0f};0'.format(uptime_seconds, user_warn, user_critical)
 
     if args.operator == 'lt':
         if uptime_seconds <= user_critical:
-            print('CRITICAL: server uptime is {0}'.format(pretty_uptime))
+            print('CRITICAL: server uptime is {0} | {1}'.format(pretty_uptime, perfdata))
             sys.exit(2)
         elif uptime_seconds <= user_warn:
-            print('WARNING: server uptime is {0}'.format(pretty_uptime))
+            print('WARNING: server uptime is {0} | {1}'.format(pretty_uptime, perfdata))
             sys.exit(1)
         elif uptime_seconds > user_warn:
-            print('OK: server uptime is {0}'.format(pretty_uptime))
+            print('OK: server uptime is {0} | {1}'.format(pretty_uptime, perfdata))
             sys.exit(0)
 
     if args.operator == 'gt':
         if uptime_seconds >= user_critical:
-            print('CRITICAL: server uptime is {0}'.format(pretty_uptime))
+            print('CRITICAL: server uptime is {0} | {1}'.format(pretty_uptime, perfdata))
             sys.exit(2)
         elif uptime_seconds >= user_warn:
-            print('WARNING: server uptime is {0}'.format(pretty_uptime))
+            print('WARNING: server uptime is {0} | {1}'.format(pretty_uptime, perfdata))
             sys.exit(1)
         elif uptime_seconds < user_warn:
-            print('OK: server uptime is {0}'.format(pretty_uptime))
+            print('OK: server uptime is {0} | {1}'.format(pretty_uptime, perfdata))
             sys.exit(0)
 
 
@@ -29,41 +29,13 @@
 from __future__ import print_function
 
 #  standard library imports
-import argparse
 import sys
 
-# related third party imports
-from pysnmp.entity.rfc3413.oneliner import cmdgen
-
-
-class SNMPData(object): # pylint: disable=I0011,R0903
-    """
-    Make an SNMP connection and return the results with do_snmpget()
-
-    :param community: SNMP community password for host
-    :param host: hostname or IP of host
-    """
-    def __init__(self, community, host):
-        self.community = community
-        self.host = host
-
-    @staticmethod
-    def do_snmpget(community, host, oid):
-        """
-        Return the results of an snmpget
-
-        :param community: SNMP community password for host
-        :param host: hostname or IP of host
-        :param oid: SNMP oid to retrieve data from the host
-        """
-        cmd_gen = cmdgen.CommandGenerator()
-        err_found, err_status, err_index, var_binds = cmd_gen.getCmd(
-            cmdgen.CommunityData(community),
-            cmdgen.UdpTransportTarget((host, 161)), *oid)
-        if err_found:
-            print('UNKNOWN: {0} {1} {2}'.format(err_found, err_status, err_index))
-            sys.exit(3)
-        return var_binds
+# local application imports
+from nagioslib.board import add_board_arguments, board_result
+from nagioslib.history import add_trend_arguments, record_history, trend_text, trend_values
+from nagioslib.result import Result
+from nagioslib.snmp import SNMPData, add_v3_arguments, snmp_auth
 
 
 class UserData(SNMPData):
@@ -71,23 +43,31 @@ class UserData(SNMPData):
     Return the formatted results of an snmpget for the number of logged in
     Unix users
 
-    :param community: SNMP community password for host
+    :param community: SNMP community password for host, or V3Credentials
     :param host: hostname or IP of host
+    :param port: SNMP port of host
     """
-    def __init__(self, community, host):
+    def __init__(self, community, host, port=161):
         self.oids = ['1.3.6.1.2.1.25.1.5.0']
-        self.data = self.do_snmpget(community, host, self.oids)
-        super(UserData, self).__init__(community, host)
+        self.data = self.do_snmpget(community, host, self.oids, port)
+        super(UserData, self).__init__(community, host, port)
 
     def user_count(self):
         """Return the number of logged in system users"""
         return int(self.data[0][1])
 
 
-def do_argparser():
-    """Parse and return command line arguments"""
+def do_argparser(argv=None):
+    """
+    Parse and return command line arguments
+
+    :param argv: arguments to parse instead of sys.argv
+    """
+    import argparse
+
     host_help = 'Host to check, i.e. 127.0.0.1'
-    comm_help = 'SNMP community password'
+    comm_help = 'SNMP community password, unless an SNMPv3 user is given'
+    port_help = 'Optional: SNMP port, defaults to 161'
     warn_help = 'Number of logged in users to generate a warning'
     critical_help = 'Number of logged in users to generate a critical alert'
     version_help = 'check_users.py, Version 1.0.0, 2017'
@@ -96,32 +76,68 @@ def do_argparser():
     parser.add_argument('-H', '--host',
                         help=host_help, required=True)
     parser.add_argument('-C', '--community',
-                        help=comm_help, required=True)
+                        help=comm_help, required=False)
     parser.add_argument('-w', '--warn',
-                        help=warn_help, type=int, required=True)
+                        help=warn_help, type=float, required=True)
     parser.add_argument('-c', '--critical',
-                        help=critical_help, type=int, required=True)
+                        help=critical_help, type=float, required=True)
+    parser.add_argument('-p', '--port', help=port_help, type=int, default=161,
+                        required=False)
+    add_v3_arguments(parser)
+    add_board_arguments(parser)
+    add_trend_arguments(parser)
     parser.add_argument('-v', '--version',
                         help=version_help, required=False)
-    return parser.parse_args()
+    return parser.parse_args(argv)
+
+
+def collect(args):
+    """
+    Return a Result of the values and text main() checks against the
+    thresholds: the number of logged in users and no text, recording it with
+    --trend
 
+    :param args: parsed command line arguments
+    """
+    users = UserData(snmp_auth(args), args.host, args.port).user_count()
+    if args.trend:
+        record_history('check_users', '{0}_{1}'.format(args.host, args.port),
+                       ('users',), (users,))
+    return Result(values=(users,))
 
-def main():
-    """Main function"""
-    args = do_argparser()
 
-    users = UserData(args.community, args.host).user_count()
+def main(argv=None):
+    """
+    Main function
 
-    if users >= args.critical:
-        print('CRITICAL: {0} logged in users'.format(users))
+    :param argv: command line arguments to use instead of sys.argv
+    """
+    args = do_argparser(argv)
+
+    if args.board:
+        values = board_result('check_users', args).values
+    else:
+        values = collect(args).values
+    users = int(values[0])
+    judged = users
+    message = '{0} logged in users'.format(users)
+    perfdata = 'users={0};{1:g};{2:g};0'.format(users, args.warn, args.critical)
+
+    if args.trend:
+        judged, = trend_values('check_users', '{0}_{1}'.format(args.host, args.port),
+                               ('users',), args)
+        message += ', ' + trend_text(args, [judged])
+
+    if judged >= args.critical:
+        print('CRITICAL: {0} | {1}'.format(message, perfdata))
         sys.exit(2)
 
-    if users >= args.warn:
-        print('WARNING: {0} logged in users'.format(users))
+    if judged >= args.warn:
+        print('WARNING: {0} | {1}'.format(message, perfdata))
         sys.exit(1)
 
-    if users < args.warn:
-        print('OK: {0} logged in users'.format(users))
+    if judged < args.warn:
+        print('OK: {0} | {1}'.format(message, perfdata))
         sys.exit(0)
 
 
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+
+"""Collect check results on a schedule and publish them to the results board"""
+
+# Runs the collection half of the load, users, uptime, time, TCP port and SSL
+# checks every --interval seconds and publishes what each collected to the
+# results board in the plugin state directory. The same plugins run with
+# --board then read their latest result from the board and apply their own
+# thresholds without any network I/O, so Nagios can check as often as it likes
+# while each host is only probed once an interval, at the pace set by the same
+# limits as batch.py:
+#
+#   --max-inflight   checks running at once in total
+#   --host-inflight  checks running at once against one host
+#   --host-rate      checks started per second against one host, in bursts of
+#                    up to --host-burst
+#   --snmp-rate      SNMP requests per second sent to one agent, in bursts of
+#                    up to --snmp-burst
+#
+# Checks are listed one per line in the format batch.py reads. Thresholds are
+# required by the plugins' arguments but are not used when collecting. A check
+# that fails to collect, i.e. an unreachable host, publishes its failure and
+# every reader of it reports the same status and output until it recovers.
+#
+# Example, with one collector running as a service:
+#
+#   ./collector.py -f collect.txt --interval 60
+#
+# collect.txt:
+#
+#   check_load -H 10.0.0.1 -C secretpass -w 1,3,5 -c 5,7,9 -n
+#   check_ssl -H www.example.com -p 443 -w 30 -c 10
+#
+# Example Nagios command for commands.cfg (or where your command templates are stored):
+#
+# define command {
+#     command_name check_load_board
+#     command_line $USER1$/check_load.py -H $HOSTADDRESS$ -w $ARG1$ -c $ARG2$ -n --board
+# }
+#
+
+from __future__ import print_function
+
+#  standard library imports
+import importlib
+import sys
+import threading
+import time
+
+# local application imports
+from batch import read_checks, run_batch
+from nagioslib.board import BOARD_PATH, BOARD_SLOTS, COLLECTED, Board, board_key
+from nagioslib.output import thread_output
+from nagioslib.ratelimit import RateLimiter, limit_snmp
+from nagioslib.tls import enable_reuse
+
+
+BOARD_PLUGINS = (
+    'check_load',
+    'check_ssl',
+    'check_tcp_port',
+    'check_time',
+    'check_uptime',
+    'check_users',
+)
+
+
+class Collector(object):
+    """
+    Collects checks and publishes their results to a board
+
+    :param board: writable Board
+    :param checks: list of Check to collect
+    """
+    def __init__(self, board, checks):
+        self.board = board
+        self.lock = threading.Lock()
+        self.targets = {}
+        for check in checks:
+            if check.error is not None:
+                sys.exit(check.error)
+            if check.plugin not in BOARD_PLUGINS:
+                sys.exit('{0} cannot publish to the board'.format(check.plugin))
+            args = importlib.import_module(check.plugin).do_argparser(check.argv)
+            self.targets[id(check)] = args, board_key(check.plugin, args.host, args.port)
+
+    def collect(self, module, check):
+        """
+        Collect a check in the calling thread and publish what it collected
+
+        :param module: plugin module
+        :param check: Check to collect
+        """
+        args, key = self.targets[id(check)]
+        result = module.collect(args)
+        with self.lock:
+            self.board.publish(key, COLLECTED, result.values, result.output)
+
+    def publish_failure(self, check, code, text):
+        """
+        Publish the exit code and output of a check that failed to collect
+
+        :param check: Check that failed
+        :param code: exit code of the check
+        :param text: output of the check
+        """
+        with self.lock:
+            self.board.publish(self.targets[id(check)][1], code, (), text)
+
+
+def do_argparser(argv=None):
+    """
+    Parse and return command line arguments
+
+    :param argv: arguments to parse instead of sys.argv
+    """
+    import argparse
+
+    file_help = 'Optional: file of checks, one per line, defaults to stdin'
+    interval_help = 'Optional: seconds between collections of each check, defaults to 60'
+    once_help = 'Optional: collect every check once and exit'
+    slots_help = ('Optional: results the board can hold, defaults to {0} or twice the '
+                  'number of checks if that is more'.format(BOARD_SLOTS))
+    inflight_help = 'Optional: most checks running at once, defaults to 32'
+    host_inflight_help = 'Optional: most checks running at once against one host, defaults to 2'
+    host_rate_help = 'Optional: checks started per second against one host, defaults to 5'
+    host_burst_help = 'Optional: checks started at once against one host, defaults to 5'
+    snmp_rate_help = 'Optional: SNMP requests per second sent to one agent, defaults to 20'
+    snmp_burst_help = 'Optional: SNMP requests sent at once to one agent, defaults to 10'
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--file', help=file_help, required=False)
+    parser.add_argument('-i', '--interval', help=interval_help, type=float,
+                        default=60.0)
+    parser.add_argument('--once', help=once_help, action='store_true')
+    parser.add_argument('--slots', help=slots_help, type=int, default=BOARD_SLOTS)
+    parser.add_argument('-j', '--max-inflight', help=inflight_help, type=int,
+                        default=32)
+    parser.add_argument('--host-inflight', help=host_inflight_help, type=int,
+                        default=2)
+    parser.add_argument('--host-rate', help=host_rate_help, type=float, default=5.0)
+    parser.add_argument('--host-burst', help=host_burst_help, type=float, default=5.0)
+    parser.add_argument('--snmp-rate', help=snmp_rate_help, type=float, default=20.0)
+    parser.add_argument('--snmp-burst', help=snmp_burst_help, type=float, default=10.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Main function
+
+    :param argv: command line arguments to use instead of sys.argv
+    """
+    args = do_argparser(argv)
+
+    source = open(args.file) if args.file else sys.stdin
+    with source:
+        checks = list(read_checks(source))
+
+    # every check has a record of its own, so a board twice their number
+    # never fills and stays quick to probe
+    collector = Collector(Board(BOARD_PATH, max(args.slots, 2 * len(checks))), checks)
+    limit_snmp(args.snmp_rate, args.snmp_burst)
+    enable_reuse()
+    host_limiter = RateLimiter(args.host_rate, args.host_burst)
+    try:
+        with thread_output() as output:
+            while True:
+                started = time.time()
+                for result in run_batch(checks, output, args.max_inflight,
+                                        args.host_inflight, host_limiter, collector.collect):
+                    if result.code:
+                        collector.publish_failure(result.check, result.code, result.output)
+                if args.once:
+                    break
+                time.sleep(max(0.0, started + args.interval - time.time()))
+    finally:
+        collector.board.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+#!/usr/bin/python
+
+"""Serve the results of plugin checks as OpenMetrics for Prometheus"""
+
+# Runs the checks of a check file on scrape and serves their results, so
+# Prometheus can scrape the same probes Nagios runs instead of probing every
+# target a second time. Checks are listed one per line in the format batch.py
+# reads and run with the same limits, by one scheduler shared by every
+# scrape, so overlapping scrapes together stay within --max-inflight and the
+# per-host limits. Each result is cached for --min-interval seconds however
+# often Prometheus scrapes, and a check is never run twice at once: scrapes
+# arriving while it runs wait for its result instead, but only until just
+# before the scrape times out, then serve the last result of a check still
+# running, or UNKNOWN if it has none. Should the scheduler fail, the error is
+# logged to stderr and the scheduler restarted.
+#
+#   /metrics             every check in the file
+#   /probe?host=web1     the checks whose host_name is web1
+#
+# Every check exposes its exit status, duration and the time it ran, and
+# each value of its performance data as nagios_check_perfdata with the
+# perfdata label and unit as labels.
+#
+# Example:
+#
+#   ./exporter.py -f checks.txt --port 9720 --min-interval 30
+#
+# prometheus.yml:
+#
+#   scrape_configs:
+#     - job_name: nagios_plugins
+#       scrape_interval: 60s
+#       scrape_timeout: 50s
+#       static_configs:
+#         - targets: ['poller:9720']
+#
+
+from __future__ import print_function
+
+#  standard library imports
+import re
+import sys
+import threading
+import time
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+# local application imports
+from batch import read_checks, run_batch
+from nagioslib.output import thread_output
+from nagioslib.ratelimit import RateLimiter, limit_snmp
+from nagioslib.result import Result
+from nagioslib.tls import enable_reuse
+
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# label=value[unit] of one perfdata item, the label quoted if it has spaces
+PERFDATA_ITEM = re.compile(r"('[^']+'|[^\s=']+)=(-?[0-9.]+(?:[eE][-+]?[0-9]+)?)([a-zA-Z%]*)")
+
+# Seconds the scheduler waits for results before looking for checks a scrape
+# has asked for
+FEED_WAIT = 0.05
+
+# Seconds before the scrape timeout a scrape stops waiting for checks, to
+# leave time to render and send what it has
+SCRAPE_MARGIN = 0.5
+
+# Seconds the scheduler waits before restarting after it failed
+RESTART_WAIT = 1.0
+
+
+class ResultCache(object):
+    """
+    Latest Result of each check, run again once older than min_interval.
+    Iterating over it yields the checks scrapes are waiting for, to feed one
+    run_batch() shared by every scrape, whose Results store() keeps.
+
+    :param min_interval: seconds a Result is served before its check runs
+                         again
+    """
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.inflight = {}
+        self.pending = queue.Queue()
+
+    def __iter__(self):
+        """
+        Yield each check a scrape has asked to run, forever, and FEED_WAIT
+        whenever there is none
+        """
+        while True:
+            try:
+                yield self.pending.get_nowait()
+            except queue.Empty:
+                yield FEED_WAIT
+
+    def store(self, results):
+        """
+        Keep each Result as it completes and wake the scrapes waiting for it
+
+        :param results: iterable of Result, i.e. from run_batch()
+        """
+        for result in results:
+            with self.lock:
+                self.cache[id(result.check)] = result
+                event = self.inflight.pop(id(result.check), None)
+            if event is not None:
+                event.set()
+
+    def schedule(self, run):
+        """
+        Store the Results of run(self) forever, logging the error and starting
+        it over if it fails, after waking the scrapes waiting for the checks
+        it was running or had queued
+
+        :param run: function returning the Results of the checks it is fed,
+                    i.e. run_batch() with its other arguments bound
+        """
+        while True:
+            try:
+                self.store(run(self))
+            except Exception: # pylint: disable=I0011,W0703
+                traceback.print_exc()
+            with self.lock:
+                while not self.pending.empty():
+                    self.pending.get_nowait()
+                events = list(self.inflight.values())
+                self.inflight.clear()
+            for event in events:
+                event.set()
+            time.sleep(RESTART_WAIT)
+
+    def results(self, checks, timeout):
+        """
+        Return the Result of each check, queueing the checks whose Result is
+        missing or too old unless they are already running, and waiting for
+        them for up to timeout seconds; a check still running after that gets
+        its last Result, or an UNKNOWN one if it has none
+
+        :param checks: list of Check to return the Results of
+        :param timeout: seconds to wait for the checks to run
+        """
+        now = time.time()
+        waiting = []
+        with self.lock:
+            for check in checks:
+                cached = self.cache.get(id(check))
+                if cached is not None and now - cached.started < self.min_interval:
+                    continue
+                event = self.inflight.get(id(check))
+                if event is None:
+                    event = self.inflight[id(check)] = threading.Event()
+                    self.pending.put(check)
+                waiting.append(event)
+
+        deadline = now + timeout
+        for event in waiting:
+            if not event.wait(max(deadline - time.time(), 0)):
+                break
+        results = []
+        with self.lock:
+            for check in checks:
+                result = self.cache.get(id(check))
+                if result is None:
+                    result = Result(check, 3, 'UNKNOWN: no result within the scrape timeout',
+                                    now)
+                results.append(result)
+        return results
+
+
+def perfdata_values(output):
+    """
+    Return the (label, value, unit) of each item of a plugin's performance
+    data
+
+    :param output: output of the plugin on one line
+    """
+    if '|' not in output:
+        return []
+    perfdata = output.split('|', 1)[1].split('\\n', 1)[0]
+    return [(label.strip("'"), float(value), unit)
+            for label, value, unit in PERFDATA_ITEM.findall(perfdata)]
+
+
+def labels(**values):
+    """
+    Return OpenMetrics labels, escaped
+
+    :param values: label values by name
+    """
+    escape = lambda val: val.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join('{0}="{1}"'.format(name, escape(str(values[name])))
+                          for name in sorted(values)) + '}'
+
+
+def render(results):
+    """
+    Return the OpenMetrics exposition of check results
+
+    :param results: list of Result
+    """
+    lines = [
+        '# TYPE nagios_check_status gauge',
+        '# HELP nagios_check_status Exit status of the check, 0 OK, 1 WARNING, 2 CRITICAL, 3 UNKNOWN',
+    ]
+    lines += ['nagios_check_status{0} {1}'.format(
+        labels(host=r.check.host_name, service=r.check.service), r.code) for r in results]
+    lines += [
+        '# TYPE nagios_check_duration_seconds gauge',
+        '# UNIT nagios_check_duration_seconds seconds',
+        '# HELP nagios_check_duration_seconds Seconds the check took',
+    ]
+    lines += ['nagios_check_duration_seconds{0} {1:.6f}'.format(
+        labels(host=r.check.host_name, service=r.check.service), r.elapsed) for r in results]
+    lines += [
+        '# TYPE nagios_check_timestamp_seconds gauge',
+        '# UNIT nagios_check_timestamp_seconds seconds',
+        '# HELP nagios_check_timestamp_seconds Time the check ran',
+    ]
+    lines += ['nagios_check_timestamp_seconds{0} {1:.3f}'.format(
+        labels(host=r.check.host_name, service=r.check.service), r.started) for r in results]
+    lines += [
+        '# TYPE nagios_check_perfdata gauge',
+        '# HELP nagios_check_perfdata Performance data value reported by the check',
+    ]
+    for r in results:
+        for label, value, unit in perfdata_values(r.output):
+            lines.append('nagios_check_perfdata{0} {1!r}'.format(
+                labels(host=r.check.host_name, service=r.check.service, label=label,
+                       unit=unit), value))
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server answering each scrape in a thread of its own"""
+    daemon_threads = True
+
+
+def make_handler(cache, checks, scrape_timeout):
+    """
+    Return the request handler class serving scrapes of checks
+
+    :param cache: ResultCache of the checks
+    :param checks: list of Check to serve
+    :param scrape_timeout: seconds a scrape may take when Prometheus does not
+                           say
+    """
+    class ScrapeHandler(BaseHTTPRequestHandler):
+        """Answers /metrics and /probe scrapes"""
+        def do_GET(self): # pylint: disable=I0011,C0103
+            """Serve the results of the checks the path asks for"""
+            url = urlparse(self.path)
+            if url.path == '/metrics':
+                wanted = checks
+            elif url.path == '/probe':
+                hosts = parse_qs(url.query).get('host', [])
+                wanted = [check for check in checks if check.host_name in hosts]
+            else:
+                self.send_error(404)
+                return
+            try:
+                timeout = float(self.headers.get('X-Prometheus-Scrape-Timeout-Seconds',
+                                                 scrape_timeout))
+            except ValueError:
+                timeout = scrape_timeout
+            results = cache.results(wanted, max(timeout - SCRAPE_MARGIN, 0))
+            body = render(results).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args): # pylint: disable=I0011,W0221
+            """Do not log every scrape"""
+            pass
+
+    return ScrapeHandler
+
+
+def do_argparser(argv=None):
+    """
+    Parse and return command line arguments
+
+    :param argv: arguments to parse instead of sys.argv
+    """
+    import argparse
+
+    file_help = 'Optional: file of checks, one per line, defaults to stdin'
+    listen_help = 'Optional: address to listen on, defaults to all'
+    port_help = 'Optional: port to listen on, defaults to 9720'
+    min_interval_help = 'Optional: seconds a result is served before its check runs again, defaults to 30'
+    scrape_timeout_help = 'Optional: seconds a scrape may take if Prometheus does not send its scrape timeout, defaults to 10'
+    inflight_help = 'Optional: most checks running at once, defaults to 32'
+    host_inflight_help = 'Optional: most checks running at once against one host, defaults to 2'
+    host_rate_help = 'Optional: checks started per second against one host, defaults to 5'
+    host_burst_help = 'Optional: checks started at once against one host, defaults to 5'
+    snmp_rate_help = 'Optional: SNMP requests per second sent to one agent, defaults to 20'
+    snmp_burst_help = 'Optional: SNMP requests sent at once to one agent, defaults to 10'
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--file', help=file_help, required=False)
+    parser.add_argument('-l', '--listen', help=listen_help, default='')
+    parser.add_argument('-p', '--port', help=port_help, type=int, default=9720)
+    parser.add_argument('--min-interval', help=min_interval_help, type=float,
+                        default=30.0)
+    parser.add_argument('--scrape-timeout', help=scrape_timeout_help, type=float,
+                        default=10.0)
+    parser.add_argument('-j', '--max-inflight', help=inflight_help, type=int,
+                        default=32)
+    parser.add_argument('--host-inflight', help=host_inflight_help, type=int,
+                        default=2)
+    parser.add_argument('--host-rate', help=host_rate_help, type=float, default=5.0)
+    parser.add_argument('--host-burst', help=host_burst_help, type=float, default=5.0)
+    parser.add_argument('--snmp-rate', help=snmp_rate_help, type=float, default=20.0)
+    parser.add_argument('--snmp-burst', help=snmp_burst_help, type=float, default=10.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Main function
+
+    :param argv: command line arguments to use instead of sys.argv
+    """
+    args = do_argparser(argv)
+
+    source = open(args.file) if args.file else sys.stdin
+    with source:
+        checks = list(read_checks(source))
+
+    limit_snmp(args.snmp_rate, args.snmp_burst)
+    enable_reuse()
+    host_limiter = RateLimiter(args.host_rate, args.host_burst)
+    cache = ResultCache(args.min_interval)
+    with thread_output() as output:
+        scheduler = threading.Thread(target=cache.schedule, args=(
+            lambda feed: run_batch(feed, output, args.max_inflight, args.host_inflight,
+                                   host_limiter),))
+        scheduler.daemon = True
+        scheduler.start()
+        handler = make_handler(cache, checks, args.scrape_timeout)
+        server = ThreadingHTTPServer((args.listen, args.port), handler)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
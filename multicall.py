@@ -0,0 +1,102 @@
+#!/usr/bin/python
+
+"""Multi-call entry point dispatching to the plugins on argv[0]"""
+
+# Runs the plugin named by the executable it was invoked as, busybox-style, so
+# all plugins can ship as one file. Either symlink the plugin names to it:
+#
+#   ./multicall.py --links /usr/local/nagios/libexec
+#   /usr/local/nagios/libexec/check_load -H 127.0.0.1 -C secretpass -w 1,3,5 -c 5,7,9
+#
+# or give the plugin name as the first argument:
+#
+#   ./multicall.py check_load -H 127.0.0.1 -C secretpass -w 1,3,5 -c 5,7,9
+#
+# To build a single-file zipapp containing every plugin:
+#
+#   mkdir build && cp -r *.py nagioslib build/ && rm build/benchmark.py
+#   python3 -m zipapp build -m multicall:main -p '/usr/bin/env python3' -o nagios-plugins.pyz
+#
+# Example Nagios command for commands.cfg (or where your command templates are stored):
+#
+# define command {
+#     command_name check_load
+#     command_line $USER1$/check_load -H $HOSTADDRESS$ -C $ARG1$ -w $ARG2$ -c $ARG3$
+# }
+#
+
+from __future__ import print_function
+
+#  standard library imports
+import importlib
+import os
+import sys
+
+
+PLUGINS = (
+    'check_interfaces',
+    'check_load',
+    'check_ping',
+    'check_procs',
+    'check_response_code',
+    'check_ssh',
+    'check_ssl',
+    'check_storage',
+    'check_tcp_port',
+    'check_time',
+    'check_uptime',
+    'check_users',
+)
+
+
+def plugin_name(path):
+    """
+    Return the plugin name for an executable path, i.e. check_load for
+    /usr/local/nagios/libexec/check_load.py
+
+    :param path: path the plugin was invoked as
+    """
+    name = os.path.basename(path)
+    for suffix in ('.py', '.pyz'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+def make_links(directory):
+    """
+    Create a symlink named after each plugin pointing at this executable
+
+    :param directory: directory to create the symlinks in
+    """
+    target = os.path.abspath(sys.argv[0])
+    for name in PLUGINS:
+        link = os.path.join(directory, name)
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(target, link)
+        print('{0} -> {1}'.format(link, target))
+
+
+def main():
+    """Main function"""
+    name = plugin_name(sys.argv[0])
+
+    if name not in PLUGINS and len(sys.argv) > 2 and sys.argv[1] == '--links':
+        make_links(sys.argv[2])
+        sys.exit(0)
+
+    if name not in PLUGINS and len(sys.argv) > 1:
+        name = plugin_name(sys.argv[1])
+        sys.argv = sys.argv[1:]
+
+    if name not in PLUGINS:
+        print('UNKNOWN: invoke as, or pass as first argument, one of {0}'.format(
+            ', '.join(PLUGINS)))
+        sys.exit(3)
+
+    importlib.import_module(name).main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Memory-mapped board of the latest collected result of each check"""
+
+# collector.py runs the collection half of the load, users, uptime, time, TCP
+# and SSL checks on a schedule and publishes what it collected for each host
+# and service into one file of fixed-size records. Run with --board, those
+# plugins look their record up and apply their thresholds to it without any
+# network I/O, so Nagios can run them at a high rate while the hosts are only
+# probed at the collector's pace.
+#
+# The file is a small header followed by a hash table of records, found by
+# the CRC32 of their key with linear probing. A key is the 64-byte BLAKE2b
+# digest of the plugin, host and port, so long hostnames never collide.
+#
+# Each record starts with a sequence number the single writer makes odd
+# before changing the record and even again afterwards (a seqlock): readers
+# read the sequence number, copy the record and read the sequence number
+# again, and retry unless both reads were the same even number, so they never
+# see a torn record and never block the writer.
+#
+# A record holds up to four values and a short text, or, when collection
+# failed, the status and output the check failed with.
+
+from __future__ import print_function
+
+#  standard library imports
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+
+# local application imports
+from nagioslib.result import Result
+from nagioslib.state import STATE_DIR
+
+
+BOARD_PATH = os.path.join(STATE_DIR, 'board')
+BOARD_SLOTS = 4096
+
+# Header of magic, slot count and record size, then the records: sequence,
+# key, collection time, status, values and text
+BOARD_HEADER = struct.Struct('<4sII')
+BOARD_RECORD = struct.Struct('<I64sdb4d147s')
+BOARD_SEQ = struct.Struct('<I')
+BOARD_MAGIC = b'NBD2'
+
+# Status of a record holding collected values rather than a failed check
+COLLECTED = -1
+
+# Attempts at a consistent copy of a record before giving up
+READ_RETRIES = 1000
+
+
+def board_key(plugin, host, port):
+    """
+    Return the key of a check's record, a digest of the whole check so keys
+    of long hostnames do not collide
+
+    :param plugin: name of the plugin
+    :param host: hostname or IP of host
+    :param port: port the plugin checks
+    """
+    return hashlib.blake2b('{0}\0{1}:{2}'.format(host, plugin, port).encode('utf-8'),
+                           digest_size=64).digest()
+
+
+class Board(object):
+    """
+    The board file, mapped into memory
+
+    :param path: path of the board file
+    :param slots: number of records to open the file for writing with, or None
+                  to open it read-only
+    """
+    def __init__(self, path=BOARD_PATH, slots=None):
+        self.path = path
+        if slots is None:
+            with open(path, 'rb') as board:
+                self.map = mmap.mmap(board.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.map = self.open_writable(path, slots)
+        magic, self.slots, record_size = BOARD_HEADER.unpack_from(self.map)
+        if magic != BOARD_MAGIC or record_size != BOARD_RECORD.size:
+            raise ValueError('{0} is not a board file'.format(path))
+
+    @classmethod
+    def open_writable(cls, path, slots):
+        """
+        Return a writable map of the board file, keeping the results in an
+        existing file with the same number of records
+
+        :param path: path of the board file
+        :param slots: number of records
+        """
+        try:
+            with open(path, 'r+b') as board:
+                board_map = mmap.mmap(board.fileno(), 0)
+        except (IOError, OSError, ValueError):
+            return cls.create(path, slots)
+        if (len(board_map) == BOARD_HEADER.size + slots * BOARD_RECORD.size and
+                BOARD_HEADER.unpack_from(board_map) == (BOARD_MAGIC, slots, BOARD_RECORD.size)):
+            return board_map
+        board_map.close()
+        return cls.create(path, slots)
+
+    @staticmethod
+    def create(path, slots):
+        """
+        Return a writable map of a new, empty board file, replacing any
+        existing board atomically so readers never see it half created
+
+        :param path: path of the board file
+        :param slots: number of records
+        """
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, BOARD_HEADER.size + slots * BOARD_RECORD.size)
+            board_map = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        BOARD_HEADER.pack_into(board_map, 0, BOARD_MAGIC, slots, BOARD_RECORD.size)
+        os.rename(tmp_path, path)
+        return board_map
+
+    def offsets(self, key):
+        """Yield the offsets of the records a key may be stored in, in probe order"""
+        start = zlib.crc32(key) % self.slots
+        for idx in range(self.slots):
+            yield BOARD_HEADER.size + (start + idx) % self.slots * BOARD_RECORD.size
+
+    def read(self, offset):
+        """Return a consistent copy of the record at an offset"""
+        for _ in range(READ_RETRIES):
+            seq = BOARD_SEQ.unpack_from(self.map, offset)[0]
+            if seq % 2 == 0:
+                record = BOARD_RECORD.unpack_from(self.map, offset)
+                if BOARD_SEQ.unpack_from(self.map, offset)[0] == seq:
+                    return record
+            time.sleep(0)
+        raise IOError('record at {0} of {1} kept changing'.format(offset, self.path))
+
+    def lookup(self, key):
+        """
+        Return the collection time, status, values and text of a key's
+        record, or None if there is none
+
+        :param key: record key from board_key()
+        """
+        for offset in self.offsets(key):
+            _, stored, collected, status, v0, v1, v2, v3, text = self.read(offset)
+            if stored == key:
+                return collected, status, (v0, v1, v2, v3), text.rstrip(b'\0').decode('utf-8', 'replace')
+            if stored == b'\0' * 64:
+                return None
+        return None
+
+    def publish(self, key, status, values=(), text=''):
+        """
+        Store the latest result of a check. Only one process may publish to
+        a board.
+
+        :param key: record key from board_key()
+        :param status: COLLECTED, or the exit code of a failed check
+        :param values: collected values, of which only the first four are
+                       stored
+        :param text: collected text, or the output of a failed check
+        """
+        for offset in self.offsets(key):
+            stored = BOARD_RECORD.unpack_from(self.map, offset)[1]
+            if stored in (key, b'\0' * 64):
+                break
+        else:
+            raise IOError('{0} is full'.format(self.path))
+        seq = BOARD_SEQ.unpack_from(self.map, offset)[0]
+        self.map[offset:offset + BOARD_SEQ.size] = BOARD_SEQ.pack(seq + 1)
+        values = (tuple(values) + (0.0, 0.0, 0.0, 0.0))[:4]
+        record = BOARD_RECORD.pack(seq + 1, key, time.time(), status,
+                                   *(values + (text.encode('utf-8')[:147],)))
+        # struct.pack_into() zeroes what it packs into before filling it in,
+        # which readers could take for an even sequence number, so the
+        # sequence number and the rest of the record are copied in instead
+        self.map[offset + BOARD_SEQ.size:offset + BOARD_RECORD.size] = record[BOARD_SEQ.size:]
+        self.map[offset:offset + BOARD_SEQ.size] = BOARD_SEQ.pack(seq + 2)
+
+    def close(self):
+        """Unmap the board file"""
+        self.map.close()
+
+
+def add_board_arguments(parser):
+    """
+    Add the board reader command line arguments to a plugin's argument parser
+
+    :param parser: argparse.ArgumentParser of the plugin
+    """
+    board_help = 'Optional: use the latest result published by collector.py instead of querying the host'
+    max_age_help = 'Optional: seconds before a result on the board is stale, defaults to 300'
+
+    parser.add_argument('--board', help=board_help, action='store_true')
+    parser.add_argument('--max-age', help=max_age_help, type=float, default=300.0)
+
+
+def board_result(plugin, args):
+    """
+    Return the Result collected for a check, with the values and text its
+    collect() gathered, exiting with the stored status if collection failed
+    and UNKNOWN if there is no fresh result
+
+    :param plugin: name of the plugin
+    :param args: parsed command line arguments
+    """
+    key = board_key(plugin, args.host, args.port)
+    try:
+        board = Board()
+    except (IOError, OSError, ValueError) as err:
+        print('UNKNOWN: no board to read: {0}'.format(err))
+        sys.exit(3)
+    try:
+        record = board.lookup(key)
+    finally:
+        board.close()
+
+    if record is None:
+        print('UNKNOWN: no result on the board for {0} port {1}'.format(args.host, args.port))
+        sys.exit(3)
+    collected, status, values, text = record
+    age = time.time() - collected
+    if age > args.max_age:
+        print('UNKNOWN: result on the board for {0} port {1} is {2:.0f}s old'.format(
+            args.host, args.port, age))
+        sys.exit(3)
+    if status != COLLECTED:
+        print(text)
+        sys.exit(status)
+    return Result(output=text, started=collected, values=values)
@@ -0,0 +1,120 @@
+"""Per-host circuit breaker shared between plugin runs"""
+
+# Counts consecutive timeouts talking to each host, across all plugins. Once
+# BREAKER_THRESHOLD checks in a row have timed out the breaker opens and every
+# check against the host fails straight away instead of sitting out its own
+# timeout, which frees the poller while a host or a whole site is down. Every
+# BREAKER_COOLDOWN seconds one check is let through as a probe (half-open): an
+# answer closes the breaker, another timeout keeps it open for a further
+# cooldown.
+#
+# NAGIOS_PLUGIN_BREAKER_THRESHOLD sets the number of timeouts, 0 disables the
+# breaker, and NAGIOS_PLUGIN_BREAKER_COOLDOWN the seconds between probes.
+
+from __future__ import print_function
+
+#  standard library imports
+import os
+import sys
+import time
+
+# local application imports
+from nagioslib import capture
+from nagioslib.state import read_state, state_path, write_state
+
+
+BREAKER_THRESHOLD = int(os.environ.get('NAGIOS_PLUGIN_BREAKER_THRESHOLD', 3))
+BREAKER_COOLDOWN = float(os.environ.get('NAGIOS_PLUGIN_BREAKER_COOLDOWN', 60))
+
+STATUS_NAMES = {1: 'WARNING', 2: 'CRITICAL', 3: 'UNKNOWN'}
+
+
+def load_breaker(host):
+    """
+    Return the number of consecutive timeouts of a host and the time the
+    next probe is due while its breaker is open
+
+    :param host: hostname or IP of host
+    """
+    cached = read_state(state_path('breaker', host))
+    try:
+        failures, probe_at = cached.split()
+        return int(failures), float(probe_at)
+    except (AttributeError, ValueError):
+        return 0, 0.0
+
+
+def save_breaker(host, failures, probe_at):
+    """
+    Store the number of consecutive timeouts of a host and the time the next
+    probe is due
+
+    :param host: hostname or IP of host
+    :param failures: number of consecutive timeouts
+    :param probe_at: time the next probe is due while the breaker is open
+    """
+    write_state(state_path('breaker', host),
+                '{0} {1:.3f}'.format(failures, probe_at).encode('ascii'))
+
+
+def breaker_open(host):
+    """
+    Return why checks against a host should fail straight away if its
+    breaker is open, otherwise None. When a probe is due the caller becomes
+    the probe, and the next probe is pushed back a cooldown so concurrent
+    checks keep failing fast while it runs.
+
+    :param host: hostname or IP of host
+    """
+    if BREAKER_THRESHOLD <= 0 or capture.replaying():
+        return None
+    failures, probe_at = load_breaker(host)
+    if failures < BREAKER_THRESHOLD:
+        return None
+    now = time.time()
+    if now >= probe_at:
+        save_breaker(host, failures, now + BREAKER_COOLDOWN)
+        return None
+    return '{0} unreachable after {1} consecutive timeouts, next probe in {2:.0f}s'.format(
+        host, failures, probe_at - now)
+
+
+def check_breaker(host, code=3):
+    """
+    Exit with the given code straight away if the breaker of a host is open,
+    otherwise return
+
+    :param host: hostname or IP of host
+    :param code: exit code of a check failing fast
+    """
+    reason = breaker_open(host)
+    if reason is not None:
+        print('{0}: {1}'.format(STATUS_NAMES[code], reason))
+        sys.exit(code)
+
+
+def record_timeout(host):
+    """
+    Count a timeout talking to a host, opening its breaker once there have
+    been BREAKER_THRESHOLD in a row
+
+    :param host: hostname or IP of host
+    """
+    if BREAKER_THRESHOLD <= 0:
+        return
+    failures, probe_at = load_breaker(host)
+    failures += 1
+    if failures >= BREAKER_THRESHOLD and probe_at < time.time():
+        probe_at = time.time() + BREAKER_COOLDOWN
+    save_breaker(host, failures, probe_at)
+
+
+def record_success(host):
+    """
+    Close the breaker of a host that answered, only touching the state file
+    when there were timeouts to forget
+
+    :param host: hostname or IP of host
+    """
+    if BREAKER_THRESHOLD > 0 and load_breaker(host)[0]:
+        save_breaker(host, 0, 0.0)
@@ -0,0 +1,165 @@
+"""Recording and replay of raw probe responses"""
+
+# With NAGIOS_PLUGIN_RECORD set to a file, every probe a plugin makes appends
+# the raw response it got to that capture file: SNMP varbinds as BER, ping
+# output, the TLS peer certificate, the HTTP status line and headers, SSH
+# banners and TCP connects, along with the contents of every state file a
+# plugin reads, such as the previous run's interface counters. With
+# NAGIOS_PLUGIN_REPLAY set to a capture file instead, plugins probe nothing
+# and feed the recorded responses through their parsing and threshold code,
+# as they run in production, so an incident can be reproduced exactly from a
+# capture and parsing benchmarked and regression tested offline with
+# replay.py. State files read while replaying get the contents recorded for
+# them, and everything written while replaying goes to a throwaway directory
+# instead of the live state directory.
+#
+# Each record is a header of kind, time recorded and lengths, then the key
+# identifying the probe (host, port and what was asked for) and the payload.
+# Records are appended with one write each, so several plugins can record to
+# the same file at once. Replayed probes get the responses recorded for the
+# same key in order, starting over from the first when they run out, and see
+# the time the response was recorded as the current time.
+
+from __future__ import print_function
+
+#  standard library imports
+import os
+import struct
+import sys
+import threading
+import time
+
+
+RECORD_PATH = os.environ.get('NAGIOS_PLUGIN_RECORD')
+REPLAY_PATH = os.environ.get('NAGIOS_PLUGIN_REPLAY')
+
+KINDS = ('snmp-get', 'snmp-walk', 'ping', 'tls', 'http', 'ssh', 'tcp', 'state')
+
+# kind, time recorded, key length, payload length
+RECORD_HEADER = struct.Struct('<BdHI')
+
+# Responses of the replay file as [time recorded, payload, decoded payload]
+# by (kind, key), loaded on first use, and the number replayed of each
+_replay = None
+_replay_count = {}
+_replay_lock = threading.Lock()
+_replayed = threading.local()
+
+
+def read_capture(path):
+    """
+    Yield the kind, time recorded, key and payload of each record of a
+    capture file
+
+    :param path: path of the capture file
+    """
+    with open(path, 'rb') as capture:
+        data = capture.read()
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        kind, stamp, key_len, payload_len = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        key = data[offset:offset + key_len].decode('utf-8')
+        offset += key_len
+        yield KINDS[kind], stamp, key, data[offset:offset + payload_len]
+        offset += payload_len
+
+
+def record(kind, key, payload):
+    """
+    Append a probe response to the capture file, if recording
+
+    :param kind: kind of probe, one of KINDS
+    :param key: host, port and what was probed for
+    :param payload: raw response as bytes
+    """
+    if RECORD_PATH is None:
+        return
+    key = key.encode('utf-8')
+    data = RECORD_HEADER.pack(KINDS.index(kind), time.time(), len(key), len(payload))
+    fd = os.open(RECORD_PATH, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+    try:
+        os.write(fd, data + key + payload)
+    finally:
+        os.close(fd)
+
+
+def use_replay(path):
+    """
+    Replay probe responses from a capture file in this process
+
+    :param path: path of the capture file
+    """
+    global REPLAY_PATH, _replay # pylint: disable=I0011,W0603
+    REPLAY_PATH = path
+    _replay = None
+    _replay_count.clear()
+
+
+def replaying():
+    """Return True if probes are replayed rather than made"""
+    return REPLAY_PATH is not None
+
+
+def replay(kind, key, decode=None):
+    """
+    Return the next response recorded for a probe, exiting UNKNOWN if there
+    is none
+
+    :param kind: kind of probe, one of KINDS
+    :param key: host, port and what was probed for
+    :param decode: function turning the payload into what the probe returns,
+                   called once per record however often it is replayed
+    """
+    with _replay_lock:
+        responses = _responses(kind, key)
+        if responses is None:
+            print('UNKNOWN: no {0} response recorded for {1}'.format(kind, key))
+            sys.exit(3)
+        count = _replay_count.get((kind, key), 0)
+        _replay_count[(kind, key)] = count + 1
+        response = responses[count % len(responses)]
+        if decode is not None and response[2] is None:
+            response[2] = decode(response[1])
+    _replayed.stamp = response[0]
+    return response[1] if decode is None else response[2]
+
+
+def replay_state(name):
+    """
+    Return the next contents recorded for a state file, b'' if it was missing
+    or empty when recorded, or None if the capture holds none for it
+
+    :param name: file name of the state file
+    """
+    with _replay_lock:
+        responses = _responses('state', name)
+        if responses is None:
+            return None
+        count = _replay_count.get(('state', name), 0)
+        _replay_count[('state', name)] = count + 1
+        return responses[count % len(responses)][1]
+
+
+def _responses(kind, key):
+    """
+    Return the responses recorded for a probe, or None if there are none,
+    loading the replay file on first use; call with _replay_lock held
+
+    :param kind: kind of probe, one of KINDS
+    :param key: host, port and what was probed for
+    """
+    global _replay # pylint: disable=I0011,W0603
+    if _replay is None:
+        _replay = {}
+        for rec_kind, stamp, rec_key, payload in read_capture(REPLAY_PATH):
+            _replay.setdefault((rec_kind, rec_key), []).append([stamp, payload, None])
+    return _replay.get((kind, key))
+
+
+def now():
+    """
+    Return the current time, or the time the response last replayed in this
+    thread was recorded
+    """
+    return getattr(_replayed, 'stamp', None) or time.time()
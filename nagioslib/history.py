@@ -0,0 +1,225 @@
+"""Fixed-size on-disk history of plugin metrics and trend thresholds"""
+
+# The plugins judge each sample on its own, so a load climbing steadily
+# towards its critical level only alerts once it is there. With --trend a
+# plugin keeps the samples of each metric in a ring buffer per host and
+# metric in the state directory and applies its thresholds to a trend of them
+# instead of the latest sample:
+#
+#   rate      change per minute, from a least squares fit over --window
+#   average   mean over --window
+#   forecast  value the least squares fit over --window reaches --horizon
+#             seconds from now, i.e. alert when the load will be critical in
+#             30 minutes
+#
+# A history file is a small header of magic, slot count and the number of
+# samples ever appended, then HISTORY_SLOTS timestamp and value pairs written
+# round-robin through a memory map, so appending costs one small write and the
+# file never grows. Checks of one metric of one host are not expected to run
+# concurrently; if they do, a sample may be lost, never torn.
+
+from __future__ import print_function
+
+#  standard library imports
+import mmap
+import os
+import struct
+import sys
+
+# local application imports
+from nagioslib import capture
+from nagioslib.state import state_path, write_state
+
+
+HISTORY_SLOTS = 1024
+
+# Header of magic, slot count and samples appended, then timestamp and value
+# pairs
+HISTORY_HEADER = struct.Struct('<4sIQ')
+HISTORY_POINT = struct.Struct('<dd')
+HISTORY_MAGIC = b'NHS1'
+
+TREND_MODES = ('rate', 'average', 'forecast')
+
+
+class History(object):
+    """
+    Memory-mapped ring buffer of the samples of one metric, created empty if
+    it does not exist
+
+    :param path: path of the history file
+    :param slots: samples kept
+    """
+    def __init__(self, path, slots=HISTORY_SLOTS):
+        size = HISTORY_HEADER.size + slots * HISTORY_POINT.size
+        self.map = self.open(path, size)
+        if self.map is None or HISTORY_HEADER.unpack_from(self.map)[:2] != (HISTORY_MAGIC, slots):
+            if self.map is not None:
+                self.map.close()
+            write_state(path, HISTORY_HEADER.pack(HISTORY_MAGIC, slots, 0) +
+                        b'\0' * (size - HISTORY_HEADER.size))
+            self.map = self.open(path, size)
+        self.slots = slots
+
+    @staticmethod
+    def open(path, size):
+        """
+        Return a writable memory map of a history file, or None if it does
+        not exist or has the wrong size
+
+        :param path: path of the history file
+        :param size: expected size of the file
+        """
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except (IOError, OSError):
+            return None
+        try:
+            if os.fstat(fd).st_size != size:
+                return None
+            return mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def append(self, stamp, value):
+        """
+        Append a sample, overwriting the oldest once the buffer is full
+
+        :param stamp: time of the sample
+        :param value: value of the sample
+        """
+        count = HISTORY_HEADER.unpack_from(self.map)[2]
+        offset = HISTORY_HEADER.size + (count % self.slots) * HISTORY_POINT.size
+        HISTORY_POINT.pack_into(self.map, offset, stamp, value)
+        HISTORY_HEADER.pack_into(self.map, 0, HISTORY_MAGIC, self.slots, count + 1)
+
+    def points(self, window):
+        """
+        Return the (timestamp, value) samples from the last window seconds
+        before the newest, oldest first
+
+        :param window: seconds of history to return
+        """
+        count = HISTORY_HEADER.unpack_from(self.map)[2]
+        points = []
+        for idx in range(count - 1, max(-1, count - self.slots - 1), -1):
+            point = HISTORY_POINT.unpack_from(
+                self.map, HISTORY_HEADER.size + (idx % self.slots) * HISTORY_POINT.size)
+            if points and point[0] < points[0][0] - window:
+                break
+            points.append(point)
+        points.reverse()
+        return points
+
+    def close(self):
+        """Unmap the history file"""
+        self.map.close()
+
+
+def history_path(plugin, host, metric):
+    """
+    Return the path of the history file of a metric of a host
+
+    :param plugin: name of the plugin
+    :param host: hostname or IP of host, with the port where it matters
+    :param metric: name of the metric
+    """
+    return state_path(plugin, host, '{0}.history'.format(metric))
+
+
+def fit(points):
+    """
+    Return the slope per second of the least squares line through samples and
+    its value at the newest sample
+
+    :param points: list of (timestamp, value) samples, oldest first
+    """
+    newest = points[-1][0]
+    mean_t = sum(t - newest for t, _ in points) / len(points)
+    mean_v = sum(v for _, v in points) / len(points)
+    var = sum((t - newest - mean_t) ** 2 for t, _ in points)
+    if not var:
+        return 0.0, mean_v
+    slope = sum((t - newest - mean_t) * (v - mean_v) for t, v in points) / var
+    return slope, mean_v - slope * mean_t
+
+
+def add_trend_arguments(parser):
+    """
+    Add the trend threshold options to a plugin's argument parser
+
+    :param parser: argparse.ArgumentParser of the plugin
+    """
+    trend_help = ('Optional: apply the thresholds to the rate of change per minute, the '
+                  'moving average or the forecast of the metrics instead of the latest '
+                  'sample, keeping their history in the state directory')
+    window_help = 'Optional: seconds of history the trend is computed over, defaults to 1800'
+    horizon_help = 'Optional: seconds ahead of now to forecast, defaults to 1800'
+
+    parser.add_argument('--trend', help=trend_help, choices=TREND_MODES, required=False)
+    parser.add_argument('--window', help=window_help, type=float, default=1800.0)
+    parser.add_argument('--horizon', help=horizon_help, type=float, default=1800.0)
+
+
+def record_history(plugin, host, metrics, values, stamp=None):
+    """
+    Append a sample of each of a host's metrics to its history
+
+    :param plugin: name of the plugin
+    :param host: hostname or IP of host, with the port where it matters
+    :param metrics: names of the metrics
+    :param values: value of each metric
+    :param stamp: time of the samples, defaults to now
+    """
+    stamp = capture.now() if stamp is None else stamp
+    for metric, value in zip(metrics, values):
+        history = History(history_path(plugin, host, metric))
+        try:
+            history.append(stamp, value)
+        finally:
+            history.close()
+
+
+def trend_values(plugin, host, metrics, args):
+    """
+    Return the trend of each of a host's metrics that --trend asks for, to
+    apply the thresholds to, or exit UNKNOWN if a metric has no history
+
+    :param plugin: name of the plugin
+    :param host: hostname or IP of host, with the port where it matters
+    :param metrics: names of the metrics
+    :param args: parsed command line arguments
+    """
+    trends = []
+    for metric in metrics:
+        history = History(history_path(plugin, host, metric))
+        try:
+            points = history.points(args.window)
+        finally:
+            history.close()
+        if not points:
+            print('UNKNOWN: no history of {0}, collect with --trend'.format(metric))
+            sys.exit(3)
+        slope, now = fit(points)
+        if args.trend == 'rate':
+            trends.append(slope * 60)
+        elif args.trend == 'average':
+            trends.append(sum(v for _, v in points) / len(points))
+        else:
+            trends.append(now + slope * args.horizon)
+    return trends
+
+
+def trend_text(args, trends):
+    """
+    Return a description of trends for a plugin's output
+
+    :param args: parsed command line arguments
+    :param trends: list of trends from trend_values()
+    """
+    values = ', '.join('{0:.2f}'.format(t) for t in trends)
+    if args.trend == 'rate':
+        return 'changing {0} a minute over {1:g} min'.format(values, args.window / 60)
+    if args.trend == 'average':
+        return 'averaging {0} over {1:g} min'.format(values, args.window / 60)
+    return 'forecast {0} in {1:g} min'.format(values, args.horizon / 60)
@@ -0,0 +1,82 @@
+"""Per-thread capture of what plugins print"""
+
+# The plugins report by printing and exiting. To run many checks at once in
+# one process, batch.py and friends install a ThreadOutput as sys.stdout and
+# sys.stderr and call each check through run_captured(), which collects what
+# the check prints in a buffer of its own thread and turns its exit into an
+# exit code.
+
+from __future__ import print_function
+
+#  standard library imports
+import contextlib
+import sys
+import threading
+
+try:
+    from io import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+
+class ThreadOutput(object):
+    """
+    Stand-in for sys.stdout and sys.stderr collecting what each thread running
+    a check prints in that thread's own buffer
+
+    :param default: stream for output from threads not running a check
+    """
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def write(self, text):
+        """Write text to the calling thread's buffer"""
+        getattr(self.local, 'buffer', self.default).write(text)
+
+    def flush(self):
+        """Nothing to flush for buffered output"""
+        pass
+
+
+@contextlib.contextmanager
+def thread_output():
+    """
+    Install a ThreadOutput as sys.stdout and sys.stderr for the duration, or
+    use the one already installed, and yield it
+    """
+    if isinstance(sys.stdout, ThreadOutput):
+        yield sys.stdout
+        return
+    stdout, stderr = sys.stdout, sys.stderr
+    output = ThreadOutput(stderr)
+    sys.stdout, sys.stderr = output, output
+    try:
+        yield output
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+
+def run_captured(output, func, *args):
+    """
+    Call a function in the calling thread and return its exit code, 0 if it
+    returned, what it printed and what it returned
+
+    :param output: ThreadOutput installed as sys.stdout and sys.stderr
+    :param func: function to call
+    :param args: arguments to call it with
+    """
+    output.local.buffer = StringIO()
+    code = 0
+    value = None
+    try:
+        value = func(*args)
+    except SystemExit as err:
+        code = err.code if isinstance(err.code, int) else 3
+    except Exception as err: # pylint: disable=I0011,W0703
+        print('UNKNOWN: {0}: {1}'.format(type(err).__name__, err))
+        code = 3
+    finally:
+        text = output.local.buffer.getvalue()
+        del output.local.buffer
+    return code, text.strip(), value
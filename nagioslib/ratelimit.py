@@ -0,0 +1,114 @@
+"""Token bucket rate limits for plugins run in batches"""
+
+# A plugin run on its own by Nagios sends a handful of packets, but a batch
+# run of hundreds of checks could burst them all at the same switch or web
+# server, and weak embedded SNMP agents drop packets when flooded, which then
+# shows up as false alerts. batch.py limits the checks started per host with a
+# RateLimiter and, through limit_snmp(), every SNMP request sent to an agent,
+# including GETBULK pages and hedged copies. Outside a batch run no limit is
+# set and nothing here is used.
+
+#  standard library imports
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    Token bucket allowing bursts of up to burst events and rate events a
+    second on average
+
+    :param rate: tokens added per second
+    :param burst: most tokens held
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.stamp = time.time()
+
+    def full(self, now):
+        """
+        Return True if the bucket has refilled, so it is no different from a
+        new one
+
+        :param now: current time
+        """
+        return self.tokens + (now - self.stamp) * self.rate >= self.burst
+
+    def take(self, now):
+        """
+        Take a token and return 0 if one is available, otherwise return the
+        seconds until one will be
+
+        :param now: current time
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter(object):
+    """
+    Token buckets keyed by target, created on first use and safe to share
+    between threads. Buckets that have refilled are dropped as new ones are
+    created, so a run over many targets does not keep one for each.
+
+    :param rate: events per second allowed per target
+    :param burst: events allowed at once per target
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.prune_at = 1024
+        self.lock = threading.Lock()
+
+    def take(self, key):
+        """
+        Take a token for a target and return 0 if one is available, otherwise
+        return the seconds until one will be
+
+        :param key: target the event is for
+        """
+        now = time.time()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.prune_at:
+                    self.buckets = dict((k, b) for k, b in self.buckets.items()
+                                        if not b.full(now))
+                    self.prune_at = max(1024, 2 * len(self.buckets))
+                bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+            return bucket.take(now)
+
+    def wait(self, key):
+        """
+        Block until a token for a target is available and take it
+
+        :param key: target the event is for
+        """
+        delay = self.take(key)
+        while delay:
+            time.sleep(delay)
+            delay = self.take(key)
+
+
+# Limit on SNMP requests per agent, set by limit_snmp()
+SNMP_LIMITER = None
+
+
+def limit_snmp(rate, burst):
+    """
+    Limit the SNMP requests sent to each agent from this process
+
+    :param rate: requests per second allowed per agent
+    :param burst: requests allowed at once per agent
+    """
+    global SNMP_LIMITER # pylint: disable=I0011,W0603
+    SNMP_LIMITER = RateLimiter(rate, burst)
@@ -0,0 +1,37 @@
+"""Compact record of the outcome of a plugin check"""
+
+# One Result is kept per check in flight, and a batch run over 100k targets
+# creates one per check, so it is a __slots__ object rather than a dict. The
+# board plugins' collect() returns one holding the values it gathered, the
+# collector publishes those values, board_result() returns them as one again,
+# and run_check() in batch.py returns one for every check it runs, which
+# formats itself as a Nagios external command.
+
+
+class Result(object):
+    """
+    Outcome of a check
+
+    :param check: Check that was run, or None for what a plugin's collect()
+                  gathered
+    :param code: exit code of the check
+    :param output: output of the check on one line
+    :param started: time the check started or its values were collected
+    :param elapsed: seconds the check took
+    :param values: values collected by the check
+    """
+    __slots__ = ('check', 'code', 'output', 'started', 'elapsed', 'values')
+
+    def __init__(self, check=None, code=0, output='', started=0.0, elapsed=0.0, values=()):
+        self.check = check
+        self.code = code
+        self.output = output
+        self.started = started
+        self.elapsed = elapsed
+        self.values = values
+
+    def command(self):
+        """Return the result as a Nagios external command line"""
+        return '[{0}] PROCESS_SERVICE_CHECK_RESULT;{1};{2};{3};{4}\n'.format(
+            int(self.started + self.elapsed), self.check.host_name,
+            self.check.service, self.code, self.output)
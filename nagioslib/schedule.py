@@ -0,0 +1,84 @@
+"""Adaptive per-check intervals for checks run as a daemon"""
+
+# batch.py --daemon runs its checks over and over, each on an interval of its
+# own that follows what the check has been reporting. A check that keeps
+# returning the same OK, i.e. a steady uptime or a certificate months from
+# expiring, is polled less and less often, up to --max-interval. A check that
+# warns or changes status, i.e. a host near a threshold or flapping, is
+# polled every --min-interval until it settles again. Every due time is
+# jittered and the first ones are spread over a whole interval, so thousands
+# of checks read at once do not all fire on the same second.
+
+#  standard library imports
+import heapq
+import random
+import time
+
+
+# Factor a steady check's interval grows by after each unchanged OK result
+GROWTH = 1.5
+
+# Fraction of its interval a due time may move either way
+JITTER = 0.1
+
+# Longest wait reported while every check is running
+IDLE = 1.0
+
+
+class Schedule(object):
+    """
+    Heap of checks by the time each is next due, with an interval per check
+    that adapts to its results
+
+    :param checks: list of checks to schedule
+    :param interval: seconds between runs of a new or recovering check
+    :param min_interval: seconds between runs of a warning or flapping check
+    :param max_interval: most seconds between runs of a steady check
+    """
+    def __init__(self, checks, interval, min_interval, max_interval):
+        self.interval = interval
+        self.min_interval = min(min_interval, interval)
+        self.max_interval = max(max_interval, interval)
+        self.heap = []
+        self.entries = {}
+        now = time.time()
+        for seq, check in enumerate(checks):
+            entry = [now + random.uniform(0, interval), seq, check, interval, None]
+            self.entries[id(check)] = entry
+            self.heap.append(entry)
+        heapq.heapify(self.heap)
+
+    def __iter__(self):
+        """
+        Yield each check as it falls due, forever, and the seconds until the
+        next is due whenever none is yet; a check is only due again once
+        its result has been reported
+        """
+        while True:
+            now = time.time()
+            if self.heap and self.heap[0][0] <= now:
+                yield heapq.heappop(self.heap)[2]
+            elif self.heap:
+                yield self.heap[0][0] - now
+            else:
+                yield IDLE
+
+    def report(self, check, code):
+        """
+        Adapt the interval of a check to the exit code it returned and
+        schedule its next run
+
+        :param check: check that ran
+        :param code: exit code it returned
+        """
+        entry = self.entries[id(check)]
+        interval, last = entry[3], entry[4]
+        if code in (1, 2) or (last is not None and code != last):
+            interval = self.min_interval
+        elif code:
+            interval = self.interval
+        else:
+            interval = min(self.max_interval, max(self.interval, interval * GROWTH))
+        entry[0] = time.time() + interval * random.uniform(1 - JITTER, 1 + JITTER)
+        entry[3], entry[4] = interval, code
+        heapq.heappush(self.heap, entry)
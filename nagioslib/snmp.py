@@ -0,0 +1,705 @@
+"""Shared SNMP machinery for the SNMP plugins"""
+
+# Talks to pysnmp's SNMP engine directly with numeric OIDs rather than through
+# the oneliner command generator. The oneliner resolves every OID through the
+# MIB view, which builds pysmi's MIB compiler on each run, and that alone
+# costs more than the SNMP round trip for a single GET.
+#
+# SNMPv3 is used when a user is given. Turning passwords into localized keys
+# and discovering the agent's engine ID, boots and time cost CPU and an extra
+# round trip, so after a successful request the localized keys and engine
+# details are cached per host in the state directory (readable only by the
+# nagios user) and fed back into pysnmp on the next run. If the agent rejects
+# the cached details, i.e. after it was reinstalled, the request is retried
+# from scratch and the cache rewritten.
+#
+# Requests are not left to pysnmp's fixed one second timeout and retries. The
+# smoothed round trip time and its variation (SRTT and RTTVAR, as TCP keeps
+# them) are tracked per host in the state directory. A request still
+# unanswered at roughly the host's p95 latency, SRTT + 2 * RTTVAR, is sent
+# again without cancelling the first copy, and whichever copy is answered
+# first wins. Further copies back off from the retransmission timeout
+# SRTT + 4 * RTTVAR. A host without history gets the old schedule of six
+# copies a second apart.
+#
+# REQUIRES: pysnmp
+
+from __future__ import print_function
+
+#  standard library imports
+import hashlib
+import json
+import socket
+import sys
+import time
+from collections import namedtuple
+
+# local application imports
+from nagioslib import capture, ratelimit
+from nagioslib.breaker import check_breaker, record_success, record_timeout
+from nagioslib.state import read_state, state_path, write_state
+
+
+V3Credentials = namedtuple('V3Credentials',
+                           'user auth_protocol auth_pass priv_protocol priv_pass')
+
+# pysnmp.entity.config attribute names of the supported SNMPv3 protocols
+AUTH_PROTOCOLS = {
+    'MD5': 'usmHMACMD5AuthProtocol',
+    'SHA': 'usmHMACSHAAuthProtocol',
+    'SHA224': 'usmHMAC128SHA224AuthProtocol',
+    'SHA256': 'usmHMAC192SHA256AuthProtocol',
+    'SHA384': 'usmHMAC256SHA384AuthProtocol',
+    'SHA512': 'usmHMAC384SHA512AuthProtocol',
+}
+PRIV_PROTOCOLS = {
+    'DES': 'usmDESPrivProtocol',
+    '3DES': 'usm3DESEDEPrivProtocol',
+    'AES': 'usmAesCfb128Protocol',
+    'AES192': 'usmAesCfb192Protocol',
+    'AES256': 'usmAesCfb256Protocol',
+}
+
+# Seconds between copies of a request to a host without RTT history, and the
+# most copies of a request sent
+TIMEOUT = 1.0
+COPIES = 6
+
+# Bounds in seconds of the hedge delay and retransmission timeout
+HEDGE_MIN = 0.01
+RTO_MIN = 0.2
+
+
+class SNMPData(object): # pylint: disable=I0011,R0903
+    """
+    Make an SNMP connection and return the results with do_snmpget() or
+    do_snmpbulkwalk()
+
+    :param community: SNMP community password for host, or V3Credentials
+    :param host: hostname or IP of host
+    :param port: SNMP port of host
+    """
+    def __init__(self, community, host, port=161):
+        self.community = community
+        self.host = host
+        self.port = port
+
+    @staticmethod
+    def do_snmpget(community, host, oid, port=161):
+        """
+        Return the results of an snmpget
+
+        :param community: SNMP community password for host, or V3Credentials
+        :param host: hostname or IP of host
+        :param oid: SNMP oids to retrieve data from the host
+        :param port: SNMP port of host
+        """
+        return SNMPData.do_timed_snmpget(community, host, oid, port)[0]
+
+    @staticmethod
+    def do_timed_snmpget(community, host, oid, port=161):
+        """
+        Return the results of an snmpget with the times the copy of the
+        request that was answered was sent and its response received
+
+        :param community: SNMP community password for host, or V3Credentials
+        :param host: hostname or IP of host
+        :param oid: SNMP oids to retrieve data from the host
+        :param port: SNMP port of host
+        """
+        key = '{0}:{1} {2}'.format(host, port, ' '.join(oid))
+        if capture.replaying():
+            var_binds = capture.replay('snmp-get', key, decode_var_binds)
+            return var_binds, capture.now(), capture.now()
+
+        from pysnmp.entity.rfc3413 import cmdgen
+        from pysnmp.proto import rfc1902
+
+        var_names = [(rfc1902.ObjectName(i), None) for i in oid]
+
+        def send(hedged):
+            """Issue the GET and return the dict its response is stored in"""
+            result = {}
+            get_gen = cmdgen.GetCommandGenerator()
+
+            def cb_fun(err_found, err_status, err_index, var_binds):
+                """Store the response"""
+                result['error'] = (err_found, err_status, err_index)
+                result['var_binds'] = var_binds
+                result['answered'] = hedged.answered
+
+            hedged.send(lambda copy_cb: get_gen.sendVarBinds(
+                hedged.snmp_engine, 'nagios-target', None, '', var_names, copy_cb), cb_fun)
+            return result
+
+        result = request(community, host, port, send)
+        if any(result['error'][:2]):
+            print('UNKNOWN: {0} {1} {2}'.format(*result['error']))
+            sys.exit(3)
+        if capture.RECORD_PATH is not None:
+            capture.record('snmp-get', key, encode_var_binds(result['var_binds']))
+        return (result['var_binds'],) + result['answered']
+
+    @staticmethod
+    def do_snmpbulkwalk(community, host, oid, port=161, max_repetitions=10):
+        """
+        Return the results of a GETBULK walk of one or more table columns as a
+        dict of {column oid: {row index: value}}
+
+        :param community: SNMP community password for host, or V3Credentials
+        :param host: hostname or IP of host
+        :param oid: SNMP oids of the table columns to walk side by side
+        :param port: SNMP port of host
+        :param max_repetitions: rows to ask for in each GETBULK request
+        """
+        key = '{0}:{1} {2}'.format(host, port, ' '.join(oid))
+        if capture.replaying():
+            return capture.replay('snmp-walk', key,
+                                  lambda payload: walk_table(oid, decode_var_binds(payload)))
+
+        from pysnmp.entity.rfc3413 import cmdgen
+        from pysnmp.proto import rfc1902, rfc1905
+
+        end_of_column = (rfc1905.EndOfMibView.tagSet, rfc1905.NoSuchObject.tagSet,
+                         rfc1905.NoSuchInstance.tagSet)
+        columns = [rfc1902.ObjectName(i) for i in oid]
+
+        def send(hedged):
+            """Start the walk and return the dict its rows are stored in"""
+            result = {'error': (None, 0, 0),
+                      'table': dict((str(col), {}) for col in columns)}
+            bulk_gen = cmdgen.BulkCommandGenerator()
+
+            def send_page(active, cursors):
+                """Request the next page of rows of the unfinished columns"""
+                var_names = [(cursors[col], None) for col in active]
+                hedged.send(
+                    lambda copy_cb: bulk_gen.sendVarBinds(
+                        hedged.snmp_engine, 'nagios-target', None, '', 0,
+                        max_repetitions, var_names, copy_cb),
+                    lambda *response: cb_fun(active, *response))
+
+            def cb_fun(active, err_found, err_status, err_index, var_bind_table):
+                """Store a page of rows and request the next for unfinished columns"""
+                if err_found or err_status:
+                    result['error'] = (err_found, err_status, err_index)
+                    return
+                cursors = {}
+                for row in var_bind_table:
+                    for column, (name, val) in zip(active, row):
+                        if column in cursors and cursors[column] is None:
+                            continue
+                        if not column.isPrefixOf(name) or val.tagSet in end_of_column:
+                            cursors[column] = None
+                            continue
+                        index = '.'.join(str(i) for i in name[len(column):])
+                        result['table'][str(column)][index] = val
+                        cursors[column] = name
+                active = [col for col in active if cursors.get(col) is not None]
+                if active:
+                    send_page(active, cursors)
+
+            send_page(columns, dict((col, col) for col in columns))
+            return result
+
+        result = request(community, host, port, send)
+        if any(result['error'][:2]):
+            print('UNKNOWN: {0} {1} {2}'.format(*result['error']))
+            sys.exit(3)
+        if capture.RECORD_PATH is not None:
+            capture.record('snmp-walk', key, encode_var_binds(
+                [(rfc1902.ObjectName('{0}.{1}'.format(column, index)), val)
+                 for column, rows in result['table'].items()
+                 for index, val in rows.items()]))
+        return result['table']
+
+
+def encode_var_binds(var_binds):
+    """
+    Return a list of (name, value) pairs BER-encoded as an SNMP VarBindList
+
+    :param var_binds: list of (ObjectName, value) pairs
+    """
+    from pyasn1.codec.ber import encoder
+    from pysnmp.proto import rfc1905
+    from pysnmp.proto.api import v2c
+
+    var_bind_list = rfc1905.VarBindList()
+    for idx, var_bind in enumerate(var_binds):
+        var_bind_list.setComponentByPosition(idx)
+        v2c.apiVarBind.setOIDVal(var_bind_list.getComponentByPosition(idx), var_bind)
+    return encoder.encode(var_bind_list)
+
+
+def decode_var_binds(data):
+    """
+    Return the list of (name, value) pairs of a BER-encoded VarBindList
+
+    :param data: bytes from encode_var_binds()
+    """
+    from pyasn1.codec.ber import decoder
+    from pysnmp.proto import rfc1905
+    from pysnmp.proto.api import v2c
+
+    var_bind_list = decoder.decode(data, asn1Spec=rfc1905.VarBindList())[0]
+    return [v2c.apiVarBind.getOIDVal(var_bind) for var_bind in var_bind_list]
+
+
+def walk_table(oid, var_binds):
+    """
+    Return walked (name, value) pairs as a dict of {column oid: {row index:
+    value}}, like do_snmpbulkwalk()
+
+    :param oid: SNMP oids of the walked table columns
+    :param var_binds: list of (ObjectName, value) pairs
+    """
+    table = dict((column, {}) for column in oid)
+    for name, val in var_binds:
+        for column in oid:
+            if str(name).startswith(column + '.'):
+                table[column][str(name)[len(column) + 1:]] = val
+    return table
+
+
+class RTTEstimate(object):
+    """
+    Smoothed round trip time of a host and its variation, updated as in
+    RFC 6298
+
+    :param srtt: smoothed round trip time in seconds, or None without history
+    :param rttvar: round trip time variation in seconds
+    """
+    def __init__(self, srtt=None, rttvar=None):
+        self.srtt = srtt
+        self.rttvar = rttvar
+
+    def sample(self, seconds):
+        """Fold in the round trip time of one request"""
+        if self.srtt is None:
+            self.srtt, self.rttvar = seconds, seconds / 2
+            return
+        self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - seconds)
+        self.srtt = 0.875 * self.srtt + 0.125 * seconds
+
+    def hedge_delay(self):
+        """Return the seconds to wait before sending a second copy of a request"""
+        if self.srtt is None:
+            return TIMEOUT
+        return min(max(self.srtt + 2 * self.rttvar, HEDGE_MIN), TIMEOUT)
+
+    def rto(self):
+        """Return the retransmission timeout in seconds"""
+        if self.srtt is None:
+            return TIMEOUT
+        return min(max(self.srtt + 4 * self.rttvar, RTO_MIN), TIMEOUT)
+
+    def schedule(self, copies):
+        """
+        Return the seconds to wait after sending each copy of a request, the
+        last being the wait before giving up
+
+        :param copies: most copies of the request to send
+        """
+        rto = self.rto()
+        return [self.hedge_delay()] + [min(rto * 2 ** i, TIMEOUT)
+                                       for i in range(copies - 1)]
+
+
+def load_rtt(host, port):
+    """
+    Return the RTTEstimate stored for a host
+
+    :param host: hostname or IP of host
+    :param port: SNMP port of host
+    """
+    cached = read_state(state_path('snmp', '{0}_{1}'.format(host, port), 'rtt'))
+    try:
+        srtt, rttvar = (float(i) for i in cached.split())
+    except (AttributeError, ValueError):
+        return RTTEstimate()
+    return RTTEstimate(srtt, rttvar)
+
+
+def save_rtt(host, port, rtt):
+    """
+    Store the RTTEstimate of a host for the next run
+
+    :param host: hostname or IP of host
+    :param port: SNMP port of host
+    :param rtt: RTTEstimate of the host
+    """
+    if rtt.srtt is not None:
+        write_state(state_path('snmp', '{0}_{1}'.format(host, port), 'rtt'),
+                    '{0:.6f} {1:.6f}'.format(rtt.srtt, rtt.rttvar).encode('ascii'))
+
+
+class HedgedRequests(object):
+    """
+    Send requests through an SNMP engine, sending another copy of any request
+    still unanswered when its wait in the RTT schedule runs out, and pass the
+    first response to arrive for each request on to its callback
+
+    :param snmp_engine: pysnmp SNMP engine
+    :param rtt: RTTEstimate of the host, updated with each response
+    :param copies: most copies of each request to send
+    :param agent: IP address and port of the agent, to rate limit requests by
+
+    The times the copy of the last request answered was sent and its response
+    received are kept in answered.
+    """
+    def __init__(self, snmp_engine, rtt, copies=COPIES, agent=None):
+        self.snmp_engine = snmp_engine
+        self.agent = agent
+        self.rtt = rtt
+        self.schedule = rtt.schedule(copies)
+        self.pending = []
+        self.answered = (None, None)
+
+    def send(self, issue, cb_fun):
+        """
+        Send the first copy of a request
+
+        :param issue: function sending one copy of the request, given the
+                      pysnmp callback for its response
+        :param cb_fun: function called once with the error indication, error
+                       status, error index and var-binds of the first response
+        """
+        request = {'issue': issue, 'cb_fun': cb_fun, 'copies': 0}
+        self.pending.append(request)
+        self.send_copy(request)
+
+    def send_copy(self, request):
+        """Send one more copy of a pending request"""
+        from pysnmp.proto import errind
+
+        if ratelimit.SNMP_LIMITER:
+            ratelimit.SNMP_LIMITER.wait(self.agent)
+        sent = time.time()
+
+        def copy_cb(snmp_engine, handle, err_found, err_status, err_index, var_binds, cb_ctx): # pylint: disable=I0011,R0913,W0613
+            """Hand the first response other than a timeout to the request's callback"""
+            if request not in self.pending or err_found == errind.requestTimedOut:
+                return False
+            self.pending.remove(request)
+            self.answered = (sent, time.time())
+            if not err_found:
+                self.rtt.sample(self.answered[1] - sent)
+            request['cb_fun'](err_found, err_status, err_index, var_binds)
+            return False
+
+        request['next'] = sent + self.schedule[request['copies']]
+        request['copies'] += 1
+        request['issue'](copy_cb)
+
+    def run(self):
+        """Run the engine's dispatcher until every request is answered or given up"""
+        from asyncore import loop
+        from pysnmp.proto import errind
+
+        dispatcher = self.snmp_engine.transportDispatcher
+        while self.pending:
+            now = time.time()
+            for request in [req for req in self.pending if req['next'] <= now]:
+                if request['copies'] < len(self.schedule):
+                    self.send_copy(request)
+                else:
+                    self.pending.remove(request)
+                    request['cb_fun'](errind.requestTimedOut, 0, 0, [])
+            if not self.pending:
+                break
+            wait = min(req['next'] for req in self.pending) - time.time()
+            loop(max(wait, 0), use_poll=True, map=dispatcher.getSocketMap(), count=1)
+            dispatcher.handleTimerTick(time.time())
+
+
+def request(community, host, port, send):
+    """
+    Run the requests issued by send() against one agent and return what
+    send() returned, retrying once without cached SNMPv3 state if a request
+    made with it fails
+
+    :param community: SNMP community password for host, or V3Credentials
+    :param host: hostname or IP of host
+    :param port: SNMP port of host
+    :param send: function issuing requests through HedgedRequests and
+                 returning a dict whose 'error' key the responses set
+    """
+    from pysnmp.proto import errind
+
+    check_breaker(host)
+    address = resolve(host, port)
+    rtt = load_rtt(host, port)
+    usm_cache = None
+    if isinstance(community, V3Credentials):
+        usm_cache = load_usm_cache(community, host, port)
+
+    while True:
+        # Agents answer stale keys or engine IDs with unauthenticated reports
+        # that pysnmp drops, so a stale cache shows up as a timeout; only try
+        # it twice before falling back to discovery
+        copies = 2 if usm_cache else COPIES
+        snmp_engine = make_engine(community, address, usm_cache,
+                                  timeout=sum(rtt.schedule(copies)))
+        hedged = HedgedRequests(snmp_engine, rtt, copies, address)
+        result = send(hedged)
+        hedged.run()
+        err_found = result['error'][0]
+        if usm_cache and err_found:
+            snmp_engine.transportDispatcher.closeDispatcher()
+            usm_cache = None
+            continue
+        break
+
+    if err_found == errind.requestTimedOut:
+        record_timeout(host)
+    else:
+        record_success(host)
+    if isinstance(community, V3Credentials) and not err_found:
+        save_usm_cache(snmp_engine, community, host, port, address, usm_cache)
+    save_rtt(host, port, rtt)
+    snmp_engine.transportDispatcher.closeDispatcher()
+    return result
+
+
+def resolve(host, port):
+    """
+    Return the IPv4 address and port of an SNMP agent
+
+    :param host: hostname or IP of host
+    :param port: SNMP port of host
+    """
+    try:
+        return socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_DGRAM)[0][4]
+    except socket.gaierror as err:
+        print('UNKNOWN: {0} {1}'.format(host, err))
+        sys.exit(3)
+
+
+def make_engine(community, address, usm_cache=None, timeout=TIMEOUT):
+    """
+    Return a pysnmp SNMP engine configured to query one agent, leaving
+    retries to HedgedRequests
+
+    :param community: SNMP community password for host, or V3Credentials
+    :param address: IP address and port of the agent
+    :param usm_cache: SNMPv3 keys and engine details from load_usm_cache()
+    :param timeout: seconds pysnmp waits for a response to any one copy
+    """
+    from pysnmp.entity import engine, config
+    from pysnmp.carrier.asyncore.dgram import udp
+
+    snmp_engine = engine.SnmpEngine()
+    if isinstance(community, V3Credentials):
+        add_v3_user(snmp_engine, community, address, usm_cache)
+    else:
+        config.addV1System(snmp_engine, 'nagios-area', community)
+        config.addTargetParams(snmp_engine, 'nagios-params', 'nagios-area', 'noAuthNoPriv', 1)
+    config.addTransport(snmp_engine, udp.domainName,
+                        udp.UdpSocketTransport().openClientMode())
+    config.addTargetAddr(snmp_engine, 'nagios-target', udp.domainName, address,
+                         'nagios-params', timeout=int(timeout * 100), retryCount=0)
+    return snmp_engine
+
+
+def v3_protocols(creds):
+    """
+    Return the pysnmp auth protocol, priv protocol and security level for a
+    set of SNMPv3 credentials
+
+    :param creds: V3Credentials
+    """
+    from pysnmp.entity import config
+
+    auth_protocol = config.usmNoAuthProtocol
+    priv_protocol = config.usmNoPrivProtocol
+    level = 'noAuthNoPriv'
+    if creds.auth_pass:
+        auth_protocol = getattr(config, AUTH_PROTOCOLS[creds.auth_protocol])
+        level = 'authNoPriv'
+        if creds.priv_pass:
+            priv_protocol = getattr(config, PRIV_PROTOCOLS[creds.priv_protocol])
+            level = 'authPriv'
+    return auth_protocol, priv_protocol, level
+
+
+def add_v3_user(snmp_engine, creds, address, usm_cache):
+    """
+    Configure an SNMP engine for an SNMPv3 user, using cached localized keys
+    and agent engine details when available so no key derivation or engine
+    discovery is needed
+
+    :param snmp_engine: pysnmp SNMP engine
+    :param creds: V3Credentials
+    :param address: IP address and port of the agent
+    :param usm_cache: SNMPv3 keys and engine details from load_usm_cache()
+    """
+    from pysnmp.entity import config
+    from pysnmp.carrier.asyncore.dgram import udp
+    from pysnmp.proto import rfc1902
+
+    auth_protocol, priv_protocol, level = v3_protocols(creds)
+    config.addTargetParams(snmp_engine, 'nagios-params', creds.user, level, 3)
+
+    if not usm_cache:
+        config.addV3User(snmp_engine, creds.user, auth_protocol, creds.auth_pass,
+                         priv_protocol, creds.priv_pass)
+        return
+
+    engine_id = rfc1902.OctetString(hexValue=usm_cache['engine_id'])
+    config.addV3User(snmp_engine, creds.user,
+                     auth_protocol, rfc1902.OctetString(hexValue=usm_cache['auth_key']),
+                     priv_protocol, rfc1902.OctetString(hexValue=usm_cache['priv_key']),
+                     securityEngineId=engine_id,
+                     authKeyType=config.usmKeyTypeLocalized,
+                     privKeyType=config.usmKeyTypeLocalized)
+
+    # Seed pysnmp's engine ID and time caches; these are private to pysnmp so
+    # without them the request just falls back to discovery
+    engine_ids = getattr(snmp_engine.messageProcessingSubsystems.get(3),
+                         '_SnmpV3MessageProcessingModel__engineIdCache', None)
+    timeline = getattr(snmp_engine.securityModels.get(3),
+                       '_SnmpUSMSecurityModel__timeline', None)
+    if engine_ids is not None:
+        engine_ids[(udp.domainName, address)] = {
+            'securityEngineId': engine_id,
+            'contextEngineId': engine_id,
+            'contextName': rfc1902.OctetString(''),
+        }
+    if timeline is not None and usm_cache.get('boots') is not None:
+        engine_time = usm_cache['time'] + int(time.time()) - usm_cache['updated']
+        timeline[engine_id] = (rfc1902.Integer(usm_cache['boots']),
+                               rfc1902.Integer(engine_time),
+                               rfc1902.Integer(engine_time), int(time.time()))
+
+
+def usm_fingerprint(creds):
+    """
+    Return a digest of SNMPv3 credentials, so cached keys are discarded when
+    any of them change without storing the passwords
+
+    :param creds: V3Credentials
+    """
+    return hashlib.sha256('\0'.join(str(i) for i in creds).encode('utf-8')).hexdigest()
+
+
+def load_usm_cache(creds, host, port):
+    """
+    Return the cached SNMPv3 keys and engine details for a host, or None
+
+    :param creds: V3Credentials
+    :param host: hostname or IP of host
+    :param port: SNMP port of host
+    """
+    cached = read_state(state_path('snmpv3', '{0}_{1}'.format(host, port), 'usm'))
+    try:
+        usm_cache = json.loads(cached.decode('utf-8'))
+    except (AttributeError, ValueError):
+        return None
+    if usm_cache.get('fingerprint') != usm_fingerprint(creds):
+        return None
+    return usm_cache
+
+
+def save_usm_cache(snmp_engine, creds, host, port, address, usm_cache):
+    """
+    Store the localized keys and agent engine details learned by an SNMP
+    engine for the next run
+
+    :param snmp_engine: pysnmp SNMP engine that completed a request
+    :param creds: V3Credentials
+    :param host: hostname or IP of host
+    :param port: SNMP port of host
+    :param address: IP address and port of the agent
+    :param usm_cache: SNMPv3 keys and engine details the request was made with
+    """
+    from pysnmp.entity import config
+    from pysnmp.carrier.asyncore.dgram import udp
+
+    engine_ids = getattr(snmp_engine.messageProcessingSubsystems.get(3),
+                         '_SnmpV3MessageProcessingModel__engineIdCache', {})
+    timeline = getattr(snmp_engine.securityModels.get(3),
+                       '_SnmpUSMSecurityModel__timeline', {})
+    peer = engine_ids.get((udp.domainName, address))
+    if not peer:
+        return
+    engine_id = peer['securityEngineId']
+
+    if usm_cache and usm_cache['engine_id'] == engine_id.asOctets().hex():
+        auth_key, priv_key = usm_cache['auth_key'], usm_cache['priv_key']
+    else:
+        auth_protocol, priv_protocol, _ = v3_protocols(creds)
+        auth_service = config.authServices[auth_protocol]
+        priv_service = config.privServices[priv_protocol]
+        auth_key = priv_key = ''
+        if creds.auth_pass:
+            auth_key = auth_service.localizeKey(
+                auth_service.hashPassphrase(creds.auth_pass), engine_id).asOctets().hex()
+        if creds.priv_pass:
+            priv_key = priv_service.localizeKey(
+                auth_protocol, priv_service.hashPassphrase(auth_protocol, creds.priv_pass),
+                engine_id).asOctets().hex()
+
+    usm_cache = {
+        'fingerprint': usm_fingerprint(creds),
+        'engine_id': engine_id.asOctets().hex(),
+        'auth_key': auth_key,
+        'priv_key': priv_key,
+        'boots': None,
+    }
+    if engine_id in timeline:
+        boots, engine_time, _, updated = timeline[engine_id]
+        usm_cache.update(boots=int(boots), time=int(engine_time), updated=int(updated))
+    write_state(state_path('snmpv3', '{0}_{1}'.format(host, port), 'usm'),
+                json.dumps(usm_cache).encode('utf-8'))
+
+
+def add_v3_arguments(parser):
+    """
+    Add the SNMPv3 command line arguments to a plugin's argument parser
+
+    :param parser: argparse.ArgumentParser of the plugin
+    """
+    user_help = 'Optional: SNMPv3 user, used instead of a community'
+    authpass_help = 'Optional: SNMPv3 authentication password'
+    privpass_help = 'Optional: SNMPv3 privacy password'
+    authproto_help = 'Optional: SNMPv3 authentication protocol, defaults to SHA'
+    privproto_help = 'Optional: SNMPv3 privacy protocol, defaults to AES'
+
+    parser.add_argument('-U', '--user', help=user_help, required=False)
+    parser.add_argument('-A', '--authpass', help=authpass_help, required=False)
+    parser.add_argument('-X', '--privpass', help=privpass_help, required=False)
+    parser.add_argument('--authproto', help=authproto_help, default='SHA',
+                        choices=sorted(AUTH_PROTOCOLS))
+    parser.add_argument('--privproto', help=privproto_help, default='AES',
+                        choices=sorted(PRIV_PROTOCOLS))
+
+
+def snmp_auth(args):
+    """
+    Return SNMPv3 credentials when a user was given on the command line,
+    otherwise the community
+
+    :param args: parsed command line arguments
+    """
+    if args.user:
+        return V3Credentials(args.user, args.authproto, args.authpass,
+                             args.privproto, args.privpass)
+    if args.community:
+        return args.community
+    print('UNKNOWN: either a community (-C) or an SNMPv3 user (-U) is required')
+    sys.exit(3)
+
+
+def date_and_time(value):
+    """
+    Return a DateAndTime octet string formatted with its MIB display hint,
+    i.e. 2017-5-26,13:30:15.0,+2:0
+
+    :param value: DateAndTime value of 8 or 11 octets
+    """
+    octets = bytearray(value.asOctets())
+    text = '{0}-{1}-{2},{3}:{4}:{5}.{6}'.format(
+        octets[0] << 8 | octets[1], *octets[2:8])
+    if len(octets) >= 11:
+        text += ',{0}{1}:{2}'.format(chr(octets[8]), octets[9], octets[10])
+    return text
@@ -0,0 +1,100 @@
+"""Small on-disk state shared between plugin runs"""
+
+# State lives under /var/tmp/nagios-plugins-python by default, which survives
+# reboots on most systems. Set NAGIOS_PLUGIN_STATE_DIR to move it. While
+# recording probe responses the contents of every state file read are
+# recorded too, and while replaying them state is read from the capture and
+# written to a throwaway directory, so replays never touch live state.
+
+#  standard library imports
+import mmap
+import os
+import re
+import threading
+
+# local application imports
+from nagioslib import capture
+
+
+STATE_DIR = os.environ.get('NAGIOS_PLUGIN_STATE_DIR',
+                           '/var/tmp/nagios-plugins-python')
+
+# Throwaway state directory used while replaying, created on first use
+_replay_dir = [None]
+_replay_dir_lock = threading.Lock()
+
+
+def state_path(plugin, host, suffix='state'):
+    """
+    Return the path of a plugin's state file for a host
+
+    :param plugin: name of the plugin owning the state
+    :param host: hostname or IP the state belongs to
+    :param suffix: file extension, to keep several kinds of state per host
+    """
+    safe_host = re.sub(r'[^A-Za-z0-9_.-]', '_', str(host))
+    return os.path.join(state_dir(), '{0}_{1}.{2}'.format(plugin, safe_host, suffix))
+
+
+def state_dir():
+    """
+    Return the state directory, or a throwaway one removed at exit while
+    replaying
+    """
+    if not capture.replaying():
+        return STATE_DIR
+    with _replay_dir_lock:
+        if _replay_dir[0] is None:
+            import atexit
+            import shutil
+            import tempfile
+            _replay_dir[0] = tempfile.mkdtemp(prefix='nagios-plugins-replay-')
+            atexit.register(shutil.rmtree, _replay_dir[0], True)
+        return _replay_dir[0]
+
+
+def read_state(path):
+    """
+    Return the contents of a state file by memory-mapping it, or None if the
+    file does not exist or is empty; while replaying, return the contents
+    recorded for it if the capture holds any
+
+    :param path: path of the state file
+    """
+    if capture.replaying():
+        data = capture.replay_state(os.path.basename(path))
+        if data is not None:
+            return data or None
+    try:
+        with open(path, 'rb') as state:
+            state_map = mmap.mmap(state.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        data = None
+    else:
+        try:
+            data = state_map[:]
+        finally:
+            state_map.close()
+    if capture.RECORD_PATH is not None:
+        capture.record('state', os.path.basename(path), data or b'')
+    return data
+
+
+def write_state(path, data):
+    """
+    Atomically replace a state file so concurrent readers never see a partial
+    write
+
+    :param path: path of the state file
+    :param data: bytes to write
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+    os.rename(tmp_path, path)
@@ -0,0 +1,192 @@
+"""TLS contexts and sessions shared by the checks run in one process"""
+
+# A plugin run on its own by Nagios builds a TLS context and does a full
+# handshake, which is what it should do. Run from batch.py, collector.py or
+# exporter.py, the same certificates are checked over and over from one
+# process, and building the context, loading the CA store and the full
+# handshakes dominate the CPU of the poller and of the servers checked. Here
+# one SSLContext is kept per verification profile and library, the session of
+# each host:port is kept to resume the next connection to it, and
+# check_response_code gets one pooled requests Session whose connections are
+# kept alive between checks. urllib3 and httpx set the verification mode,
+# CA certificates and ALPN protocols of the contexts they are given, so each
+# library gets a context of its own and never touches the one check_ssl
+# resumes sessions with.
+#
+# TLS 1.3 servers send their session tickets only after the handshake. Once
+# a long-lived runner has called enable_reuse(), the connection waits about a
+# handshake's time for one after a full handshake, unless the host:port sent
+# none last time. A plugin run on its own would never resume the session, so
+# it does not wait.
+#
+# A resumed session is not verified again, so every TLS_VERIFY_INTERVAL
+# seconds a host:port gets a full handshake with certificate verification and
+# the requests Session is replaced. Set NAGIOS_PLUGIN_TLS_VERIFY_INTERVAL to
+# change it; 0 verifies every connection in full.
+
+#  standard library imports
+import os
+import socket
+import threading
+import time
+
+
+TLS_VERIFY_INTERVAL = float(os.environ.get('NAGIOS_PLUGIN_TLS_VERIFY_INTERVAL', 3600))
+
+# Verification profiles: VERIFY checks the chain and hostname, NO_VERIFY
+# accepts any certificate
+VERIFY = 'verify'
+NO_VERIFY = 'no-verify'
+
+_lock = threading.Lock()
+_contexts = {}
+_sessions = {}
+_ticketless = set()
+_http = [None, 0.0]
+_reuse = [False]
+
+
+def enable_reuse():
+    """
+    Wait for the session tickets of TLS 1.3 servers, for runners that check
+    the same hosts again from one process
+    """
+    _reuse[0] = True
+
+
+def tls_context(profile=VERIFY, owner='ssl'):
+    """
+    Return the SSLContext of a verification profile for one library, created
+    on first use
+
+    :param profile: VERIFY or NO_VERIFY
+    :param owner: library the context is handed to, i.e. ssl, urllib3 or
+                  httpx, which may change it
+    """
+    with _lock:
+        context = _contexts.get((profile, owner))
+        if context is None:
+            import ssl
+
+            context = ssl.create_default_context()
+            if profile == NO_VERIFY:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            _contexts[(profile, owner)] = context
+        return context
+
+
+def cached_session(key):
+    """
+    Return the TLS session to resume a connection with, or None if there is
+    none or the host:port is due a full verification
+
+    :param key: host:port and profile the session was made with
+    """
+    with _lock:
+        session, verified = _sessions.get(key, (None, 0.0))
+    if time.time() - verified >= TLS_VERIFY_INTERVAL:
+        return None
+    return session
+
+
+def store_session(key, session, verified):
+    """
+    Keep the session of a connection to resume the next one with
+
+    :param key: host:port and profile the session was made with
+    :param session: ssl.SSLSession of the connection, may be None
+    :param verified: time the host:port was last verified in full
+    """
+    if session is None:
+        return
+    with _lock:
+        _sessions[key] = (session, verified)
+
+
+def tls_peer_certificate(host, port, timeout, profile=VERIFY):
+    """
+    Connect to host:port over TLS and return the peer certificate as
+    ssl.SSLSocket.getpeercert() does, resuming the session of an earlier
+    connection while it is not due a full verification
+
+    :param host: hostname to connect to
+    :param port: TLS port of host
+    :param timeout: timeout in seconds for the connection
+    :param profile: VERIFY or NO_VERIFY
+    """
+    key = '{0}:{1} {2}'.format(host, port, profile)
+    session = cached_session(key)
+    ssl_sock = tls_context(profile).wrap_socket(socket.socket(), server_hostname=host,
+                                                session=session)
+    try:
+        ssl_sock.settimeout(timeout)
+        started = time.time()
+        ssl_sock.connect((host, port))
+        cert = ssl_sock.getpeercert()
+        if ssl_sock.session_reused:
+            with _lock:
+                verified = _sessions.get(key, (None, 0.0))[1]
+        else:
+            verified = time.time()
+            with _lock:
+                wait = _reuse[0] and key not in _ticketless
+            if wait and ssl_sock.version() == 'TLSv1.3':
+                wait_for_ticket(ssl_sock, min(timeout, max(0.05, verified - started)))
+                if not ssl_sock.session.has_ticket:
+                    with _lock:
+                        _ticketless.add(key)
+        store_session(key, ssl_sock.session, verified)
+    finally:
+        ssl_sock.close()
+    return cert
+
+
+def wait_for_ticket(ssl_sock, wait):
+    """
+    Read what a TLS 1.3 server sends after the handshake for up to wait
+    seconds, so the session ticket in it is processed
+
+    :param ssl_sock: connected ssl.SSLSocket
+    :param wait: most seconds to wait
+    """
+    import ssl
+
+    ssl_sock.settimeout(wait)
+    try:
+        ssl_sock.recv(1)
+    except (socket.timeout, ssl.SSLError, socket.error):
+        pass
+
+
+def http_session():
+    """
+    Return the requests Session shared by the checks of this process, with
+    the VERIFY context of urllib3 and connections kept alive, replaced every
+    TLS_VERIFY_INTERVAL so connections are verified in full again, closing
+    the connections of the one it replaces
+    """
+    with _lock:
+        if _http[0] is not None and time.time() - _http[1] < TLS_VERIFY_INTERVAL:
+            return _http[0]
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class ContextAdapter(HTTPAdapter):
+        """HTTPAdapter using the shared VERIFY context of urllib3"""
+        def init_poolmanager(self, *args, **kwargs):
+            kwargs['ssl_context'] = tls_context(VERIFY, 'urllib3')
+            return super(ContextAdapter, self).init_poolmanager(*args, **kwargs)
+
+    session = requests.Session()
+    session.mount('https://', ContextAdapter())
+    with _lock:
+        if _http[0] is not None and time.time() - _http[1] < TLS_VERIFY_INTERVAL:
+            # another thread replaced it first, use that one instead
+            session, stale = _http[0], session
+        else:
+            stale = _http[0]
+            _http[0], _http[1] = session, time.time()
+        if stale is not None:
+            stale.close()
+    return session
@@ -0,0 +1,116 @@
+"""Worker processes for the CPU-bound checks of batch runs"""
+
+# batch.py runs its checks in threads of one process, which is cheap while
+# the checks wait on the network but holds every check to a single core once
+# they parse: TLS handshakes and certificates, SNMPv3 key localization and
+# encryption, and the regular expressions of ping, banner and process table
+# parsing all hold the GIL. With --processes, batch.py hands the checks of
+# those plugins to a pool of worker processes through a ProcessCall, while
+# scheduling, rate limits and output stay in the parent. Only the plugin name
+# and its arguments go to a worker and only the exit code and output come
+# back, so little is pickled either way.
+
+from __future__ import print_function
+
+#  standard library imports
+import importlib
+import multiprocessing
+import sys
+
+# local application imports
+from nagioslib.output import ThreadOutput, run_captured
+from nagioslib.ratelimit import limit_snmp
+from nagioslib.tls import enable_reuse
+
+
+# Plugins whose checks are offloaded whatever their arguments
+OFFLOAD_PLUGINS = ('check_ping', 'check_procs', 'check_ssh', 'check_ssl')
+
+# ThreadOutput of a worker process, installed by init_worker()
+WORKER_OUTPUT = None
+
+
+def offloaded(plugin, argv):
+    """
+    Return True if a check is CPU-bound enough to run in a worker process,
+    i.e. it parses ping output, banners, process tables or certificates, or
+    uses SNMPv3
+
+    :param plugin: plugin name
+    :param argv: plugin arguments
+    """
+    return plugin in OFFLOAD_PLUGINS or '-U' in argv or '--user' in argv
+
+
+def init_worker(snmp_rate, snmp_burst):
+    """
+    Prepare a worker process to run checks
+
+    :param snmp_rate: SNMP requests per second the worker may send to one agent
+    :param snmp_burst: SNMP requests the worker may send at once to one agent
+    """
+    global WORKER_OUTPUT # pylint: disable=I0011,W0603
+    WORKER_OUTPUT = ThreadOutput(sys.stderr)
+    sys.stdout, sys.stderr = WORKER_OUTPUT, WORKER_OUTPUT
+    limit_snmp(snmp_rate, snmp_burst)
+    enable_reuse()
+
+
+def run_in_worker(plugin, argv):
+    """
+    Run a plugin in a worker process and return its exit code and output
+
+    :param plugin: plugin name
+    :param argv: plugin arguments
+    """
+    module = importlib.import_module(plugin)
+    code, text, _ = run_captured(WORKER_OUTPUT, module.main, argv)
+    return code, text
+
+
+class ProcessCall(object):
+    """
+    Runs offloaded checks in a pool of worker processes and the others with
+    call, as the call of batch.run_batch()
+
+    A check against one agent may run in as many workers at once as
+    host_inflight allows, so each worker gets that share of the SNMP rate.
+
+    :param processes: worker processes
+    :param call: function called with the plugin module and the Check to run
+                 the checks that are not offloaded
+    :param host_inflight: most checks running at once against one host
+    :param snmp_rate: SNMP requests per second allowed per agent
+    :param snmp_burst: SNMP requests allowed at once per agent
+    """
+    def __init__(self, processes, call, host_inflight, snmp_rate, snmp_burst):
+        from concurrent.futures import ProcessPoolExecutor
+
+        share = float(max(1, min(processes, host_inflight)))
+        # Workers are not forked from the threads already running checks
+        context = None
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+        self.call = call
+        self.pool = ProcessPoolExecutor(
+            processes, context, init_worker,
+            (snmp_rate / share, max(1.0, snmp_burst / share)))
+
+    def __call__(self, module, check):
+        """
+        Run a check, in a worker process if it is offloaded, printing its
+        output and exiting with its exit code
+
+        :param module: plugin module
+        :param check: Check to run
+        """
+        if not offloaded(check.plugin, check.argv):
+            return self.call(module, check)
+        code, text = self.pool.submit(run_in_worker, check.plugin, check.argv).result()
+        print(text)
+        if code:
+            sys.exit(code)
+
+    def close(self):
+        """Stop the worker processes"""
+        self.pool.shutdown()
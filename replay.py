@@ -0,0 +1,82 @@
+#!/usr/bin/python
+
+"""Replay recorded probe responses through the plugins' parsing and thresholds"""
+
+# Runs checks in this process against a capture file recorded with
+# NAGIOS_PLUGIN_RECORD instead of probing the hosts, and prints each result
+# in the external command format batch.py writes. Checks are listed one per
+# line in the format batch.py reads and must match the recorded ones, since
+# responses are looked up by host, port and what was probed for.
+#
+# Example, recording a production run and replaying it later:
+#
+#   NAGIOS_PLUGIN_RECORD=/tmp/incident.cap ./batch.py -f checks.txt -o nagios.cmd
+#   ./replay.py -r /tmp/incident.cap -f checks.txt
+#
+# With --repeat the checks are replayed that many times over and the rate
+# reported on stderr, to benchmark the parsing and threshold code without
+# the network in the way.
+#
+
+from __future__ import print_function
+
+#  standard library imports
+import sys
+import time
+
+# local application imports
+from batch import read_checks, run_check
+from nagioslib.capture import use_replay
+from nagioslib.output import thread_output
+
+
+def do_argparser(argv=None):
+    """
+    Parse and return command line arguments
+
+    :param argv: arguments to parse instead of sys.argv
+    """
+    import argparse
+
+    replay_help = 'Capture file recorded with NAGIOS_PLUGIN_RECORD'
+    file_help = 'Optional: file of checks, one per line, defaults to stdin'
+    repeat_help = 'Optional: times to replay the checks and report the rate, defaults to 1'
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--replay', help=replay_help, required=True)
+    parser.add_argument('-f', '--file', help=file_help, required=False)
+    parser.add_argument('-n', '--repeat', help=repeat_help, type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Main function
+
+    :param argv: command line arguments to use instead of sys.argv
+    """
+    args = do_argparser(argv)
+
+    source = open(args.file) if args.file else sys.stdin
+    with source:
+        checks = list(read_checks(source))
+
+    use_replay(args.replay)
+    stdout = sys.stdout
+    with thread_output() as output:
+        started = time.time()
+        for check in checks:
+            stdout.write(run_check(check, output).command())
+        for _ in range(args.repeat - 1):
+            for check in checks:
+                run_check(check, output)
+        elapsed = time.time() - started
+
+    if args.repeat > 1:
+        count = len(checks) * args.repeat
+        print('{0} checks replayed in {1:.2f}s, {2:.0f} checks/sec'.format(
+            count, elapsed, count / elapsed if elapsed else 0), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""Importing a plugin must not pull in its heavy dependencies"""
+
+# Each plugin is imported in a fresh interpreter, as Nagios runs it, so the
+# modules other plugins or this test already imported do not hide a heavy
+# import. Timings are left to benchmark.py --imports, which is not flaky on
+# a loaded machine the way a timing assertion here would be.
+
+#  standard library imports
+import json
+import os
+import subprocess
+import sys
+
+# related third party imports
+import pytest
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+
+# local application imports
+from benchmark import HEAVY_MODULES, IMPORT_PROBE, PLUGINS
+
+
+MODULES = sorted(set(plugin.split(':')[0] for plugin, _ in PLUGINS)) + ['multicall']
+
+
+@pytest.mark.parametrize('module', MODULES)
+def test_no_heavy_imports(module):
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_PROBE, module], cwd=HERE)
+    imported = json.loads(output.decode())['modules']
+    heavy = sorted(mod for mod in imported if mod.split('.')[0] in HEAVY_MODULES)
+    assert heavy == []